@@ -0,0 +1,108 @@
+from recurrence import DAY
+from schema import write_transaction
+from timeutil import now_minutes
+
+# Reservations that ended more than this many days ago leave the hot table.
+ARCHIVE_AFTER_DAYS = 30
+# Rows moved per write transaction, so the write lock is only held briefly.
+BATCH_SIZE = 2000
+# Change log entries kept behind the newest one. Running readers sync every
+# few seconds and stay far closer to the head than this; one that falls
+# further behind loads its rooms again instead of reading the delta.
+CHANGE_LOG_KEEP = 100000
+PRUNE_BATCH_SIZE = 50000
+
+COLUMNS = 'id, room_id, start_minute, end_minute, teacher_name, student_name, purpose, priority'
+
+
+# The hot `reservations` table holds only current and recent bookings; it is
+# what sync, conflict checks, availability and the status tick read, so their
+# cost does not grow with years of history. Older rows move to
+# `reservations_archive` with their ids. History listings and exports read
+# the `reservation_history` view, which is both tables together.
+
+def cutoff_minute(days=ARCHIVE_AFTER_DAYS, minute=None):
+    minute = now_minutes() if minute is None else minute
+    return minute // DAY * DAY - days * DAY
+
+
+def history_source(include_archived):
+    # Queries select from this under the alias `reservations`.
+    return 'reservation_history' if include_archived else 'reservations'
+
+
+def _move_batch(cursor, before_minute, batch_size):
+    # start_minute <= end_minute, so the start index narrows the scan.
+    cursor.execute('''
+        SELECT id FROM reservations WHERE start_minute < ? AND end_minute < ?
+        ORDER BY start_minute LIMIT ?
+    ''', (before_minute, before_minute, batch_size))
+    ids = [(row[0],) for row in cursor.fetchall()]
+    cursor.executemany(f'INSERT OR REPLACE INTO reservations_archive ({COLUMNS}) '
+                       f'SELECT {COLUMNS} FROM reservations WHERE id = ?', ids)
+    # Logged as deletes, so running instances drop them from memory too.
+    cursor.executemany('DELETE FROM reservations WHERE id = ?', ids)
+    return len(ids)
+
+
+def archive_batch(conn, before_minute, batch_size=BATCH_SIZE):
+    """Move up to batch_size reservations that ended before before_minute; returns how many moved."""
+    return write_transaction(conn, _move_batch, before_minute, batch_size)
+
+
+def archive(conn, before_minute, batch_size=BATCH_SIZE):
+    total = 0
+    while True:
+        moved = archive_batch(conn, before_minute, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
+
+
+def _prune_batch(cursor, keep, batch_size):
+    cursor.execute('SELECT MIN(seq), MAX(seq) FROM reservation_changes')
+    first, last = cursor.fetchone()
+    if first is None or last - keep < first:
+        return 0
+    # The newest entry always stays, so readers can tell a trimmed log from an empty one.
+    cursor.execute('DELETE FROM reservation_changes WHERE seq <= ?', (min(last - keep, first + batch_size - 1),))
+    return cursor.rowcount
+
+
+def prune_batch(conn, keep=CHANGE_LOG_KEEP, batch_size=PRUNE_BATCH_SIZE):
+    """Trim up to batch_size of the oldest change log entries beyond the newest `keep`; returns how many."""
+    return write_transaction(conn, _prune_batch, keep, batch_size)
+
+
+def prune(conn, keep=CHANGE_LOG_KEEP, batch_size=PRUNE_BATCH_SIZE):
+    total = 0
+    while True:
+        pruned = prune_batch(conn, keep, batch_size)
+        total += pruned
+        if pruned < batch_size:
+            return total
+
+
+def counts(conn):
+    return conn.execute('''
+        SELECT (SELECT COUNT(*) FROM reservations), (SELECT COUNT(*) FROM reservations_archive)
+    ''').fetchone()
+
+
+def build_parser(subparsers, common):
+    archive_parser = subparsers.add_parser('archive', parents=[common],
+                                           help='move old reservations out of the hot table')
+    archive_parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                                help=f"archive reservations that ended more than this many days ago "
+                                     f"(default {ARCHIVE_AFTER_DAYS})")
+    archive_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    archive_parser.set_defaults(handler=run_archive)
+
+
+def run_archive(conn, args):
+    moved = archive(conn, cutoff_minute(args.days), args.batch_size)
+    pruned = prune(conn)
+    hot, archived = counts(conn)
+    print(f"Archived {moved} reservations; {hot} remain current, {archived} archived. "
+          f"Trimmed {pruned} change log entries.")
+    return 0
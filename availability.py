@@ -0,0 +1,277 @@
+import numpy as np
+
+import schema
+from features import FeatureCatalog, room_masks
+from recurrence import DAY, SERIES_COLUMNS, occurrences, series_from_row
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = DAY // SLOT_MINUTES
+
+# Days built, and searched, per step; bounds the unpacked working matrix.
+DAYS_PER_BUILD = 14
+
+
+def _day_runs(days):
+    # Split sorted days into runs of consecutive days no longer than DAYS_PER_BUILD.
+    run = []
+    for day in days:
+        if run and (day != run[-1] + 1 or len(run) == DAYS_PER_BUILD):
+            yield run
+            run = []
+        run.append(day)
+    if run:
+        yield run
+
+
+class AvailabilityIndex:
+    """Bit matrix of busy time slots per day, rooms by 15-minute slots.
+
+    Days are built on first use with one range query and kept packed
+    (12 bytes per room-day), so a year of 5,000 rooms is about 22 MB. A
+    search unpacks a couple of weeks at a time into a rooms x slots boolean
+    matrix, finds free windows with a cumulative sum along the time axis,
+    and stops as soon as the best `limit` rooms are known.
+    `refresh` re-reads only the rooms named in the reservation change log.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.days = {}
+        self.watermark = None
+        self.rooms_signature = None
+        self.load_rooms()
+
+    def load_rooms(self):
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT rooms.id, rooms.name, rooms.building_id, buildings.name, rooms.floor, rooms.capacity
+            FROM rooms LEFT JOIN buildings ON rooms.building_id = buildings.id
+            ORDER BY rooms.id
+        ''')
+        rows = cursor.fetchall()
+        self.room_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.room_names = [row[1] for row in rows]
+        self.building_ids = np.array([row[2] if row[2] is not None else -1 for row in rows], dtype=np.int64)
+        self.building_names = [row[3] for row in rows]
+        self.capacities = np.array([row[5] or 0 for row in rows], dtype=np.int64)
+        # Python ints in an object array, so masks are not limited to 64 features.
+        masks = room_masks(cursor)
+        self.feature_masks = np.array([masks.get(row[0], 0) for row in rows], dtype=object)
+        self.catalog = FeatureCatalog(self.conn)
+        self.row_of = {room_id: i for i, room_id in enumerate(self.room_ids.tolist())}
+        self.rooms_signature = self._rooms_signature(cursor)
+        self.days.clear()
+        self.watermark = self._current_seq(cursor)
+        cursor.execute('SELECT COALESCE(MAX(end_minute - start_minute), 0) FROM reservations')
+        self.longest = cursor.fetchone()[0]
+
+    def _rooms_signature(self, cursor):
+        cursor.execute('''
+            SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(SUM(capacity), 0), (SELECT COUNT(*) FROM room_features)
+            FROM rooms
+        ''')
+        return cursor.fetchone()
+
+    def _current_seq(self, cursor):
+        cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM reservation_changes')
+        return cursor.fetchone()[0]
+
+    def _busy_rows(self, first_day, last_day, room_ids=None):
+        # Busy slots of days [first_day, last_day] for all rooms, or for
+        # `room_ids` in that order, marked through a difference array so no
+        # Python loop touches individual slots.
+        span_start = first_day * DAY
+        span_end = (last_day + 1) * DAY
+        if room_ids is None:
+            row_of = self.row_of
+            room_filter = ''
+            room_params = []
+        else:
+            row_of = {room_id: i for i, room_id in enumerate(room_ids)}
+            room_filter = f"AND room_id IN ({','.join('?' * len(room_ids))})"
+            room_params = list(room_ids)
+
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT room_id, start_minute, end_minute FROM reservations
+            WHERE start_minute >= ? AND start_minute < ? AND end_minute > ? {room_filter}
+        ''', [span_start - self.longest, span_end, span_start] + room_params)
+        intervals = cursor.fetchall()
+
+        cursor.execute(f'''
+            SELECT {", ".join(SERIES_COLUMNS)} FROM reservation_series WHERE start_minute < ? {room_filter}
+        ''', [span_end] + room_params)
+        series_rows = cursor.fetchall()
+        if series_rows:
+            exceptions = {}
+            cursor.execute(f'''
+                SELECT series_id, occurrence_start FROM series_exceptions
+                WHERE series_id IN ({','.join('?' * len(series_rows))})
+            ''', [row[0] for row in series_rows])
+            for series_id, start in cursor.fetchall():
+                exceptions.setdefault(series_id, []).append(start)
+            for row in series_rows:
+                series = series_from_row(row, exceptions.get(row[0], ()))
+                intervals.extend((series['room_id'], start, start + series['duration'])
+                                 for start in occurrences(series, span_start, span_end))
+
+        slots = (last_day - first_day + 1) * SLOTS_PER_DAY
+        diff = np.zeros((len(row_of), slots + 1), dtype=np.int32)
+        intervals = [interval for interval in intervals if interval[0] in row_of]
+        if intervals:
+            data = np.array(intervals, dtype=np.int64)
+            rows = np.array([row_of[room_id] for room_id in data[:, 0].tolist()], dtype=np.int64)
+            first = np.clip((data[:, 1] - span_start) // SLOT_MINUTES, 0, slots)
+            last = np.clip(-((span_start - data[:, 2]) // SLOT_MINUTES), 0, slots)
+            np.add.at(diff, (rows, first), 1)
+            np.add.at(diff, (rows, last), -1)
+        return np.cumsum(diff, axis=1, dtype=np.int32)[:, :slots] > 0
+
+    def _ensure_days(self, first_day, last_day):
+        missing = [day for day in range(first_day, last_day + 1) if day not in self.days]
+        for run in _day_runs(missing):
+            busy = self._busy_rows(run[0], run[-1])
+            for day in run:
+                offset = (day - run[0]) * SLOTS_PER_DAY
+                self.days[day] = np.packbits(busy[:, offset:offset + SLOTS_PER_DAY], axis=1)
+
+    def refresh(self):
+        cursor = self.conn.cursor()
+        if self._rooms_signature(cursor) != self.rooms_signature:
+            self.load_rooms()
+            return
+        cursor.execute('SELECT MAX(seq) FROM reservation_changes WHERE seq > ?', (self.watermark,))
+        latest = cursor.fetchone()[0]
+        if latest is None:
+            return
+        cursor.execute('SELECT DISTINCT room_id FROM reservation_changes WHERE seq > ? AND seq <= ?',
+                       (self.watermark, latest))
+        changed = [room_id for (room_id,) in cursor.fetchall() if room_id in self.row_of]
+        cursor.execute('SELECT MIN(seq) FROM reservation_changes')
+        if cursor.fetchone()[0] > self.watermark + 1:
+            # Entries past the watermark were trimmed; what they touched is unknown.
+            self.load_rooms()
+            return
+        self.watermark = latest
+        if changed:
+            cursor.execute(f'''
+                SELECT COALESCE(MAX(end_minute - start_minute), 0) FROM reservations
+                WHERE room_id IN ({','.join('?' * len(changed))})
+            ''', changed)
+            self.longest = max(self.longest, cursor.fetchone()[0])
+            self.update_rooms(changed)
+
+    def update_rooms(self, room_ids):
+        # Recompute the given rooms' rows in every loaded day.
+        rows = [self.row_of[room_id] for room_id in room_ids]
+        for run in _day_runs(sorted(self.days)):
+            busy = self._busy_rows(run[0], run[-1], room_ids)
+            for day in run:
+                offset = (day - run[0]) * SLOTS_PER_DAY
+                self.days[day][rows] = np.packbits(busy[:, offset:offset + SLOTS_PER_DAY], axis=1)
+
+    def _earliest_windows(self, rows, first_slot, last_slot, needed, limit):
+        # (rows, first slot of each row's earliest run of `needed` free slots)
+        # for the rows that have one. Days are unpacked DAYS_PER_BUILD at a
+        # time; each still-pending row carries the length of the free run it
+        # ended the previous chunk with, so runs may cross chunk boundaries.
+        # Results rank by capacity, then start, so the scan stops once
+        # `limit` rows are found that no pending row, all of whose windows
+        # start later, can outrank.
+        earliest = np.full(len(rows), -1, dtype=np.int64)
+        pending = np.arange(len(rows))
+        carry = np.zeros(len(rows), dtype=np.int64)
+        first_day = first_slot // SLOTS_PER_DAY
+        last_day = (last_slot - 1) // SLOTS_PER_DAY
+        for chunk_start in range(first_day, last_day + 1, DAYS_PER_BUILD):
+            chunk_end = min(chunk_start + DAYS_PER_BUILD - 1, last_day)
+            self._ensure_days(chunk_start, chunk_end)
+            busy = np.concatenate([np.unpackbits(self.days[day][rows[pending]], axis=1, count=SLOTS_PER_DAY)
+                                   for day in range(chunk_start, chunk_end + 1)], axis=1)
+            chunk_first = max(first_slot, chunk_start * SLOTS_PER_DAY)
+            offset = chunk_first - chunk_start * SLOTS_PER_DAY
+            busy = busy[:, offset:offset + min(last_slot, (chunk_end + 1) * SLOTS_PER_DAY) - chunk_first]
+
+            # Free runs as rising and falling edges of the free slots, each
+            # row framed by a busy slot at both ends and the rows laid end
+            # to end, so every run costs O(1) after two passes over the slots.
+            width = busy.shape[1]
+            free = np.zeros((len(pending), width + 2), dtype=np.int8)
+            free[:, 1:-1] = busy == 0
+            edges = np.diff(free.ravel())
+            run_starts = np.flatnonzero(edges == 1) + 1
+            run_ends = np.flatnonzero(edges == -1) + 1
+            row, start = np.divmod(run_starts, width + 2)
+            start -= 1
+            length = run_ends - run_starts
+            continued = start == 0
+            length[continued] += carry[row[continued]]
+            start[continued] -= carry[row[continued]]
+
+            fit = length >= needed
+            found_rows, first = np.unique(row[fit], return_index=True)
+            earliest[pending[found_rows]] = chunk_first + start[fit][first]
+            found = np.zeros(len(pending), dtype=bool)
+            found[found_rows] = True
+            carry = np.zeros(len(pending), dtype=np.int64)
+            trailing = run_ends % (width + 2) == width + 1
+            carry[row[trailing]] = length[trailing]
+            pending = pending[~found]
+            carry = carry[~found]
+            if not len(pending):
+                break
+            if limit is not None:
+                settled = self.capacities[rows[earliest >= 0]]
+                if np.count_nonzero(settled <= self.capacities[rows[pending]].min()) >= limit:
+                    break
+        found = earliest >= 0
+        return rows[found], earliest[found]
+
+    def search(self, start_minute, end_minute, duration, capacity=0, features=(), building_id=None, limit=20):
+        """Rooms free for `duration` minutes somewhere in [start, end).
+
+        Results are ranked by best fit: the smallest room that holds
+        `capacity` people first, then the earliest start. Start times are
+        aligned to 15-minute slots.
+        """
+        self.refresh()
+        candidates = self.capacities >= capacity
+        if building_id is not None:
+            candidates &= self.building_ids == building_id
+        wanted = self.catalog.mask(features)
+        if wanted is None:
+            return []
+        if wanted:
+            candidates &= ((self.feature_masks & wanted) == wanted).astype(bool)
+        candidate_rows = np.flatnonzero(candidates)
+        needed = -(-duration // SLOT_MINUTES)
+        first_slot = -(-start_minute // SLOT_MINUTES)
+        last_slot = end_minute // SLOT_MINUTES
+        if not len(candidate_rows) or needed <= 0 or last_slot - first_slot < needed:
+            return []
+
+        rows, earliest = self._earliest_windows(candidate_rows, first_slot, last_slot, needed, limit)
+        order = np.lexsort((earliest, self.capacities[rows] - capacity))[:limit]
+        results = []
+        for i in order.tolist():
+            row = int(rows[i])
+            start = int(earliest[i]) * SLOT_MINUTES
+            results.append({
+                'room_id': int(self.room_ids[row]),
+                'name': self.room_names[row],
+                'building_id': int(self.building_ids[row]),
+                'building': self.building_names[row],
+                'capacity': int(self.capacities[row]),
+                'start_minute': start,
+                'end_minute': start + duration,
+            })
+        return results
+
+
+def find_free_rooms(path, start_minute, end_minute, duration, capacity=0, features=(), building_id=None, limit=20):
+    conn = schema.connect(path)
+    try:
+        return AvailabilityIndex(conn).search(start_minute, end_minute, duration, capacity, features, building_id,
+                                              limit)
+    finally:
+        conn.close()
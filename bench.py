@@ -0,0 +1,316 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import schema
+from recurrence import DAY
+from timeutil import to_minutes
+
+# (buildings, rooms, reservations)
+SCALES = {
+    'small': (10, 1000, 100000),
+    'medium': (20, 5000, 1000000),
+    'large': (50, 10000, 5000000),
+}
+FEATURES = ['Projector', 'Whiteboard', 'Audio', 'Video', 'Wheelchair access', 'Piano', 'Kitchen', 'Computers']
+CAPACITIES = [4, 6, 8, 10, 12, 20, 30, 50, 80]
+DURATIONS = [30, 45, 60, 90, 120]
+PURPOSES = ['Orientation', 'Lesson', 'Study group', 'Interview', 'Rehearsal', 'Planning', 'Review', 'Workshop']
+INSERT_CHUNK = 50000
+# Reservations are spread over this many days, centred on the anchor day.
+SPAN_DAYS = 365
+
+# compare flags a metric whose median grew by more than the threshold and
+# by more than the noise floor.
+REGRESSION_THRESHOLD = 0.2
+NOISE_FLOOR_MS = 1.0
+
+
+def _names(rng, count, prefix):
+    return [f"{prefix} {rng.randrange(10 ** 6):06d}" for _ in range(count)]
+
+
+def generate(path, buildings, rooms, reservations, seed=1, anchor=None):
+    """Write a synthetic rooms database; the same seed and anchor give the same rows.
+
+    Bookings never overlap within a room and are spread over SPAN_DAYS
+    around the anchor day (today by default), so "now" falls in the middle
+    of the data. Only the anchor's date matters.
+    """
+    rng = random.Random(seed)
+    anchor = anchor or datetime.now()
+    first_minute = to_minutes(anchor) // DAY * DAY - SPAN_DAYS // 2 * DAY
+    conn = schema.connect(path)
+    conn.execute('PRAGMA synchronous = OFF')
+    cursor = conn.cursor()
+    cursor.executemany('INSERT INTO buildings (id, name) VALUES (?, ?)',
+                       [(i + 1, f"Building {i + 1}") for i in range(buildings)])
+    cursor.executemany('INSERT INTO rooms (id, name, building_id, floor, capacity) VALUES (?, ?, ?, ?, ?)', [
+        (i + 1, f"Room {i // buildings + 1:04d}", i % buildings + 1, rng.randint(1, 3), rng.choice(CAPACITIES))
+        for i in range(rooms)])
+    cursor.executemany('INSERT INTO features (id, name, key) VALUES (?, ?, ?)',
+                       [(i + 1, name, name.casefold()) for i, name in enumerate(FEATURES)])
+    cursor.executemany('INSERT INTO room_features (room_id, feature_id) VALUES (?, ?)', [
+        (room_id, feature_id) for room_id in range(1, rooms + 1)
+        for feature_id in range(1, len(FEATURES) + 1) if rng.random() < 0.3])
+
+    # Triggers are skipped for the bulk load and put back afterwards: the
+    # change log only matters to running instances, and the search index and
+    # usage summary are faster to rebuild in one pass.
+    triggers = cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'reservations'"
+                              ).fetchall()
+    for name, _ in triggers:
+        cursor.execute(f'DROP TRIGGER {name}')
+    teachers = _names(rng, 500, 'Teacher')
+    students = _names(rng, 5000, 'Student')
+
+    def rows():
+        per_room, extra = divmod(reservations, rooms)
+        for room_id in range(1, rooms + 1):
+            count = per_room + (room_id <= extra)
+            if not count:
+                continue
+            # Average gap that fits `count` bookings into the span.
+            gap = max(0, (SPAN_DAYS * DAY) // count - 75)
+            minute = first_minute + rng.randrange(0, 8 * 60, 15)
+            for _ in range(count):
+                minute += rng.randrange(0, 2 * gap + 1) // 15 * 15
+                duration = rng.choice(DURATIONS)
+                yield (room_id, minute, minute + duration, rng.choice(teachers), rng.choice(students),
+                       rng.choice(PURPOSES), rng.randint(1, 7))
+                minute += duration
+
+    generated = rows()
+    while True:
+        chunk = [row for _, row in zip(range(INSERT_CHUNK), generated)]
+        if not chunk:
+            break
+        cursor.executemany('''
+            INSERT INTO reservations (room_id, start_minute, end_minute, teacher_name, student_name, purpose, priority)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', chunk)
+    for _, sql in triggers:
+        cursor.execute(sql)
+    schema.rebuild_search(cursor)
+    schema.rebuild_usage(cursor)
+    conn.commit()
+    conn.close()
+
+
+def parse_anchor(value):
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def dataset(cache_dir, scale, seed, anchor):
+    # The rows depend on the anchor day, so it is part of the cache key.
+    path = os.path.join(cache_dir, f"bench-{scale}-{seed}-{anchor:%Y%m%d}.db")
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        generate(path + '.tmp', *SCALES[scale], seed=seed, anchor=anchor)
+        os.replace(path + '.tmp', path)
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(path + '.tmp' + suffix):
+                os.remove(path + '.tmp' + suffix)
+        print(f"generated {scale} dataset in {time.perf_counter() - started:.1f}s: {path}", file=sys.stderr)
+    return path
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    }
+
+
+def measure(path, repeat):
+    """Time the desktop app's hot paths against one database, headless."""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5 import QtWidgets
+    import main
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    main.DB_PATH = path
+    timings = {}
+
+    def timed(name, fn, *args, **kwargs):
+        # Async steps count until their results have reached the widgets.
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn(*args, **kwargs)
+            window.worker.waitForDone()
+            samples.append((time.perf_counter() - started) * 1000)
+        timings[name] = _summary(samples)
+
+    started = time.perf_counter()
+    # Archiving would start moving the older half of the data away mid-run.
+    window = main.RoomReservationApp(archiveAfterDays=0)
+    window.worker.waitForDone()
+    timings['startup'] = _summary([(time.perf_counter() - started) * 1000])
+
+    timed('loadBuildings', window.loadBuildings)
+    window.buildingCombo.setCurrentIndex(1)
+    window.worker.waitForDone()
+    timed('loadRooms+loadReservations', window.loadRooms)
+    timed('loadReservations (no changes)', window.loadReservations)
+    timed('checkReservations', window.checkReservations, datetime.now())
+
+    def toggle_filter():
+        window.capacitySpin.setValue(0 if window.capacitySpin.value() else 20)
+    timed('filterRooms', toggle_filter)
+
+    dialog = main.ViewReservationsDialog(window)
+    window.worker.waitForDone()
+    timed('ViewReservationsDialog.loadReservations', dialog.loadReservations)
+
+    # Book far in the future so every attempt lands on a free slot.
+    room = next(iter(window.rooms))
+    dates = iter(range(1000, 1000 + repeat))
+
+    def book():
+        day = (datetime.now() + timedelta(days=next(dates))).strftime('%Y-%m-%d')
+        outcome = []
+        window.reserveRoom(room, day, '09:00 AM', '10:00 AM', 'Bench', 'Bench', 'Bench', done=outcome.append)
+        window.worker.waitForDone()
+        if outcome != [True]:
+            raise RuntimeError(f"benchmark booking failed: {outcome}")
+    timed('reserveRoom', book)
+
+    window.worker.close()
+    app.processEvents()
+    return timings
+
+
+def _run_scale(args):
+    # One process per scale, so peak RSS belongs to that scale alone.
+    # The timed bookings go into a copy, so the cached dataset stays as generated.
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'rooms.db')
+        shutil.copyfile(dataset(args.cache_dir, args.scale, args.seed, args.anchor), path)
+        timings = measure(path, args.repeat)
+    json.dump({
+        'dataset': dict(zip(('buildings', 'rooms', 'reservations'), SCALES[args.scale]), seed=args.seed,
+                        anchor=f"{args.anchor:%Y-%m-%d}"),
+        'timings': timings,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }, sys.stdout)
+    return 0
+
+
+def run(args):
+    anchor = args.anchor or datetime.now()
+    cache_dir = args.cache_dir or os.path.join(tempfile.gettempdir(), 'rooms-bench')
+    os.makedirs(cache_dir, exist_ok=True)
+    results = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+        },
+        'scales': {},
+    }
+    for scale in args.scales.split(','):
+        if scale not in SCALES:
+            raise SystemExit(f"unknown scale {scale!r}; choose from {', '.join(SCALES)}")
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '_scale', scale, '--cache-dir', cache_dir,
+             '--seed', str(args.seed), '--anchor', f"{anchor:%Y-%m-%d}", '--repeat', str(args.repeat)],
+            check=True, stdout=subprocess.PIPE, text=True).stdout
+        results['scales'][scale] = json.loads(output.strip().splitlines()[-1])
+        for name, summary in results['scales'][scale]['timings'].items():
+            print(f"{scale:>7} {name:<42} median {summary['median_ms']:>10.2f} ms   p95 {summary['p95_ms']:>10.2f} ms",
+                  file=sys.stderr)
+        print(f"{scale:>7} peak RSS {results['scales'][scale]['peak_rss_mb']} MB", file=sys.stderr)
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, 'w') as handle:
+            handle.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+def compare(args):
+    with open(args.baseline) as handle:
+        baseline = json.load(handle)
+    with open(args.current) as handle:
+        current = json.load(handle)
+    regressions = 0
+    for scale, result in current['scales'].items():
+        before = baseline['scales'].get(scale)
+        if before is None:
+            continue
+        metrics = [(name, before['timings'][name]['median_ms'], summary['median_ms'], 'ms')
+                   for name, summary in result['timings'].items() if name in before['timings']]
+        metrics.append(('peak RSS', before['peak_rss_mb'], result['peak_rss_mb'], 'MB'))
+        for name, old, new, unit in metrics:
+            change = (new - old) / old if old else 0.0
+            floor = NOISE_FLOOR_MS if unit == 'ms' else 0.0
+            regressed = change > args.threshold and new - old > floor
+            regressions += regressed
+            print(f"{'REGRESSION' if regressed else 'ok':<10} {scale:>7} {name:<42} "
+                  f"{old:>10.2f} -> {new:>10.2f} {unit} ({change:+.0%})")
+    print(f"{regressions} regression(s) over {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the app against seeded synthetic databases.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='generate (or reuse) datasets and time the hot paths')
+    run_parser.add_argument('--scales', default='small', help=f"comma separated, from {', '.join(SCALES)}")
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--anchor', type=parse_anchor,
+                            help='YYYY-MM-DD day the bookings are centred on (default today)')
+    run_parser.add_argument('--cache-dir', help='where generated databases are kept between runs')
+    run_parser.add_argument('--out', help='write the JSON results here instead of stdout')
+    run_parser.set_defaults(handler=run)
+
+    generate_parser = subparsers.add_parser('generate', help='write one synthetic rooms database')
+    generate_parser.add_argument('db')
+    generate_parser.add_argument('--scale', choices=SCALES, default='small')
+    generate_parser.add_argument('--seed', type=int, default=1)
+    generate_parser.add_argument('--anchor', type=parse_anchor,
+                                 help='YYYY-MM-DD day the bookings are centred on (default today)')
+    generate_parser.set_defaults(
+        handler=lambda args: generate(args.db, *SCALES[args.scale], seed=args.seed, anchor=args.anchor) or 0)
+
+    compare_parser = subparsers.add_parser('compare', help='flag regressions against a stored baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                                help='relative slowdown that counts as a regression (default 0.2)')
+    compare_parser.set_defaults(handler=compare)
+
+    scale_parser = subparsers.add_parser('_scale')
+    scale_parser.add_argument('scale', choices=SCALES)
+    scale_parser.add_argument('--cache-dir', required=True)
+    scale_parser.add_argument('--seed', type=int, default=1)
+    scale_parser.add_argument('--anchor', type=parse_anchor, required=True)
+    scale_parser.add_argument('--repeat', type=int, default=5)
+    scale_parser.set_defaults(handler=_run_scale)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+import argparse
+import sys
+from datetime import datetime
+
+import schema
+from conflicts import LOWEST_PRIORITY, BookingConflict, priority_label
+from recurrence import DAY, FREQUENCIES, SERIES_COLUMNS, occurrences, series_from_row
+from timeutil import TIME_FORMAT, format_minutes, now_minutes, to_minutes
+
+LIST_LIMIT = 50
+FREE_LIMIT = 20
+# How far ahead `status` looks for a room's next change.
+STATUS_HORIZON = DAY
+# Handed to transfer.main before parsing, since building their parsers loads numpy.
+TRANSFER_COMMANDS = {
+    'import': 'bulk import reservations from CSV or iCalendar',
+    'export': 'export reservations to CSV or iCalendar',
+    'archive': 'move old reservations out of the hot table',
+    'search': 'full-text search over teacher, student and purpose',
+    'utilization': 'export room utilization by room, building, floor, week or priority',
+}
+
+
+# Scripted use without the window: cron status checks, bulk bookings and
+# reports. Each subcommand imports only what it needs, so `status` starts in
+# a few tens of milliseconds; PyQt5 is loaded by `gui` alone and numpy by
+# `free` and the transfer commands. Subcommands that only read open the
+# database read-only.
+
+def _minutes(value):
+    for layout in (TIME_FORMAT, '%Y-%m-%d'):
+        try:
+            return to_minutes(datetime.strptime(value, layout))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD or YYYY-MM-DD HH:MM, got {value!r}")
+
+
+def find_building(conn, name):
+    row = conn.execute('SELECT id FROM buildings WHERE name = ?', (name,)).fetchone()
+    if row is None:
+        raise ValueError(f"No building named {name!r}")
+    return row[0]
+
+
+def find_room(conn, name, building=None):
+    if building:
+        ids = conn.execute('SELECT id FROM rooms WHERE name = ? AND building_id = ?',
+                           (name, find_building(conn, building))).fetchall()
+    else:
+        ids = conn.execute('SELECT id FROM rooms WHERE name = ?', (name,)).fetchall()
+    if not ids:
+        raise ValueError(f"No room named {name!r}")
+    if len(ids) > 1:
+        raise ValueError(f"Several buildings have a room named {name!r}; pass --building")
+    return ids[0][0]
+
+
+def _series_occurrences(conn, window_start, window_end, building_id=None):
+    # (room, start, end) of series occurrences overlapping the window.
+    building_filter = 'AND room_id IN (SELECT id FROM rooms WHERE building_id = ?)' if building_id is not None else ''
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT {", ".join(SERIES_COLUMNS)} FROM reservation_series
+        WHERE start_minute < ? AND (until_minute IS NULL OR until_minute + duration > ?) {building_filter}
+    ''', [window_end, window_start] + ([building_id] if building_id is not None else []))
+    rows = cursor.fetchall()
+    if not rows:
+        return []
+    exceptions = {}
+    cursor.execute(f'''
+        SELECT series_id, occurrence_start FROM series_exceptions
+        WHERE series_id IN ({",".join("?" * len(rows))})
+    ''', [row[0] for row in rows])
+    for series_id, start in cursor.fetchall():
+        exceptions.setdefault(series_id, []).append(start)
+    found = []
+    for row in rows:
+        series = series_from_row(row, exceptions.get(row[0], ()))
+        found.extend((series['room_id'], start, start + series['duration'])
+                     for start in occurrences(series, window_start, window_end))
+    return found
+
+
+def room_status(conn, minute, building_id=None):
+    """(building, room, occupied, next change or None) of every room at `minute`.
+
+    Bookings in one room may overlap, so a room is occupied until the latest
+    end among those running at `minute`. Nothing that started more than the
+    room's longest booking ago can still be running, so each room costs a
+    bounded range of idx_reservations_room_start and a seek of
+    idx_reservations_room_duration instead of loading its reservations.
+    Changes more than STATUS_HORIZON ahead are not reported.
+    """
+    horizon = minute + STATUS_HORIZON
+    building_filter = 'WHERE rooms.building_id = :building' if building_id is not None else ''
+    rows = conn.execute(f'''
+        SELECT rooms.id, buildings.name, rooms.name,
+               (SELECT MAX(end_minute) FROM reservations
+                WHERE room_id = rooms.id AND start_minute <= :minute
+                  AND start_minute > :minute - (SELECT COALESCE(MAX(end_minute - start_minute), 0)
+                                                FROM reservations WHERE room_id = rooms.id)),
+               (SELECT start_minute FROM reservations WHERE room_id = rooms.id AND start_minute > :minute
+                ORDER BY start_minute LIMIT 1)
+        FROM rooms LEFT JOIN buildings ON buildings.id = rooms.building_id
+        {building_filter}
+        ORDER BY buildings.name, rooms.name, rooms.id
+    ''', {'minute': minute, 'building': building_id}).fetchall()
+    until = {}
+    upcoming = {}
+    for room_id, start, end in _series_occurrences(conn, minute, horizon, building_id):
+        if start <= minute:
+            until[room_id] = max(end, until.get(room_id, end))
+        else:
+            upcoming[room_id] = min(start, upcoming.get(room_id, start))
+    status = []
+    for room_id, building, room, last_end, next_start in rows:
+        end = max(until.get(room_id, minute), last_end if last_end is not None else minute)
+        if end > minute:
+            change = end
+        else:
+            change = min(next_start if next_start is not None else horizon, upcoming.get(room_id, horizon))
+        status.append((building, room, end > minute, change if change < horizon else None))
+    return status
+
+
+def _print_conflicts(conflicts):
+    for conflict in conflicts:
+        print(f"  {format_minutes(conflict['start_minute'])} - {format_minutes(conflict['end_minute'])} "
+              f"({'recurring, ' if 'series_id' in conflict else ''}{priority_label(conflict['priority'])})",
+              file=sys.stderr)
+
+
+def run_status(conn, args):
+    minute = args.at if args.at is not None else now_minutes()
+    building_id = find_building(conn, args.building) if args.building else None
+    status = room_status(conn, minute, building_id)
+    occupied = 0
+    for building, room, busy, change in status:
+        occupied += busy
+        if args.only is not None and busy != (args.only == 'occupied'):
+            continue
+        print(f"{building or ''}\t{room}\t{'occupied' if busy else 'vacant'}\t"
+              f"{format_minutes(change) if change is not None else ''}")
+    print(f"{occupied} of {len(status)} rooms occupied at {format_minutes(minute)}.", file=sys.stderr)
+    return 0
+
+
+def run_book(conn, args):
+    import service
+    booking = service.parse_booking({
+        'room_id': find_room(conn, args.room, args.building), 'start_minute': args.start, 'end_minute': args.end,
+        'teacher_name': args.teacher, 'student_name': args.student, 'purpose': args.purpose,
+        'priority': args.priority, 'frequency': args.repeat, 'interval': args.interval,
+        'until_minute': args.until, 'count': args.count,
+    })
+    try:
+        result = service.book(conn, booking)
+    except BookingConflict as error:
+        print(f"{args.room} is already booked by an equal or higher priority meeting:", file=sys.stderr)
+        _print_conflicts(error.conflicts)
+        return 1
+    print(f"Booked {'series' if args.repeat else 'reservation'} {result['id']}.")
+    if result['displaced']:
+        print("Displaced these lower priority reservations:", file=sys.stderr)
+        _print_conflicts(result['displaced'])
+    return 0
+
+
+def run_cancel(conn, args):
+    import service
+    deleted = service.delete_reservations(conn, args.ids)
+    print(f"Cancelled {deleted} of {len(args.ids)} reservation(s).")
+    return 0 if deleted == len(args.ids) else 1
+
+
+def run_list(conn, args):
+    from reservation_query import ReservationQuery
+    query = ReservationQuery(conn)
+    room_id = find_room(conn, args.room, args.building) if args.room else None
+    start_from = args.start_from if args.start_from is not None else now_minutes() // DAY * DAY
+    query.set_filters(room_id=room_id, start_from=start_from, start_to=args.start_to, teacher=args.teacher,
+                      include_archived=args.include_archived)
+    rows = query.page(limit=args.limit)
+    for _, res_id, room, start, end, teacher, student, purpose in rows:
+        print(f"{res_id}\t{room}\t{format_minutes(start)}\t{format_minutes(end)}\t"
+              f"{teacher or ''}\t{student or ''}\t{purpose or ''}")
+    return 0
+
+
+def run_free(conn, args):
+    from availability import AvailabilityIndex
+    building_id = find_building(conn, args.building) if args.building else None
+    duration = args.duration if args.duration is not None else args.end - args.start
+    results = AvailabilityIndex(conn).search(args.start, args.end, duration, args.capacity, args.feature,
+                                             building_id, args.limit)
+    for result in results:
+        print(f"{result['building'] or ''}\t{result['name']}\t{result['capacity']}\t"
+              f"{format_minutes(result['start_minute'])}\t{format_minutes(result['end_minute'])}")
+    return 0 if results else 1
+
+
+def run_gui(args, app_args):
+    import main as app
+    app.DB_PATH = args.db
+    return app.main(app_args)
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--db', default='rooms.db', help='path to the rooms database')
+    parser = argparse.ArgumentParser(prog='cli.py', description='Room reservations from the command line.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    status_parser = subparsers.add_parser('status', parents=[common], help='show which rooms are occupied')
+    status_parser.add_argument('--building')
+    status_parser.add_argument('--at', type=_minutes, metavar='"YYYY-MM-DD HH:MM"', help='instead of now')
+    status_parser.add_argument('--only', choices=['occupied', 'vacant'])
+    status_parser.set_defaults(handler=run_status, connect=schema.connect_readonly)
+
+    book_parser = subparsers.add_parser('book', parents=[common], help='book a room')
+    book_parser.add_argument('room')
+    book_parser.add_argument('start', type=_minutes, metavar='START')
+    book_parser.add_argument('end', type=_minutes, metavar='END')
+    book_parser.add_argument('--building', help='needed when several buildings have a room of that name')
+    book_parser.add_argument('--teacher')
+    book_parser.add_argument('--student')
+    book_parser.add_argument('--purpose')
+    book_parser.add_argument('--priority', type=int, choices=range(1, LOWEST_PRIORITY + 1), metavar='PRIORITY',
+                             help=f'meeting type, 1 (most important) to {LOWEST_PRIORITY}')
+    book_parser.add_argument('--repeat', choices=FREQUENCIES, help='book a recurring series')
+    book_parser.add_argument('--interval', type=int, help='repeat every this many days, weeks or months')
+    book_parser.add_argument('--until', type=_minutes, metavar='"YYYY-MM-DD HH:MM"')
+    book_parser.add_argument('--count', type=int, help='number of occurrences')
+    book_parser.set_defaults(handler=run_book, connect=schema.connect)
+
+    cancel_parser = subparsers.add_parser('cancel', parents=[common], help='delete reservations by id')
+    cancel_parser.add_argument('ids', type=int, nargs='+', metavar='ID')
+    cancel_parser.set_defaults(handler=run_cancel, connect=schema.connect)
+
+    list_parser = subparsers.add_parser('list', parents=[common], help='list reservations, from today by default')
+    list_parser.add_argument('--room')
+    list_parser.add_argument('--building', help='needed when several buildings have a room of that name')
+    list_parser.add_argument('--from', dest='start_from', type=_minutes, metavar='YYYY-MM-DD')
+    list_parser.add_argument('--to', dest='start_to', type=_minutes, metavar='YYYY-MM-DD', help='exclusive end')
+    list_parser.add_argument('--teacher')
+    list_parser.add_argument('--include-archived', action='store_true')
+    list_parser.add_argument('--limit', type=int, default=LIST_LIMIT)
+    list_parser.set_defaults(handler=run_list, connect=schema.connect_readonly)
+
+    free_parser = subparsers.add_parser('free', parents=[common], help='find rooms free somewhere in a time window')
+    free_parser.add_argument('start', type=_minutes, metavar='START')
+    free_parser.add_argument('end', type=_minutes, metavar='END')
+    free_parser.add_argument('--duration', type=int, help='minutes needed (default the whole window)')
+    free_parser.add_argument('--capacity', type=int, default=0)
+    free_parser.add_argument('--feature', action='append', default=[])
+    free_parser.add_argument('--building')
+    free_parser.add_argument('--limit', type=int, default=FREE_LIMIT)
+    free_parser.set_defaults(handler=run_free, connect=schema.connect_readonly)
+
+    gui_parser = subparsers.add_parser('gui', parents=[common], help='open the desktop app',
+                                       description="Other options, such as --serve 8765 or --archive-after 90, "
+                                                   "are passed on to the app.")
+    gui_parser.set_defaults(handler=run_gui, connect=None)
+
+    # Listed for --help only; main() never parses these.
+    for name, summary in TRANSFER_COMMANDS.items():
+        subparsers.add_parser(name, help=summary)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in TRANSFER_COMMANDS:
+        import transfer
+        return transfer.main(argv, prog='cli.py')
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.connect is None:
+        return args.handler(args, extra)
+    if extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    conn = args.connect(args.db)
+    try:
+        return args.handler(conn, args)
+    except ValueError as error:
+        print(f"{error}.", file=sys.stderr)
+        return 2
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+from bisect import bisect_left, insort
+
+from recurrence import FREQUENCIES, SERIES_COLUMNS, first_conflict, last_end, occurrences, series_from_row
+from schema import write_transaction
+
+# Meeting types from the booking guidelines; a lower number is more important.
+MEETING_TYPES = {
+    1: 'Unbaptized Contact In person',
+    2: 'Baptized Persecuted Contact',
+    3: 'Unbaptized Contact Zoom',
+    4: 'Baptized Contact In person',
+    5: 'Baptized Contact Zoom',
+    6: 'Group Activities',
+    7: 'Team Activities',
+}
+LOWEST_PRIORITY = max(MEETING_TYPES)
+
+BOOKING_FIELDS = ('room_id', 'start_minute', 'end_minute', 'teacher_name', 'student_name', 'purpose', 'priority')
+SERIES_FIELDS = SERIES_COLUMNS[1:]
+
+# Reservations of a room overlapping [:start, :end). Nothing that started
+# more than the room's longest booking ago can still be running, so this is
+# a bounded range of idx_reservations_room_start rather than the room's
+# whole history before :end.
+OVERLAPPING = '''
+    SELECT id, start_minute, end_minute, priority FROM reservations
+    WHERE room_id = :room AND start_minute < :end AND end_minute > :start
+      AND start_minute > :start - (SELECT COALESCE(MAX(end_minute - start_minute), 0) FROM reservations
+                                   WHERE room_id = :room)
+'''
+
+
+class BookingConflict(Exception):
+    def __init__(self, conflicts):
+        super().__init__(f"Conflicts with {len(conflicts)} existing reservation(s)")
+        self.conflicts = conflicts
+
+
+def priority_label(priority):
+    if priority is None:
+        return "priority unknown"
+    return f"priority {priority} - {MEETING_TYPES[priority]}" if priority in MEETING_TYPES else f"priority {priority}"
+
+
+def outranks(priority, other):
+    # A booking may only displace strictly less important ones.
+    return priority is not None and other is not None and priority < other
+
+
+class ConflictEngine:
+    """Double-booking checks and priority resolution for reservations.
+
+    A new booking that overlaps only less important reservations displaces
+    them when `bump` is set; otherwise, or if any overlapping reservation is
+    at least as important, the booking is rejected. `book` and `book_series`
+    check and insert inside one write transaction, so concurrent writers on
+    other connections or processes cannot double-book a slot.
+    """
+
+    def __init__(self, conn, bump=True):
+        self.conn = conn
+        self.bump = bump
+
+    def find_conflicts(self, room_id, start_minute, end_minute):
+        cursor = self.conn.cursor()
+        cursor.execute(OVERLAPPING, {'room': room_id, 'start': start_minute, 'end': end_minute})
+        conflicts = [{'id': res_id, 'room_id': room_id, 'start_minute': start, 'end_minute': end, 'priority': priority}
+                     for res_id, start, end, priority in cursor.fetchall()]
+        # Recurring series only expand the occurrences inside the window.
+        for series in self.room_series(room_id, end_minute):
+            conflicts.extend(occurrence_conflict(series, start)
+                             for start in occurrences(series, start_minute, end_minute))
+        return conflicts
+
+    def room_series(self, room_id, before=None):
+        cursor = self.conn.cursor()
+        cursor.execute(f'''
+            SELECT {", ".join(SERIES_COLUMNS)} FROM reservation_series
+            WHERE room_id = ? AND start_minute < ?
+        ''', (room_id, before if before is not None else 2 ** 62))
+        rows = cursor.fetchall()
+        exceptions = {}
+        if rows:
+            cursor.execute(f'''
+                SELECT series_id, occurrence_start FROM series_exceptions
+                WHERE series_id IN ({",".join("?" * len(rows))})
+            ''', [row[0] for row in rows])
+            for series_id, occurrence_start in cursor.fetchall():
+                exceptions.setdefault(series_id, []).append(occurrence_start)
+        return [series_from_row(row, exceptions.get(row[0], ())) for row in rows]
+
+    def displace(self, cursor, conflicts):
+        # Single reservations are deleted; a displaced occurrence of a series
+        # becomes an exception of that series.
+        cursor.executemany('DELETE FROM reservations WHERE id = ?',
+                           [(conflict['id'],) for conflict in conflicts if 'id' in conflict])
+        cursor.executemany('INSERT OR IGNORE INTO series_exceptions (series_id, occurrence_start) VALUES (?, ?)',
+                           [(conflict['series_id'], conflict['start_minute'])
+                            for conflict in conflicts if 'series_id' in conflict])
+
+    def resolve(self, priority, conflicts):
+        if not conflicts:
+            return 'accepted'
+        if self.bump and all(outranks(priority, conflict['priority']) for conflict in conflicts):
+            return 'bumped'
+        return 'rejected'
+
+    def book(self, booking):
+        check_span(booking)
+        return write_transaction(self.conn, self._book, booking)
+
+    def _book(self, cursor, booking):
+        conflicts = self.find_conflicts(booking['room_id'], booking['start_minute'], booking['end_minute'])
+        if self.resolve(booking.get('priority'), conflicts) == 'rejected':
+            raise BookingConflict(conflicts)
+        self.displace(cursor, conflicts)
+        cursor.execute(f'''
+            INSERT INTO reservations ({", ".join(BOOKING_FIELDS)})
+            VALUES ({", ".join("?" * len(BOOKING_FIELDS))})
+        ''', [booking.get(field) for field in BOOKING_FIELDS])
+        return {'id': cursor.lastrowid, 'displaced': conflicts}
+
+    def book_series(self, series):
+        """Store a recurring series after checking it against the room.
+
+        Other series are compared arithmetically with
+        recurrence.first_conflict and always block, since displacing one
+        would need an open-ended list of exceptions. Overlapped single
+        reservations are resolved by priority like in `book`.
+        """
+        series = dict({'interval': 1, 'until_minute': None, 'count': None}, **series)
+        check_series(series)
+        series.update(id=None, exceptions=frozenset(series.get('exceptions', ())))
+        return write_transaction(self.conn, self._book_series, series)
+
+    def _book_series(self, cursor, series):
+        end = last_end(series)
+        blocking = []
+        for other in self.room_series(series['room_id'], end):
+            found = first_conflict(series, other)
+            if found is not None:
+                blocking.append(occurrence_conflict(other, found[1]))
+        if blocking:
+            raise BookingConflict(blocking)
+
+        cursor.execute(OVERLAPPING, {'room': series['room_id'], 'start': series['start_minute'],
+                                     'end': end if end is not None else 2 ** 62})
+        conflicts = [{'id': res_id, 'room_id': series['room_id'], 'start_minute': start, 'end_minute': finish,
+                      'priority': priority}
+                     for res_id, start, finish, priority in cursor.fetchall()
+                     if next(occurrences(series, start, finish), None) is not None]
+        if self.resolve(series.get('priority'), conflicts) == 'rejected':
+            raise BookingConflict(conflicts)
+
+        self.displace(cursor, conflicts)
+        cursor.execute(f'''
+            INSERT INTO reservation_series ({", ".join(SERIES_FIELDS)})
+            VALUES ({", ".join("?" * len(SERIES_FIELDS))})
+        ''', [series.get(field) for field in SERIES_FIELDS])
+        series_id = cursor.lastrowid
+        cursor.executemany('INSERT INTO series_exceptions (series_id, occurrence_start) VALUES (?, ?)',
+                           [(series_id, start) for start in series['exceptions']])
+        return {'id': series_id, 'displaced': conflicts}
+
+    def validate_batch(self, bookings):
+        """Check many proposed bookings against the database and each other.
+
+        Bookings are taken in order, so an earlier proposal wins a tie with a
+        later one of equal priority. Nothing is written; each result has a
+        'status' of accepted, bumped, rejected or displaced (accepted, then
+        bumped by a later, more important proposal in the same batch).
+        Existing reservations listed under 'displaced' by any result that
+        was not rejected must be removed for the batch to be consistent.
+        """
+        results = [None] * len(bookings)
+        by_room = {}
+        for i, booking in enumerate(bookings):
+            try:
+                check_span(booking)
+            except ValueError as error:
+                results[i] = {'status': 'rejected', 'error': str(error), 'conflicts': []}
+                continue
+            by_room.setdefault(booking['room_id'], []).append(i)
+
+        for room_id, indexes in by_room.items():
+            # One indexed range query per room covers the whole batch span.
+            window_start = min(bookings[i]['start_minute'] for i in indexes)
+            window_end = max(bookings[i]['end_minute'] for i in indexes)
+            timeline = RoomTimeline()
+            for conflict in self.find_conflicts(room_id, window_start, window_end):
+                timeline.add(conflict)
+
+            for i in indexes:
+                booking = bookings[i]
+                entry = {'index': i, 'room_id': room_id, 'start_minute': booking['start_minute'],
+                         'end_minute': booking['end_minute'], 'priority': booking.get('priority')}
+                conflicts = timeline.overlapping(entry)
+                status = self.resolve(entry['priority'], conflicts)
+                if status == 'rejected':
+                    results[i] = {'status': 'rejected', 'conflicts': [dict(other) for other in conflicts]}
+                    continue
+                for conflict in conflicts:
+                    timeline.remove(conflict)
+                    if 'index' in conflict:
+                        results[conflict['index']]['status'] = 'displaced'
+                timeline.add(entry)
+                results[i] = {'status': status, 'displaced': [dict(other) for other in conflicts]}
+        return results
+
+
+class RoomTimeline:
+    """Sorted in-memory reservations of one room used by batch validation."""
+
+    def __init__(self):
+        self._entries = []
+        self._longest = 0
+
+    @staticmethod
+    def _key(entry):
+        return (entry['start_minute'], entry['end_minute'], entry.get('id', 0), entry.get('series_id', 0),
+                entry.get('index', -1))
+
+    def add(self, entry):
+        self._longest = max(self._longest, entry['end_minute'] - entry['start_minute'])
+        insort(self._entries, (self._key(entry), entry), key=lambda item: item[0])
+
+    def remove(self, entry):
+        key = self._key(entry)
+        i = bisect_left(self._entries, key, key=lambda item: item[0])
+        del self._entries[i]
+
+    def overlapping(self, entry):
+        start = entry['start_minute']
+        end = entry['end_minute']
+        found = []
+        i = bisect_left(self._entries, (end,), key=lambda item: item[0]) - 1
+        # Nothing starting more than the longest duration ago can still be running.
+        while i >= 0 and self._entries[i][0][0] > start - self._longest:
+            other = self._entries[i][1]
+            if other['end_minute'] > start:
+                found.append(other)
+            i -= 1
+        found.reverse()
+        return found
+
+
+def occurrence_conflict(series, start):
+    return {'series_id': series['id'], 'room_id': series['room_id'], 'start_minute': start,
+            'end_minute': start + series['duration'], 'priority': series['priority']}
+
+
+def check_priority(priority):
+    # Anything outside the meeting types would outrank every real booking.
+    if priority is not None and priority not in MEETING_TYPES:
+        raise ValueError(f"Priority must be a meeting type from 1 to {LOWEST_PRIORITY}, not {priority!r}")
+
+
+def check_span(booking):
+    if booking['end_minute'] <= booking['start_minute']:
+        raise ValueError("End time must be after start time")
+    check_priority(booking.get('priority'))
+
+
+def check_series(series):
+    if series['duration'] <= 0:
+        raise ValueError("End time must be after start time")
+    if series['frequency'] not in FREQUENCIES:
+        raise ValueError(f"Unknown repeat frequency {series['frequency']!r}")
+    if series['interval'] < 1:
+        raise ValueError("Repeat interval must be at least 1")
+    if series['count'] is not None and series['count'] < 1:
+        raise ValueError("Repeat count must be at least 1")
+    if series['until_minute'] is not None and series['until_minute'] <= series['start_minute']:
+        raise ValueError("Repeat end date must be after the first occurrence")
+    check_priority(series.get('priority'))
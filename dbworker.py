@@ -0,0 +1,162 @@
+import threading
+
+from PyQt5 import QtCore, sip
+
+import schema
+
+READ_THREADS = 2
+
+
+def _deleted(callback):
+    receiver = getattr(callback, '__self__', None)
+    return isinstance(receiver, QtCore.QObject) and sip.isdeleted(receiver)
+
+
+class _Job(QtCore.QRunnable):
+    def __init__(self, worker, job_id, channel, fn, args):
+        super().__init__()
+        self.worker = worker
+        self.job_id = job_id
+        self.channel = channel
+        self.fn = fn
+        self.args = args
+
+    def run(self):
+        # A job superseded while it sat in the queue is not worth running.
+        if not self.worker.isCurrent(self.channel, self.job_id):
+            self.worker.finished.emit(self.job_id, None, None)
+            return
+        conn = self.worker.connection()
+        try:
+            result = self.fn(conn, *self.args)
+        except Exception as error:
+            if conn.in_transaction:
+                conn.rollback()
+            self.worker.finished.emit(self.job_id, None, error)
+        else:
+            self.worker.finished.emit(self.job_id, result, None)
+
+
+class _Writer(QtCore.QObject):
+    # Lives on the writer thread; jobs arrive through a queued connection
+    # and so run one at a time in submission order.
+    def runJob(self, job):
+        job.run()
+
+
+class DatabaseWorker(QtCore.QObject):
+    """Runs database jobs off the GUI thread and reports back on it.
+
+    A job is a callable taking a connection plus its arguments; its result
+    goes to `done` (or its exception to `failed`) on the GUI thread. Every
+    pool thread opens its own WAL connection. `read` jobs share a small
+    pool. `write` jobs run one at a time, in order, on a dedicated thread;
+    objects that keep a connection, such as ReservationSync, are created
+    and used only from write jobs so they always see the same one.
+
+    Jobs given a `channel` supersede earlier jobs on it: an older result is
+    dropped instead of delivered, so switching buildings quickly only ever
+    shows the last one asked for. `quiet` jobs, such as periodic polls, do
+    not count towards busyChanged. Callbacks bound to a QObject that was
+    deleted meanwhile, such as a closed dialog, are skipped.
+    """
+
+    finished = QtCore.pyqtSignal(object, object, object)
+    queued = QtCore.pyqtSignal(object)
+    busyChanged = QtCore.pyqtSignal(bool)
+    failed = QtCore.pyqtSignal(object)
+
+    def __init__(self, path, readers=READ_THREADS, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.readPool = QtCore.QThreadPool(self)
+        self.readPool.setMaxThreadCount(readers)
+        # Threads keep their connection for as long as the worker lives.
+        self.readPool.setExpiryTimeout(-1)
+        self.writeThread = QtCore.QThread(self)
+        self.writer = _Writer()
+        self.writer.moveToThread(self.writeThread)
+        self.queued.connect(self.writer.runJob)
+        self.writeThread.start()
+        # Let queued writes reach the database before the threads go away.
+        if QtCore.QCoreApplication.instance() is not None:
+            QtCore.QCoreApplication.instance().aboutToQuit.connect(self.close)
+        self.nextId = 0
+        self.latest = {}
+        self.pending = {}
+        self.busyJobs = set()
+        self.finished.connect(self.deliver)
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = schema.connect(self.path)
+        return conn
+
+    def read(self, fn, *args, channel=None, done=None, failed=None, quiet=False):
+        return self.submit(self.readPool.start, fn, args, channel, done, failed, quiet)
+
+    def write(self, fn, *args, channel=None, done=None, failed=None, quiet=False):
+        return self.submit(self.queued.emit, fn, args, channel, done, failed, quiet)
+
+    def submit(self, start, fn, args, channel, done, failed, quiet=False):
+        with self.lock:
+            self.nextId += 1
+            job_id = self.nextId
+            if channel is not None:
+                self.latest[channel] = job_id
+        self.pending[job_id] = (channel, done, failed)
+        if not quiet:
+            self.busyJobs.add(job_id)
+            if len(self.busyJobs) == 1:
+                self.busyChanged.emit(True)
+        start(_Job(self, job_id, channel, fn, args))
+        return job_id
+
+    def cancel(self, channel):
+        # Drops whatever is still outstanding on the channel.
+        with self.lock:
+            self.nextId += 1
+            self.latest[channel] = self.nextId
+
+    def isCurrent(self, channel, job_id):
+        with self.lock:
+            return channel is None or self.latest.get(channel) == job_id
+
+    def deliver(self, job_id, result, error):
+        channel, done, failed = self.pending.pop(job_id)
+        try:
+            if not self.isCurrent(channel, job_id):
+                return
+            if error is not None:
+                if failed is not None and not _deleted(failed):
+                    failed(error)
+                elif failed is None:
+                    self.failed.emit(error)
+            elif done is not None and not _deleted(done):
+                done(result)
+        finally:
+            if job_id in self.busyJobs:
+                self.busyJobs.discard(job_id)
+                if not self.busyJobs:
+                    self.busyChanged.emit(False)
+
+    def isBusy(self):
+        return bool(self.busyJobs)
+
+    def waitForDone(self, timeout_ms=-1):
+        # Blocks until every submitted job has been delivered; for shutdown
+        # and scripted use, never from a slot.
+        deadline = QtCore.QDeadlineTimer(timeout_ms) if timeout_ms >= 0 else QtCore.QDeadlineTimer(
+            QtCore.QDeadlineTimer.Forever)
+        while self.pending and not deadline.hasExpired():
+            self.readPool.waitForDone(10)
+            QtCore.QCoreApplication.processEvents()
+        return not self.pending
+
+    def close(self):
+        self.waitForDone()
+        self.writeThread.quit()
+        self.writeThread.wait()
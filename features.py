@@ -0,0 +1,83 @@
+def normalize_feature(name):
+    # 'audio ', ' Audio' and 'AUDIO' are one feature; the first spelling seen
+    # is kept for display and the casefolded form is the unique key.
+    return ' '.join(name.split())
+
+
+def feature_key(name):
+    return normalize_feature(name).casefold()
+
+
+def parse_features(text):
+    names = {}
+    for name in (text or '').split(','):
+        name = normalize_feature(name)
+        if name:
+            names.setdefault(name.casefold(), name)
+    return list(names.values())
+
+
+def feature_bit(feature_id):
+    return 1 << (feature_id - 1)
+
+
+def ensure_features(cursor, names):
+    ids = []
+    for name in names:
+        cursor.execute('INSERT OR IGNORE INTO features (name, key) VALUES (?, ?)', (name, feature_key(name)))
+        cursor.execute('SELECT id FROM features WHERE key = ?', (feature_key(name),))
+        ids.append(cursor.fetchone()[0])
+    return ids
+
+
+def set_room_features(cursor, room_id, names):
+    cursor.execute('DELETE FROM room_features WHERE room_id = ?', (room_id,))
+    cursor.executemany('INSERT OR IGNORE INTO room_features (room_id, feature_id) VALUES (?, ?)',
+                       [(room_id, feature_id) for feature_id in ensure_features(cursor, names)])
+
+
+def room_masks(cursor, building_id=None):
+    # {room_id: bitmask of its features}; rooms without features are absent.
+    if building_id is None:
+        cursor.execute('SELECT room_id, feature_id FROM room_features')
+    else:
+        cursor.execute('''
+            SELECT room_features.room_id, room_features.feature_id
+            FROM room_features JOIN rooms ON room_features.room_id = rooms.id
+            WHERE rooms.building_id = ?
+        ''', (building_id,))
+    masks = {}
+    for room_id, feature_id in cursor.fetchall():
+        masks[room_id] = masks.get(room_id, 0) | feature_bit(feature_id)
+    return masks
+
+
+class FeatureCatalog:
+    """The features table, with names mapped to bits of a room's mask."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.load()
+
+    def load(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT id, name, key FROM features ORDER BY key')
+        rows = cursor.fetchall()
+        self.names = {feature_id: name for feature_id, name, key in rows}
+        self.ids = {key: feature_id for feature_id, name, key in rows}
+
+    def mask(self, names):
+        # None when a feature is not in the catalogue, since no room has it.
+        mask = 0
+        for name in names:
+            name = normalize_feature(name)
+            if not name:
+                continue
+            feature_id = self.ids.get(name.casefold())
+            if feature_id is None:
+                return None
+            mask |= feature_bit(feature_id)
+        return mask
+
+    def names_of(self, mask):
+        return [name for feature_id, name in self.names.items() if mask & feature_bit(feature_id)]
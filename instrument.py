@@ -0,0 +1,312 @@
+import functools
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+import schema
+
+ENV_VAR = 'ROOMS_PROFILE'
+# An event-loop gap longer than this (beyond the heartbeat interval) is a stall.
+STALL_MS = 50
+HEARTBEAT_MS = 10
+# Histogram bucket upper bounds in milliseconds; the last bucket is open.
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+# Oldest calls and statements are dropped from the trace past this many.
+MAX_EVENTS = 200000
+MAX_STALLS = 1000
+TOP_STATEMENTS = 50
+
+# The profiler statements report to, once install() has run.
+_active = None
+
+
+class Histogram:
+    """Latency counts per bucket plus the exact count, total and maximum."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding that rank, never above the maximum.
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_json(self):
+        labels = [f"<={bound}" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]}"]
+        return {
+            'count': self.count,
+            'total_ms': round(self.total, 3),
+            'mean_ms': round(self.total / self.count, 3) if self.count else 0.0,
+            'p50_ms': round(self.percentile(0.5), 3),
+            'p95_ms': round(self.percentile(0.95), 3),
+            'p99_ms': round(self.percentile(0.99), 3),
+            'max_ms': round(self.max, 3),
+            'buckets': {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+
+class Profiler:
+    """Collects handler latencies, SQL statements and event-loop stalls.
+
+    Everything here is opt-in: nothing is wrapped or traced until
+    `instrument` and `install` are called, so a normal run pays nothing.
+    Recording is thread-safe because SQL runs on the database worker's
+    threads. Events keep perf_counter seconds and are converted when dumped.
+    """
+
+    def __init__(self, output=None):
+        self.output = output
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        self.main_thread = threading.get_ident()
+        self.calls = {}
+        self.statements = {}
+        # [kind, name, start, duration, thread id, rows]
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.stalls = deque(maxlen=MAX_STALLS)
+        self.last_beat = None
+
+    def instrument(self, cls, names):
+        """Replace the named methods of `cls` with timed versions."""
+        for name in names:
+            setattr(cls, name, _timed(self, f"{cls.__name__}.{name}", getattr(cls, name)))
+
+    def call(self, name, started, finished):
+        ms = (finished - started) * 1000
+        with self.lock:
+            self.calls.setdefault(name, Histogram()).add(ms)
+            self.events.append(['call', name, started, finished - started, threading.get_ident(), None])
+
+    def statement(self, sql, started, finished, rows):
+        event = ['sql', ' '.join(sql.split()), started, finished - started, threading.get_ident(), max(rows, 0)]
+        with self.lock:
+            self.events.append(event)
+            stats = self.statements.setdefault(event[1], [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += event[3]
+            stats[2] = max(stats[2], event[3])
+            stats[3] += event[5]
+        return event
+
+    def fetched(self, event, seconds, rows):
+        # Rows of a SELECT are only produced while fetching.
+        with self.lock:
+            event[3] += seconds
+            event[5] += rows
+            stats = self.statements[event[1]]
+            stats[1] += seconds
+            stats[2] = max(stats[2], event[3])
+            stats[3] += rows
+
+    def heartbeat(self, interval_ms=HEARTBEAT_MS):
+        """Call from a repeating GUI timer; a late tick means the loop was blocked."""
+        now = time.perf_counter()
+        if self.last_beat is not None and (now - self.last_beat) * 1000 - interval_ms > STALL_MS:
+            self._stall(self.last_beat + interval_ms / 1000, now)
+        self.last_beat = now
+
+    def _stall(self, started, finished):
+        with self.lock:
+            # Events are appended as they finish, so walk back only as far as
+            # the gap to name the GUI handlers that ran during it.
+            handlers = set()
+            for kind, name, start, duration, thread, _ in reversed(self.events):
+                if start + duration < started:
+                    break
+                if kind == 'call' and thread == self.main_thread:
+                    handlers.add(name)
+            self.stalls.append({'start_ms': round((started - self.origin) * 1000, 3),
+                                'duration_ms': round((finished - started) * 1000, 3),
+                                'handlers': sorted(handlers)})
+            self.events.append(['stall', 'event loop stall', started, finished - started, self.main_thread, None])
+
+    def readout(self):
+        """One line for the status bar."""
+        with self.lock:
+            slowest = max(self.calls.items(), key=lambda item: item[1].percentile(0.95), default=None)
+            queries = sum(stats[0] for stats in self.statements.values())
+            sql_ms = sum(stats[1] for stats in self.statements.values()) * 1000
+            stalls = len(self.stalls)
+        text = f"SQL {queries} ({sql_ms:.0f} ms) · {stalls} stall(s)"
+        if slowest is not None:
+            text = f"{slowest[0].split('.')[-1]} p95 {slowest[1].percentile(0.95):.1f} ms · " + text
+        return text
+
+    def summary(self):
+        with self.lock:
+            calls = {name: histogram.to_json() for name, histogram in sorted(self.calls.items())}
+            statements = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+            slowest = sorted((event for event in self.events if event[0] == 'sql'),
+                             key=lambda event: event[3], reverse=True)[:TOP_STATEMENTS]
+            stalls = list(self.stalls)
+        return {
+            'uptime_s': round(time.perf_counter() - self.origin, 3),
+            'calls': calls,
+            'sql': {
+                'executed': sum(stats[0] for _, stats in statements),
+                'total_ms': round(sum(stats[1] for _, stats in statements) * 1000, 3),
+                'statements': [{'sql': sql, 'count': count, 'total_ms': round(total * 1000, 3),
+                                'max_ms': round(longest * 1000, 3), 'rows': rows}
+                               for sql, (count, total, longest, rows) in statements[:TOP_STATEMENTS]],
+                'slowest': [{'sql': event[1], 'at_ms': round((event[2] - self.origin) * 1000, 3),
+                             'duration_ms': round(event[3] * 1000, 3), 'rows': event[5]} for event in slowest],
+            },
+            'stalls': stalls,
+        }
+
+    def chrome_trace(self):
+        """Events in the Trace Event Format read by chrome://tracing and Perfetto."""
+        pid = os.getpid()
+        with self.lock:
+            events = list(self.events)
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': self.main_thread, 'args': {'name': 'GUI'}}]
+        for kind, name, start, duration, thread, rows in events:
+            event = {'name': name, 'cat': kind, 'ph': 'X', 'pid': pid, 'tid': thread,
+                     'ts': round((start - self.origin) * 1e6, 1), 'dur': round(duration * 1e6, 1)}
+            if kind == 'sql':
+                event['name'] = name.split(' ', 1)[0].upper()
+                event['args'] = {'sql': name, 'rows': rows}
+            trace.append(event)
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path):
+        with open(path, 'w') as handle:
+            json.dump(self.summary(), handle, indent=2)
+
+    def dump_trace(self, path):
+        with open(path, 'w') as handle:
+            json.dump(self.chrome_trace(), handle)
+
+    def save(self):
+        # At exit: the summary goes to `output`, the trace next to it.
+        if self.output:
+            self.dump(self.output)
+            self.dump_trace(trace_path(self.output))
+
+
+def trace_path(path):
+    root, ext = os.path.splitext(path)
+    return f"{root}.trace{ext or '.json'}"
+
+
+def _timed(profiler, name, method):
+    # Signals pass every argument they carry and PyQt drops the ones a slot
+    # does not take; the wrapper takes *args, so it has to do the dropping.
+    parameters = inspect.signature(method).parameters.values()
+    if any(parameter.kind is parameter.VAR_POSITIONAL for parameter in parameters):
+        limit = None
+    else:
+        limit = sum(parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)
+                    for parameter in parameters)
+
+    @functools.wraps(method)
+    def timed(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args[:limit], **kwargs)
+        finally:
+            profiler.call(name, started, time.perf_counter())
+    return timed
+
+
+class TracedCursor(sqlite3.Cursor):
+    event = None
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.event = _active.statement(sql, started, time.perf_counter(), self.rowcount)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.event = _active.statement(sql, started, time.perf_counter(), self.rowcount)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self.event = _active.statement(sql_script, started, time.perf_counter(), 0)
+
+    def _fetch(self, fetch, *args):
+        started = time.perf_counter()
+        rows = fetch(*args)
+        if self.event is not None:
+            count = len(rows) if isinstance(rows, list) else rows is not None
+            _active.fetched(self.event, time.perf_counter() - started, count)
+        return rows
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def __next__(self):
+        row = self._fetch(super().fetchone)
+        if row is None:
+            raise StopIteration
+        return row
+
+
+class TracedConnection(sqlite3.Connection):
+    # Connection.execute builds its cursor internally, bypassing cursor().
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def install(profiler):
+    """Trace every statement on connections opened from now on."""
+    global _active
+    _active = profiler
+    schema.CONNECTION_FACTORY = TracedConnection
+
+
+def configure(output=None):
+    """Return an installed Profiler if one was asked for, else None.
+
+    `output` comes from the --profile flag; the ROOMS_PROFILE environment
+    variable is the fallback. Either names the JSON summary written at exit.
+    """
+    output = output or os.environ.get(ENV_VAR)
+    if not output:
+        return None
+    profiler = Profiler(output)
+    install(profiler)
+    return profiler
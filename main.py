@@ -1,12 +1,82 @@
 from PyQt5 import QtWidgets, QtGui, QtCore
+import argparse
+import csv
 import sys
 import time
 from datetime import datetime, timedelta
-import sqlite3
+
+import archive
+import cli
+import instrument
+import service
+import transfer
+import utilization
+from availability import AvailabilityIndex
+from conflicts import LOWEST_PRIORITY, MEETING_TYPES, BookingConflict, priority_label
+from dbworker import DatabaseWorker
+from features import FeatureCatalog, feature_bit, room_masks
+from recurrence import DAY, FREQUENCIES
+from reservation_query import COLUMNS as RESERVATION_COLUMNS, PAGE_SIZE, RELEVANCE, ReservationQuery
+from sync import ExternalChanges, ReservationSync
+from timeline import PRIORITY_COLORS, TimelineView
+from timeutil import format_minutes, from_minutes, now_minutes, to_minutes
+
+# QTimer intervals are signed 32-bit milliseconds; far-off transitions are
+# re-armed when this shorter wait expires.
+MAX_TIMER_MS = 24 * 60 * 60 * 1000
+
+DB_PATH = 'rooms.db'
+
+# How often to look for bookings made by other copies of the app.
+EXTERNAL_POLL_MS = 2000
+
+# Old reservations are moved to the archive, and the change log trimmed, a
+# batch at a time: first shortly after start-up, then hourly, with batches
+# back to back while a backlog lasts.
+ARCHIVE_START_MS = 60 * 1000
+ARCHIVE_INTERVAL_MS = 60 * 60 * 1000
+
+# Pause in typing before the reservations view searches.
+SEARCH_DELAY_MS = 250
+
+# How often the profiler readout in the header is refreshed.
+PROFILE_READOUT_MS = 1000
+
+# Jobs for DatabaseWorker; each runs on a worker thread with that thread's
+# connection and must not touch any widget. The plain database operations
+# live in service.py.
+
+def _load_building(conn, building_id):
+    # The sync keeps this (writer) connection, so its later deltas must be
+    # write jobs as well.
+    feature_masks = room_masks(conn.cursor(), building_id)
+    rooms = service.fetch_rooms(conn, building_id)
+    sync = ReservationSync(conn)
+    sync.track(row[0] for row in rooms)
+    return rooms, feature_masks, sync, sync.sync()
+
+def _sync_reservations(conn, sync):
+    return sync.sync()
+
+def _reservation_page(conn, sort, filters, after):
+    query = ReservationQuery(conn)
+    query.set_sort(*sort)
+    query.set_filters(**filters)
+    return query.page(after)
+
+def _commit(conn):
+    conn.commit()
+
+def _archive_batch(conn, days):
+    # The change log is trimmed even when archiving is turned off.
+    moved = archive.archive_batch(conn, archive.cutoff_minute(days)) if days else 0
+    return moved, archive.prune_batch(conn)
 
 class RoomReservationApp(QtWidgets.QWidget):
-    def __init__(self):
+    def __init__(self, profiler=None, archiveAfterDays=archive.ARCHIVE_AFTER_DAYS):
         super().__init__()
+        self.profiler = profiler
+        self.archiveAfterDays = archiveAfterDays
         self.initUI()
         self.initDB()
         self.loadBuildings()
@@ -47,15 +117,24 @@ class RoomReservationApp(QtWidgets.QWidget):
         """)
 
         self.rooms = {}
+        self.roomItems = {}
+        self.roomStatus = service.RoomStatus()
         self.currentRoom = None
         self.currentBuilding = None
+        self.pendingReservation = None
 
         # Main layout
         mainLayout = QtWidgets.QVBoxLayout(self)
 
-        # Real-time clock display
+        # Loading indicator and real-time clock display
+        headerLayout = QtWidgets.QHBoxLayout()
+        self.statusLabel = QtWidgets.QLabel(self)
+        headerLayout.addWidget(self.statusLabel)
+        if self.profiler is not None:
+            self.initProfiling(headerLayout)
         self.clockLabel = QtWidgets.QLabel(self)
-        mainLayout.addWidget(self.clockLabel, alignment=QtCore.Qt.AlignRight)
+        headerLayout.addWidget(self.clockLabel, alignment=QtCore.Qt.AlignRight)
+        mainLayout.addLayout(headerLayout)
 
         # Building Selection
         self.buildingCombo = QtWidgets.QComboBox()
@@ -79,17 +158,19 @@ class RoomReservationApp(QtWidgets.QWidget):
         filterLayout.addWidget(QtWidgets.QLabel("Capacity:"))
         filterLayout.addWidget(self.capacitySpin)
 
-        self.featuresCombo = QtWidgets.QComboBox()
-        self.featuresCombo.addItems(["Any", "Audio", "Display", "Video"])
-        self.featuresCombo.currentIndexChanged.connect(self.filterRooms)
+        self.featuresCombo = FeatureComboBox()
+        self.featuresCombo.selectionChanged.connect(self.filterRooms)
         filterLayout.addWidget(QtWidgets.QLabel("Features:"))
         filterLayout.addWidget(self.featuresCombo)
 
         mainLayout.addLayout(filterLayout)
 
-        # Room List
+        # Room List, and the same rooms on a timeline
+        self.roomTabs = QtWidgets.QTabWidget()
         self.roomList = QtWidgets.QListWidget()
-        mainLayout.addWidget(self.roomList)
+        self.roomTabs.addTab(self.roomList, "Status")
+        self.roomTabs.addTab(self.initTimeline(), "Timeline")
+        mainLayout.addWidget(self.roomTabs)
 
         # Buttons
         buttonLayout = QtWidgets.QHBoxLayout()
@@ -110,6 +191,14 @@ class RoomReservationApp(QtWidgets.QWidget):
         self.viewReservationsButton.clicked.connect(self.openViewReservationsDialog)
         buttonLayout.addWidget(self.viewReservationsButton)
 
+        self.findFreeRoomButton = QtWidgets.QPushButton('Find Free Room', self)
+        self.findFreeRoomButton.clicked.connect(self.openFindFreeRoomDialog)
+        buttonLayout.addWidget(self.findFreeRoomButton)
+
+        self.utilizationButton = QtWidgets.QPushButton('Utilization', self)
+        self.utilizationButton.clicked.connect(self.openUtilizationDialog)
+        buttonLayout.addWidget(self.utilizationButton)
+
         self.deleteRoomsButton = QtWidgets.QPushButton('Delete Rooms', self)
         self.deleteRoomsButton.clicked.connect(self.openDeleteRoomsDialog)
         buttonLayout.addWidget(self.deleteRoomsButton)
@@ -123,136 +212,308 @@ class RoomReservationApp(QtWidgets.QWidget):
         self.setLayout(mainLayout)
         self.show()
 
+        # The clock only needs to wake once a minute; room statuses are
+        # flipped by a separate timer armed for the next reservation boundary.
+        self.clockTimer = QtCore.QTimer(self)
+        self.clockTimer.setSingleShot(True)
+        self.clockTimer.timeout.connect(self.updateClock)
+        self.transitionTimer = QtCore.QTimer(self)
+        self.transitionTimer.setSingleShot(True)
+        self.transitionTimer.timeout.connect(self.applyTransitions)
+
         # Move the call to updateClock here after the UI is initialized
         self.updateClock()
-        self.timer = QtCore.QTimer(self)
-        self.timer.timeout.connect(self.updateClock)
-        self.timer.start(1000)
+
+    def initTimeline(self):
+        page = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout(page)
+        controls = QtWidgets.QHBoxLayout()
+
+        self.timelineDate = QtWidgets.QDateEdit(QtCore.QDate.currentDate())
+        self.timelineDate.setCalendarPopup(True)
+        self.timelineDate.dateChanged.connect(self.showTimelineRange)
+        self.timelineSpan = QtWidgets.QComboBox()
+        self.timelineSpan.addItem("Day", userData=1)
+        self.timelineSpan.addItem("Week", userData=7)
+        self.timelineSpan.currentIndexChanged.connect(self.showTimelineRange)
+        previousButton = QtWidgets.QPushButton("◀")
+        previousButton.clicked.connect(lambda: self.stepTimeline(-1))
+        todayButton = QtWidgets.QPushButton("Today")
+        todayButton.clicked.connect(lambda: self.timelineDate.setDate(QtCore.QDate.currentDate()))
+        nextButton = QtWidgets.QPushButton("▶")
+        nextButton.clicked.connect(lambda: self.stepTimeline(1))
+        for widget in (previousButton, todayButton, nextButton, self.timelineDate, self.timelineSpan):
+            controls.addWidget(widget)
+
+        legend = QtWidgets.QLabel(" ".join(f"<span style='color:{color.name()}'>■</span>&nbsp;{level}"
+                                           for level, color in PRIORITY_COLORS.items()))
+        legend.setToolTip("\n".join(f"{level} - {meeting_type}" for level, meeting_type in MEETING_TYPES.items()))
+        controls.addStretch()
+        controls.addWidget(QtWidgets.QLabel("Priority:"))
+        controls.addWidget(legend)
+        layout.addLayout(controls)
+
+        self.timeline = TimelineView(self.rooms)
+        self.timeline.setToolTip("Click or drag across free time to book; Ctrl+wheel zooms")
+        self.timeline.bookingRequested.connect(self.bookFromTimeline)
+        layout.addWidget(self.timeline)
+        return page
+
+    def showTimelineRange(self):
+        first_day = to_minutes(datetime.combine(self.timelineDate.date().toPyDate(), datetime.min.time())) // DAY
+        self.timeline.setRange(first_day, self.timelineSpan.currentData())
+
+    def stepTimeline(self, direction):
+        self.timelineDate.setDate(self.timelineDate.date().addDays(direction * self.timelineSpan.currentData()))
+
+    def bookFromTimeline(self, room, start, end):
+        self.showPrefilledReservation(room, from_minutes(start), from_minutes(end))
+
+    def initProfiling(self, headerLayout):
+        self.profileButton = QtWidgets.QToolButton(self)
+        self.profileButton.setAutoRaise(True)
+        self.profileButton.setToolTip("Open the profiler panel (Ctrl+Shift+P)")
+        self.profileButton.clicked.connect(self.openProfilerDialog)
+        QtWidgets.QShortcut(QtGui.QKeySequence("Ctrl+Shift+P"), self, self.openProfilerDialog)
+        headerLayout.addWidget(self.profileButton)
+        # A heartbeat that fires late means a handler held the event loop.
+        self.heartbeatTimer = QtCore.QTimer(self)
+        self.heartbeatTimer.timeout.connect(lambda: self.profiler.heartbeat(instrument.HEARTBEAT_MS))
+        self.heartbeatTimer.start(instrument.HEARTBEAT_MS)
+        self.profileTimer = QtCore.QTimer(self)
+        self.profileTimer.timeout.connect(lambda: self.profileButton.setText(self.profiler.readout()))
+        self.profileTimer.start(PROFILE_READOUT_MS)
+
+    def openProfilerDialog(self):
+        dialog = ProfilerDialog(self.profiler, self)
+        dialog.exec_()
 
     def initDB(self):
-        self.conn = sqlite3.connect('rooms.db')
-        self.cursor = self.conn.cursor()
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS buildings (
-                id INTEGER PRIMARY KEY,
-                name TEXT
-            )
-        ''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS rooms (
-                id INTEGER PRIMARY KEY,
-                name TEXT,
-                building_id INTEGER,
-                floor INTEGER,
-                capacity INTEGER,
-                features TEXT,
-                FOREIGN KEY(building_id) REFERENCES buildings(id)
-            )
-        ''')
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS reservations (
-                id INTEGER PRIMARY KEY,
-                room_id INTEGER,
-                start_time TEXT,
-                end_time TEXT,
-                teacher_name TEXT,
-                student_name TEXT,
-                purpose TEXT,
-                FOREIGN KEY(room_id) REFERENCES rooms(id)
-            )
-        ''')
-        self.conn.commit()
+        # All queries run on the worker's threads; results come back to the
+        # slots below through queued signals.
+        self.worker = DatabaseWorker(DB_PATH, parent=self)
+        self.worker.busyChanged.connect(self.showBusy)
+        self.worker.failed.connect(self.showDatabaseError)
+        self.reservationSync = None
+        self.availability = None
+        self.featureCatalog = None
+        # Other instances sharing the database are noticed through
+        # PRAGMA data_version and merged in by the usual incremental loads.
+        self.externalChanges = None
+        self.roomsSignature = None
+        self.pollTimer = QtCore.QTimer(self)
+        self.pollTimer.timeout.connect(self.pollExternalChanges)
+        self.pollTimer.start(EXTERNAL_POLL_MS)
+        self.archiveTimer = QtCore.QTimer(self)
+        self.archiveTimer.setSingleShot(True)
+        self.archiveTimer.timeout.connect(self.archiveReservations)
+        self.archiveTimer.start(ARCHIVE_START_MS)
+
+    def archiveReservations(self):
+        self.worker.write(_archive_batch, self.archiveAfterDays, channel='archive', done=self.reservationsArchived,
+                          quiet=True)
+
+    def reservationsArchived(self, result):
+        # Each batch is its own write job, so bookings still get through
+        # between batches of a large backlog.
+        moved, pruned = result
+        backlog = moved == archive.BATCH_SIZE or pruned == archive.PRUNE_BATCH_SIZE
+        self.archiveTimer.start(0 if backlog else ARCHIVE_INTERVAL_MS)
+        if moved:
+            # Our own commits do not show up through pollExternalChanges.
+            self.loadReservations()
+
+    def pollExternalChanges(self):
+        def poll(conn):
+            if self.externalChanges is None:
+                self.externalChanges = ExternalChanges(conn)
+            elif not self.externalChanges.poll():
+                return None
+            return service.rooms_signature(conn)
+        self.worker.write(poll, channel='external-changes', done=self.externalChangesPolled, quiet=True)
+
+    def externalChangesPolled(self, signature):
+        if signature is None:
+            return
+        if self.roomsSignature is not None and signature != self.roomsSignature:
+            self.loadBuildings()
+        else:
+            self.loadReservations()
+        self.roomsSignature = signature
+
+    def showBusy(self, busy):
+        self.statusLabel.setText("Loading…" if busy else "")
+
+    def showDatabaseError(self, error):
+        QtWidgets.QMessageBox.warning(self, "Database Error", str(error))
+
+    def loadFeatures(self):
+        self.worker.read(FeatureCatalog, channel='features', done=self.showFeatures)
+
+    def showFeatures(self, catalog):
+        self.featureCatalog = catalog
+        self.featuresCombo.setFeatures(catalog.names)
 
     def loadBuildings(self):
+        self.loadFeatures()
+        self.worker.read(service.fetch_buildings, channel='buildings', done=self.showBuildings)
+
+    def showBuildings(self, rows):
+        selected = self.buildingCombo.currentData()
+        self.buildingCombo.blockSignals(True)
         self.buildingCombo.clear()
         self.buildingCombo.addItem("Select Building")
-        self.cursor.execute('SELECT * FROM buildings')
-        for row in self.cursor.fetchall():
-            building_id, name = row
+        for building_id, name in rows:
             self.buildingCombo.addItem(name, userData=building_id)
+        self.buildingCombo.setCurrentIndex(max(0, self.buildingCombo.findData(selected)))
+        self.buildingCombo.blockSignals(False)
         self.loadRooms()
 
     def loadRooms(self):
         self.rooms.clear()
+        self.roomItems.clear()
         self.roomList.clear()
+        self.timeline.setRooms([])
+        self.timeline.invalidate()
+        self.roomStatus.reset((), now_minutes())
+        self.reservationSync = None
         self.currentBuilding = self.buildingCombo.currentData()
-        if self.currentBuilding:
-            self.cursor.execute('SELECT * FROM rooms WHERE building_id=?', (self.currentBuilding,))
-            for row in self.cursor.fetchall():
-                room_id, name, building_id, floor, capacity, features = row
-                self.rooms[name] = {
-                    'id': room_id,
-                    'building_id': building_id,
-                    'floor': floor,
-                    'capacity': capacity,
-                    'features': features.split(","),
-                    'status': 'vacant',
-                    'label': name,
-                    'reserved_slots': []
-                }
-            self.loadReservations()
-            self.filterRooms()
+        if not self.currentBuilding:
+            self.worker.cancel('rooms')
+            return
+        loading = QtWidgets.QListWidgetItem("Loading rooms…")
+        loading.setFlags(QtCore.Qt.NoItemFlags)
+        self.roomList.addItem(loading)
+        # A newer building choice supersedes this job on the 'rooms' channel.
+        self.worker.write(_load_building, self.currentBuilding, channel='rooms', done=self.showRooms)
+
+    def showRooms(self, result):
+        rows, feature_masks, sync, changes = result
+        self.roomList.clear()
+        self.roomStatus.reset(rows, now_minutes())
+        # The window's room dicts are RoomStatus's own, so both see the same
+        # status and bookings.
+        for room_id, info in self.roomStatus.rooms.items():
+            info.update(feature_mask=feature_masks.get(room_id, 0), label=info['name'],
+                        reserved_slots=self.roomStatus.slots[room_id], series=self.roomStatus.series[room_id])
+            self.rooms[info['name']] = info
+        self.reservationSync = sync
+        self.applyReservationChanges(sync, changes)
+        self.filterRooms()
+        if self.pendingReservation is not None:
+            room, start, end = self.pendingReservation
+            self.pendingReservation = None
+            self.showPrefilledReservation(room, start, end)
 
     def loadReservations(self):
-        self.cursor.execute('SELECT * FROM reservations')
-        for row in self.cursor.fetchall():
-            res_id, room_id, start_time, end_time, teacher_name, student_name, purpose = row
-            for room in self.rooms.values():
-                if room['id'] == room_id:
-                    room['reserved_slots'].append({
-                        'start_time': start_time,
-                        'end_time': end_time,
-                        'teacher_name': teacher_name,
-                        'student_name': student_name,
-                        'purpose': purpose
-                    })
-                    break
+        sync = self.reservationSync
+        if sync is None:
+            return
+        self.worker.write(_sync_reservations, sync,
+                          done=lambda changes: self.applyReservationChanges(sync, changes))
+
+    def applyReservationChanges(self, sync, changes):
+        # Deltas of a building that is no longer shown are dropped.
+        if sync is not self.reservationSync:
+            return
+        current_minute = now_minutes()
+        changed = self.roomStatus.apply(changes, current_minute)
+        self.timeline.invalidate(self.roomNames(changed))
+        self.refreshRoomItems(self.roomNames(self.roomStatus.update_statuses(changed, current_minute)))
+        self.armTransitionTimer()
+
+    def roomNames(self, room_ids):
+        return [self.roomStatus.rooms[room_id]['name'] for room_id in room_ids]
+
+    def slideSeriesWindow(self):
+        # Recurring series are only expanded around today; RoomStatus moves
+        # the window on once the day is over.
+        current_minute = now_minutes()
+        slid = self.roomStatus.slide_window(current_minute)
+        if slid:
+            self.refreshRoomItems(self.roomNames(self.roomStatus.update_statuses(slid, current_minute)))
+            self.armTransitionTimer()
 
     def saveState(self):
-        self.conn.commit()
-        print("State saved to database.")
+        self.worker.write(_commit, done=lambda result: print("State saved to database."))
 
     def updateClock(self):
         currentTime = time.strftime('%Y-%m-%d %H:%M', time.localtime())
         self.clockLabel.setText(currentTime)
-        self.checkReservations(currentTime)
+        self.clockTimer.start(int((60 - time.time() % 60) * 1000) + 50)
+        # Moves the timeline's now line; its cached rows stay as they are.
+        self.timeline.viewport().update()
+        self.slideSeriesWindow()
 
     def filterRooms(self):
-        self.roomList.clear()
         building = self.buildingCombo.currentText()
         floor = self.floorCombo.currentText()
         capacity = self.capacitySpin.value()
-        features = self.featuresCombo.currentText()
+        features = self.featuresCombo.checkedMask()
 
+        for room in [room for room in self.roomItems if room not in self.rooms]:
+            self.roomList.takeItem(self.roomList.row(self.roomItems.pop(room)))
+
+        # Rows are created once per room and only shown/hidden here; their
+        # text is refreshed by refreshRoomItems when a status changes.
+        shown = []
         for room, info in self.rooms.items():
-            if building != "Any" and info['building_id'] != self.currentBuilding:
-                continue
-            if floor != "Any" and str(info['floor']) != floor:
-                continue
-            if capacity != 0 and info['capacity'] < capacity:
-                continue
-            if features != "Any" and features not in info['features']:
-                continue
-            roomItem = QtWidgets.QListWidgetItem(f"{info['label']} - {'vacant' if info['status'] == 'vacant' else 'occupied'}")
-            self.roomList.addItem(roomItem)
+            item = self.roomItems.get(room)
+            if item is None:
+                item = QtWidgets.QListWidgetItem(self.roomItemText(info))
+                self.roomList.addItem(item)
+                self.roomItems[room] = item
+            hidden = not self.roomMatches(info, building, floor, capacity, features)
+            if item.isHidden() != hidden:
+                item.setHidden(hidden)
+            if not hidden:
+                shown.append(room)
+        self.timeline.setRooms(shown)
+
+    def roomMatches(self, info, building, floor, capacity, features):
+        if building != "Any" and info['building_id'] != self.currentBuilding:
+            return False
+        if floor != "Any" and str(info['floor']) != floor:
+            return False
+        if capacity != 0 and info['capacity'] < capacity:
+            return False
+        if info['feature_mask'] & features != features:
+            return False
+        return True
+
+    def roomItemText(self, info):
+        return f"{info['label']} - {'vacant' if info['status'] == 'vacant' else 'occupied'}"
+
+    def refreshRoomItems(self, rooms):
+        for room in rooms:
+            item = self.roomItems.get(room)
+            if item is not None:
+                item.setText(self.roomItemText(self.rooms[room]))
 
     def checkReservations(self, currentTime):
-        current_time = datetime.strptime(currentTime, '%Y-%m-%d %H:%M')
-        for room, info in self.rooms.items():
-            reserved_slots = info.get('reserved_slots', [])
-            is_occupied = any(
-                datetime.strptime(slot['start_time'], '%Y-%m-%d %H:%M') <= current_time < datetime.strptime(slot['end_time'], '%Y-%m-%d %H:%M')
-                for slot in reserved_slots
-            )
-            info['status'] = 'occupied' if is_occupied else 'vacant'
-        self.filterRooms()
+        current_minute = to_minutes(currentTime)
+        self.refreshRoomItems(self.roomNames(self.roomStatus.update_statuses(self.roomStatus.rooms, current_minute)))
+        self.roomStatus.scheduler.reset(current_minute)
+        self.armTransitionTimer()
+
+    def applyTransitions(self):
+        current_minute = now_minutes()
+        due = self.roomStatus.pop_due(current_minute)
+        self.refreshRoomItems(self.roomNames(self.roomStatus.update_statuses(due, current_minute)))
+        self.armTransitionTimer()
+
+    def armTransitionTimer(self):
+        self.transitionTimer.stop()
+        boundary = self.roomStatus.next_due()
+        if boundary is None:
+            return
+        delay_ms = int((from_minutes(boundary) - datetime.now()).total_seconds() * 1000) + 50
+        self.transitionTimer.start(max(0, min(delay_ms, MAX_TIMER_MS)))
 
     def createBuilding(self):
         building_name, ok = QtWidgets.QInputDialog.getText(self, 'Create Building', 'Enter building name:')
         if ok and building_name:
-            self.cursor.execute('INSERT INTO buildings (name) VALUES (?)', (building_name,))
-            self.conn.commit()
-            self.loadBuildings()
+            self.worker.write(service.insert_building, building_name, done=lambda result: self.loadBuildings())
 
     def openCreateRoomDialog(self):
         if not self.currentBuilding:
@@ -260,6 +521,7 @@ class RoomReservationApp(QtWidgets.QWidget):
             return
         dialog = CreateRoomDialog(self.currentBuilding, self)
         dialog.exec_()
+        self.loadFeatures()
         self.loadRooms()
 
     def enableRoomReservation(self):
@@ -273,23 +535,60 @@ class RoomReservationApp(QtWidgets.QWidget):
         self.filterRooms()
         print("Room reservation enabled.")
 
-    def reserveRoom(self, room, date, start_time, end_time, teacher_name, student_name, purpose):
+    def reserveRoom(self, room, date, start_time, end_time, teacher_name, student_name, purpose, priority=LOWEST_PRIORITY,
+                    repeat=None, until=None, done=None):
+        # Booking runs as a write job; `done` is called with True or False
+        # once the outcome has been shown.
         room_id = self.rooms[room]['id']
         start_datetime = f"{date} {start_time}"
         end_datetime = f"{date} {end_time}"
 
-        # Convert the start and end times to 24-hour format before storing
-        start_time_24 = datetime.strptime(start_datetime, '%Y-%m-%d %I:%M %p').strftime('%Y-%m-%d %H:%M')
-        end_time_24 = datetime.strptime(end_datetime, '%Y-%m-%d %I:%M %p').strftime('%Y-%m-%d %H:%M')
-
-        self.cursor.execute('''
-            INSERT INTO reservations (room_id, start_time, end_time, teacher_name, student_name, purpose)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (room_id, start_time_24, end_time_24, teacher_name, student_name, purpose))
-        self.conn.commit()
+        # Convert the start and end times to epoch minutes before storing
+        start_minute = to_minutes(datetime.strptime(start_datetime, '%Y-%m-%d %I:%M %p'))
+        end_minute = to_minutes(datetime.strptime(end_datetime, '%Y-%m-%d %I:%M %p'))
+
+        booking = {
+            'room_id': room_id,
+            'start_minute': start_minute,
+            'end_minute': end_minute,
+            'teacher_name': teacher_name,
+            'student_name': student_name,
+            'purpose': purpose,
+            'priority': priority
+        }
+        description = f"from {start_datetime} to {end_datetime}{f' ({repeat} until {until})' if repeat else ''}"
+        finished = done or (lambda ok: None)
+        if repeat:
+            # The series runs through the whole `until` day.
+            booking = dict(booking, duration=end_minute - start_minute, frequency=repeat,
+                           until_minute=to_minutes(datetime.strptime(until, '%Y-%m-%d')) + DAY)
+        self.worker.write(service.book, booking,
+                          done=lambda result: finished(self.reservationBooked(room, description, result)),
+                          failed=lambda error: finished(self.reservationFailed(room, error)))
+
+    def reservationBooked(self, room, description, result):
         self.loadReservations()
         self.filterRooms()
-        print(f"Room '{room}' reserved from {start_datetime} to {end_datetime}.")
+        if result['displaced']:
+            details = "\n".join(f"{format_minutes(c['start_minute'])} - {format_minutes(c['end_minute'])} ({priority_label(c['priority'])})"
+                                for c in result['displaced'])
+            QtWidgets.QMessageBox.information(self, "Reservations Displaced",
+                                              f"These lower priority reservations of '{room}' were removed:\n{details}")
+        print(f"Room '{room}' reserved {description}.")
+        return True
+
+    def reservationFailed(self, room, error):
+        if isinstance(error, BookingConflict):
+            details = "\n".join(f"{format_minutes(c['start_minute'])} - {format_minutes(c['end_minute'])} "
+                                f"({'recurring, ' if 'series_id' in c else ''}{priority_label(c['priority'])})"
+                                for c in error.conflicts)
+            QtWidgets.QMessageBox.warning(self, "Room Already Booked",
+                                          f"'{room}' is already booked by an equal or higher priority meeting:\n{details}")
+        elif isinstance(error, ValueError):
+            QtWidgets.QMessageBox.warning(self, "Invalid Time", str(error))
+        else:
+            self.showDatabaseError(error)
+        return False
 
     def deleteRoom(self):
         selected_room_item = self.roomList.currentItem()
@@ -301,14 +600,14 @@ class RoomReservationApp(QtWidgets.QWidget):
                                                           QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No)
             if confirmation == QtWidgets.QMessageBox.Yes:
                 room_id = self.rooms[room_name]['id']
-                self.cursor.execute('DELETE FROM reservations WHERE room_id=?', (room_id,))
-                self.cursor.execute('DELETE FROM rooms WHERE id=?', (room_id,))
-                self.conn.commit()
-                self.loadRooms()
-                QtWidgets.QMessageBox.information(self, "Room Deleted", f"The room '{room_name}' has been deleted.")
+                self.worker.write(service.delete_rooms, [room_id], done=lambda result: self.roomDeleted(room_name))
         else:
             QtWidgets.QMessageBox.warning(self, "No Selection", "Please select a room to delete.")
 
+    def roomDeleted(self, room_name):
+        self.loadRooms()
+        QtWidgets.QMessageBox.information(self, "Room Deleted", f"The room '{room_name}' has been deleted.")
+
     def openDeleteRoomsDialog(self):
         dialog = DeleteRoomsDialog(self.rooms, self)
         dialog.exec_()
@@ -318,6 +617,88 @@ class RoomReservationApp(QtWidgets.QWidget):
         dialog = ViewReservationsDialog(self)
         dialog.exec_()
 
+    def openFindFreeRoomDialog(self):
+        dialog = FindFreeRoomDialog(self)
+        dialog.exec_()
+
+    def openUtilizationDialog(self):
+        dialog = UtilizationDialog(self)
+        dialog.exec_()
+
+    def findFreeRooms(self, done, start_minute, end_minute, duration, **filters):
+        # The index keeps the writer connection, so it is built and searched
+        # only from write jobs.
+        def search(conn):
+            if self.availability is None:
+                self.availability = AvailabilityIndex(conn)
+            return self.availability.search(start_minute, end_minute, duration, **filters)
+        self.worker.write(search, channel='free-rooms', done=done)
+
+    def openPrefilledReservation(self, building_id, room, start, end):
+        # Switch to the room's building first so the dialog can offer it; its
+        # rooms arrive asynchronously and showRooms opens the dialog then.
+        index = self.buildingCombo.findData(building_id)
+        if index >= 0 and index != self.buildingCombo.currentIndex():
+            self.pendingReservation = (room, start, end)
+            self.buildingCombo.setCurrentIndex(index)
+            return
+        self.showPrefilledReservation(room, start, end)
+
+    def showPrefilledReservation(self, room, start, end):
+        if room not in self.rooms:
+            return
+        dialog = ReserveRoomDialog(self.rooms, self, room, start, end)
+        dialog.exec_()
+
+class FeatureComboBox(QtWidgets.QComboBox):
+    # Multi-select combo: every catalogue feature is a checkable item and the
+    # closed box lists the checked ones.
+    selectionChanged = QtCore.pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setModel(QtGui.QStandardItemModel(self))
+        self.setEditable(True)
+        self.lineEdit().setReadOnly(True)
+        self.view().viewport().installEventFilter(self)
+        self.updateText()
+
+    def setFeatures(self, names):
+        checked = self.checkedMask()
+        self.model().clear()
+        for feature_id, name in names.items():
+            item = QtGui.QStandardItem(name)
+            item.setData(feature_id, QtCore.Qt.UserRole)
+            item.setFlags(QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsUserCheckable)
+            item.setCheckState(QtCore.Qt.Checked if checked & feature_bit(feature_id) else QtCore.Qt.Unchecked)
+            self.model().appendRow(item)
+        self.updateText()
+
+    def eventFilter(self, obj, event):
+        # Toggle on click and keep the popup open for further choices.
+        if obj is self.view().viewport() and event.type() == QtCore.QEvent.MouseButtonRelease:
+            item = self.model().itemFromIndex(self.view().indexAt(event.pos()))
+            if item is not None:
+                item.setCheckState(QtCore.Qt.Unchecked if item.checkState() == QtCore.Qt.Checked
+                                   else QtCore.Qt.Checked)
+                self.updateText()
+                self.selectionChanged.emit()
+            return True
+        return super().eventFilter(obj, event)
+
+    def checkedMask(self):
+        mask = 0
+        for row in range(self.model().rowCount()):
+            item = self.model().item(row)
+            if item.checkState() == QtCore.Qt.Checked:
+                mask |= feature_bit(item.data(QtCore.Qt.UserRole))
+        return mask
+
+    def updateText(self):
+        names = [self.model().item(row).text() for row in range(self.model().rowCount())
+                 if self.model().item(row).checkState() == QtCore.Qt.Checked]
+        self.lineEdit().setText(", ".join(names) or "Any")
+
 class CreateRoomDialog(QtWidgets.QDialog):
     def __init__(self, building_id, parent=None):
         super().__init__(parent)
@@ -353,21 +734,27 @@ class CreateRoomDialog(QtWidgets.QDialog):
         features = self.features.text()
 
         if room_name:
-            conn = sqlite3.connect('rooms.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO rooms (name, building_id, floor, capacity, features)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (room_name, self.building_id, floor, capacity, features))
-            conn.commit()
-            conn.close()
-            self.accept()
+            self.createButton.setEnabled(False)
+            self.parent().worker.write(service.insert_room, room_name, self.building_id, floor, capacity, features,
+                                       done=lambda result: self.accept(),
+                                       failed=self.createFailed)
+
+    def createFailed(self, error):
+        self.createButton.setEnabled(True)
+        self.parent().showDatabaseError(error)
 
 class ReserveRoomDialog(QtWidgets.QDialog):
-    def __init__(self, rooms, parent=None):
+    def __init__(self, rooms, parent=None, room=None, start=None, end=None):
         super().__init__(parent)
         self.rooms = rooms
         self.initUI()
+        if room is not None:
+            self.roomCombo.setCurrentText(room)
+        if start is not None:
+            self.dateEdit.setDate(start.date())
+            self.startTimeEdit.setTime(start.time())
+        if end is not None:
+            self.endTimeEdit.setTime(end.time())
 
     def initUI(self):
         self.setWindowTitle("Reserve Room")
@@ -391,6 +778,22 @@ class ReserveRoomDialog(QtWidgets.QDialog):
         self.studentName = QtWidgets.QLineEdit(self)
         self.purpose = QtWidgets.QLineEdit(self)
 
+        self.priorityCombo = QtWidgets.QComboBox(self)
+        for level, meeting_type in MEETING_TYPES.items():
+            self.priorityCombo.addItem(f"{level} - {meeting_type}", userData=level)
+
+        self.repeatCombo = QtWidgets.QComboBox(self)
+        self.repeatCombo.addItem("Does not repeat", userData=None)
+        for frequency in FREQUENCIES:
+            self.repeatCombo.addItem(frequency.capitalize(), userData=frequency)
+
+        self.untilEdit = QtWidgets.QDateEdit(self)
+        self.untilEdit.setCalendarPopup(True)
+        self.untilEdit.setDate(QtCore.QDate.currentDate().addMonths(3))
+        self.untilEdit.setEnabled(False)
+        self.repeatCombo.currentIndexChanged.connect(
+            lambda: self.untilEdit.setEnabled(self.repeatCombo.currentData() is not None))
+
         layout.addRow("Room:", self.roomCombo)
         layout.addRow("Date:", self.dateEdit)
         layout.addRow("Start Time:", self.startTimeEdit)
@@ -398,6 +801,9 @@ class ReserveRoomDialog(QtWidgets.QDialog):
         layout.addRow("Name of Teacher:", self.teacherName)
         layout.addRow("Student:", self.studentName)
         layout.addRow("Purpose:", self.purpose)
+        layout.addRow("Meeting Type:", self.priorityCombo)
+        layout.addRow("Repeat:", self.repeatCombo)
+        layout.addRow("Until:", self.untilEdit)
 
         self.submitButton = QtWidgets.QPushButton("Submit", self)
         self.submitButton.clicked.connect(self.submitForm)
@@ -413,16 +819,99 @@ class ReserveRoomDialog(QtWidgets.QDialog):
         teacher_name = self.teacherName.text()
         student_name = self.studentName.text()
         purpose = self.purpose.text()
+        priority = self.priorityCombo.currentData()
+        repeat = self.repeatCombo.currentData()
+        until = self.untilEdit.date().toString('yyyy-MM-dd') if repeat else None
 
         if room and date and start_time and end_time and teacher_name and student_name and purpose:
-            self.parent().reserveRoom(room, date, start_time, end_time, teacher_name, student_name, purpose)
-            self.accept()
+            self.submitButton.setEnabled(False)
+            self.parent().reserveRoom(room, date, start_time, end_time, teacher_name, student_name, purpose, priority,
+                                      repeat, until, done=self.reservationFinished)
         else:
             QtWidgets.QMessageBox.warning(self, "Incomplete Data", "Please fill all fields.")
 
+    def reservationFinished(self, ok):
+        if ok:
+            self.accept()
+        else:
+            self.submitButton.setEnabled(True)
+
+class ReservationTableModel(QtCore.QAbstractTableModel):
+    # Rows come from ReservationQuery one page at a time as the view scrolls,
+    # each page a read job; cells are only formatted when the view asks for them.
+    def __init__(self, worker, parent=None):
+        super().__init__(parent)
+        self.worker = worker
+        self.channel = ('reservation-page', id(self))
+        self.sortOrder = (1, False)
+        self.filters = {}
+        self.rows = []
+        self.exhausted = False
+        self.loading = False
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(RESERVATION_COLUMNS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return RESERVATION_COLUMNS[section][0]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role != QtCore.Qt.DisplayRole:
+            return None
+        value = self.rows[index.row()][index.column() + 2]
+        if index.column() in (1, 2):
+            return from_minutes(value).strftime('%Y-%m-%d %I:%M %p')
+        return value
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid() or self.loading:
+            return
+        self.loading = True
+        self.worker.read(_reservation_page, self.sortOrder, self.filters, self.rows[-1] if self.rows else None,
+                         channel=self.channel, done=self.addPage)
+
+    def addPage(self, page):
+        self.loading = False
+        if len(page) < PAGE_SIZE:
+            self.exhausted = True
+        if page:
+            self.beginInsertRows(QtCore.QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.endInsertRows()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self.sortOrder = (column, order == QtCore.Qt.DescendingOrder)
+        self.refresh()
+
+    def setFilters(self, **filters):
+        self.filters = filters
+        self.refresh()
+
+    def refresh(self):
+        # Starting over supersedes any page still in flight.
+        self.beginResetModel()
+        self.rows = []
+        self.exhausted = False
+        self.loading = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def reservationId(self, row):
+        return self.rows[row][1]
+
 class ViewReservationsDialog(QtWidgets.QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
+        # A new dialog opens every time; deleting it also drops its busyChanged connection.
+        self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
         self.initUI()
         self.loadReservations()
 
@@ -430,47 +919,196 @@ class ViewReservationsDialog(QtWidgets.QDialog):
         self.setWindowTitle("Current Reservations")
         self.layout = QtWidgets.QVBoxLayout(self)
 
-        self.reservationsTable = QtWidgets.QTableWidget(self)
-        self.reservationsTable.setColumnCount(6)
-        self.reservationsTable.setHorizontalHeaderLabels(["Room", "Start Time", "End Time", "Teacher", "Student", "Purpose"])
+        self.searchEdit = QtWidgets.QLineEdit(self)
+        self.searchEdit.setPlaceholderText("Search teacher, student or purpose")
+        self.searchEdit.setClearButtonEnabled(True)
+        self.searchTimer = QtCore.QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(SEARCH_DELAY_MS)
+        self.searchTimer.timeout.connect(self.searchChanged)
+        self.searchEdit.textChanged.connect(self.searchTimer.start)
+        self.layout.addWidget(self.searchEdit)
+
+        # Filtering Options
+        filterLayout = QtWidgets.QHBoxLayout()
+
+        self.roomCombo = QtWidgets.QComboBox(self)
+        self.roomCombo.addItem("Any", userData=None)
+        self.parent().worker.read(service.fetch_room_names, done=self.addRooms)
+        self.roomCombo.currentIndexChanged.connect(self.loadReservations)
+        filterLayout.addWidget(QtWidgets.QLabel("Room:"))
+        filterLayout.addWidget(self.roomCombo)
+
+        self.dateRangeCheck = QtWidgets.QCheckBox("From:", self)
+        self.dateRangeCheck.toggled.connect(self.loadReservations)
+        self.fromDate = QtWidgets.QDateEdit(QtCore.QDate.currentDate(), self)
+        self.fromDate.setCalendarPopup(True)
+        self.fromDate.dateChanged.connect(self.loadReservations)
+        self.toDate = QtWidgets.QDateEdit(QtCore.QDate.currentDate().addDays(7), self)
+        self.toDate.setCalendarPopup(True)
+        self.toDate.dateChanged.connect(self.loadReservations)
+        filterLayout.addWidget(self.dateRangeCheck)
+        filterLayout.addWidget(self.fromDate)
+        filterLayout.addWidget(QtWidgets.QLabel("To:"))
+        filterLayout.addWidget(self.toDate)
+
+        self.teacherEdit = QtWidgets.QLineEdit(self)
+        self.teacherEdit.setPlaceholderText("Teacher")
+        self.teacherEdit.editingFinished.connect(self.loadReservations)
+        filterLayout.addWidget(self.teacherEdit)
+
+        self.archivedCheck = QtWidgets.QCheckBox("Include archived", self)
+        self.archivedCheck.toggled.connect(self.loadReservations)
+        filterLayout.addWidget(self.archivedCheck)
+
+        self.layout.addLayout(filterLayout)
+
+        self.model = ReservationTableModel(self.parent().worker, self)
+        self.reservationsTable = QtWidgets.QTableView(self)
+        self.reservationsTable.setModel(self.model)
+        self.reservationsTable.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.reservationsTable.horizontalHeader().setSortIndicator(1, QtCore.Qt.AscendingOrder)
+        self.reservationsTable.setSortingEnabled(True)
+        self.reservationsTable.horizontalHeader().sectionClicked.connect(
+            lambda: self.reservationsTable.horizontalHeader().setSortIndicatorShown(True))
         self.layout.addWidget(self.reservationsTable)
 
         self.deleteButton = QtWidgets.QPushButton("Delete Selected", self)
         self.deleteButton.clicked.connect(self.deleteReservation)
         self.layout.addWidget(self.deleteButton)
 
+        self.statusLabel = QtWidgets.QLabel(self)
+        self.parent().worker.busyChanged.connect(self.showBusy)
+        self.layout.addWidget(self.statusLabel)
+
         self.setLayout(self.layout)
 
-    def loadReservations(self):
-        self.parent().cursor.execute('SELECT rooms.name, start_time, end_time, teacher_name, student_name, purpose FROM reservations JOIN rooms ON reservations.room_id = rooms.id')
-        reservations = self.parent().cursor.fetchall()
-        self.reservationsTable.setRowCount(len(reservations))
+    def addRooms(self, rows):
+        for room_id, name in rows:
+            self.roomCombo.addItem(name, userData=room_id)
+
+    def showBusy(self, busy):
+        self.statusLabel.setText("Loading…" if busy else f"{self.model.rowCount()} reservation(s) loaded")
+
+    def searchChanged(self):
+        # A new search lists the best matches first until a column is clicked.
+        header = self.reservationsTable.horizontalHeader()
+        if self.searchEdit.text().strip():
+            self.model.sortOrder = (RELEVANCE, False)
+            header.setSortIndicatorShown(False)
+        elif self.model.sortOrder[0] is RELEVANCE:
+            self.model.sortOrder = (1, False)
+            header.setSortIndicator(1, QtCore.Qt.AscendingOrder)
+            header.setSortIndicatorShown(True)
+        self.loadReservations()
 
-        for row_num, row_data in enumerate(reservations):
-            for col_num, data in enumerate(row_data):
-                if col_num == 1 or col_num == 2:
-                    data = datetime.strptime(data, '%Y-%m-%d %H:%M').strftime('%I:%M %p')
-                self.reservationsTable.setItem(row_num, col_num, QtWidgets.QTableWidgetItem(data))
+    def loadReservations(self):
+        start_from = start_to = None
+        if self.dateRangeCheck.isChecked():
+            start_from = to_minutes(datetime.combine(self.fromDate.date().toPyDate(), datetime.min.time()))
+            start_to = to_minutes(datetime.combine(self.toDate.date().toPyDate(), datetime.min.time())) + 24 * 60
+        self.model.setFilters(room_id=self.roomCombo.currentData(), start_from=start_from, start_to=start_to,
+                              teacher=self.teacherEdit.text().strip(), search=self.searchEdit.text(),
+                              include_archived=self.archivedCheck.isChecked())
 
     def deleteReservation(self):
-        selected_row = self.reservationsTable.currentRow()
-        if selected_row >= 0:
-            room_name = self.reservationsTable.item(selected_row, 0).text()
-            start_time = self.reservationsTable.item(selected_row, 1).text()
-            start_time_24 = datetime.strptime(start_time, '%I:%M %p').strftime('%H:%M')
-            start_datetime = f"{datetime.now().strftime('%Y-%m-%d')} {start_time_24}"
-            self.parent().cursor.execute('''
-                DELETE FROM reservations
-                WHERE room_id = (SELECT id FROM rooms WHERE name = ?) AND start_time = ?
-            ''', (room_name, start_datetime))
-            self.parent().conn.commit()
-            self.loadReservations()
-            self.parent().loadReservations()
-            self.parent().filterRooms()
-            QtWidgets.QMessageBox.information(self, "Deleted", "The reservation has been deleted.")
+        selected_rows = sorted({index.row() for index in self.reservationsTable.selectionModel().selectedRows()})
+        if selected_rows:
+            reservation_ids = [self.model.reservationId(row) for row in selected_rows]
+            self.parent().worker.write(service.delete_reservations, reservation_ids, done=self.reservationsDeleted)
         else:
             QtWidgets.QMessageBox.warning(self, "No Selection", "Please select a reservation to delete.")
 
+    def reservationsDeleted(self, result):
+        self.loadReservations()
+        self.parent().loadReservations()
+        self.parent().filterRooms()
+        QtWidgets.QMessageBox.information(self, "Deleted", "The reservation has been deleted.")
+
+class FindFreeRoomDialog(QtWidgets.QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.results = []
+        self.initUI()
+
+    def initUI(self):
+        self.setWindowTitle("Find Free Room")
+        layout = QtWidgets.QVBoxLayout(self)
+
+        formLayout = QtWidgets.QFormLayout()
+        self.capacitySpin = QtWidgets.QSpinBox(self)
+        self.capacitySpin.setRange(0, 1000)
+        self.featuresEdit = QtWidgets.QLineEdit(self)
+        self.featuresEdit.setPlaceholderText("e.g. Audio, Display")
+        self.durationSpin = QtWidgets.QSpinBox(self)
+        self.durationSpin.setRange(15, 24 * 60)
+        self.durationSpin.setSingleStep(15)
+        self.durationSpin.setValue(60)
+        self.durationSpin.setSuffix(" min")
+        now = QtCore.QDateTime.currentDateTime()
+        self.fromEdit = QtWidgets.QDateTimeEdit(now, self)
+        self.fromEdit.setCalendarPopup(True)
+        self.toEdit = QtWidgets.QDateTimeEdit(now.addDays(1), self)
+        self.toEdit.setCalendarPopup(True)
+        self.anyBuildingCheck = QtWidgets.QCheckBox("Any building", self)
+        self.anyBuildingCheck.setChecked(True)
+
+        formLayout.addRow("Capacity at least:", self.capacitySpin)
+        formLayout.addRow("Features:", self.featuresEdit)
+        formLayout.addRow("Duration:", self.durationSpin)
+        formLayout.addRow("Between:", self.fromEdit)
+        formLayout.addRow("And:", self.toEdit)
+        formLayout.addRow("", self.anyBuildingCheck)
+        layout.addLayout(formLayout)
+
+        self.searchButton = QtWidgets.QPushButton("Search", self)
+        self.searchButton.clicked.connect(self.search)
+        layout.addWidget(self.searchButton)
+
+        self.resultsTable = QtWidgets.QTableWidget(self)
+        self.resultsTable.setColumnCount(5)
+        self.resultsTable.setHorizontalHeaderLabels(["Building", "Room", "Capacity", "Start Time", "End Time"])
+        self.resultsTable.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectRows)
+        self.resultsTable.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.resultsTable.cellDoubleClicked.connect(self.reserveResult)
+        layout.addWidget(self.resultsTable)
+
+        self.setLayout(layout)
+
+    def search(self):
+        building_id = None if self.anyBuildingCheck.isChecked() else self.parent().currentBuilding
+        self.searchButton.setEnabled(False)
+        self.searchButton.setText("Searching…")
+        self.parent().findFreeRooms(
+            self.showResults,
+            to_minutes(self.fromEdit.dateTime().toPyDateTime()),
+            to_minutes(self.toEdit.dateTime().toPyDateTime()),
+            self.durationSpin.value(),
+            capacity=self.capacitySpin.value(),
+            features=self.featuresEdit.text().split(","),
+            building_id=building_id)
+
+    def showResults(self, results):
+        self.searchButton.setEnabled(True)
+        self.searchButton.setText("Search")
+        self.results = results
+        self.resultsTable.setRowCount(len(self.results))
+        for row_num, result in enumerate(self.results):
+            values = [result['building'], result['name'], str(result['capacity']),
+                      from_minutes(result['start_minute']).strftime('%Y-%m-%d %I:%M %p'),
+                      from_minutes(result['end_minute']).strftime('%I:%M %p')]
+            for col_num, value in enumerate(values):
+                self.resultsTable.setItem(row_num, col_num, QtWidgets.QTableWidgetItem(value))
+        if not self.results:
+            QtWidgets.QMessageBox.information(self, "No Rooms Found", "No room matches those requirements.")
+
+    def reserveResult(self, row, column):
+        result = self.results[row]
+        self.accept()
+        self.parent().openPrefilledReservation(result['building_id'], result['name'],
+                                               from_minutes(result['start_minute']),
+                                               from_minutes(result['end_minute']))
+
 class DeleteRoomsDialog(QtWidgets.QDialog):
     def __init__(self, rooms, parent=None):
         super().__init__(parent)
@@ -494,19 +1132,311 @@ class DeleteRoomsDialog(QtWidgets.QDialog):
         self.setLayout(layout)
 
     def deleteSelectedRooms(self):
-        for room, checkbox in self.checkboxes.items():
-            if checkbox.isChecked():
-                room_id = self.rooms[room]['id']
-                self.parent().cursor.execute('DELETE FROM reservations WHERE room_id=?', (room_id,))
-                self.parent().cursor.execute('DELETE FROM rooms WHERE id=?', (room_id,))
-        self.parent().conn.commit()
+        room_ids = [self.rooms[room]['id'] for room, checkbox in self.checkboxes.items() if checkbox.isChecked()]
+        self.deleteButton.setEnabled(False)
+        self.parent().worker.write(service.delete_rooms, room_ids, done=self.roomsDeleted)
+
+    def roomsDeleted(self, result):
         QtWidgets.QMessageBox.information(self, "Rooms Deleted", "The selected rooms have been deleted.")
         self.accept()
 
-def main():
-    app = QtWidgets.QApplication(sys.argv)
-    ex = RoomReservationApp()
-    sys.exit(app.exec_())
+class HeatmapModel(QtCore.QAbstractTableModel):
+    # Rooms down, hours of the week across; cells shaded by booked share,
+    # relative to the busiest cell so quiet buildings still show a pattern.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rooms = []
+        self.heat = None
+        self.colors = [QtGui.QColor(255 - round(255 * level / 100), 255 - round(135 * level / 100),
+                                    255 - round(40 * level / 100)) for level in range(101)]
+        self.scale = 1.0
+
+    def setHeatmap(self, rooms, heat):
+        self.beginResetModel()
+        self.rooms = rooms
+        self.heat = heat
+        self.scale = float(heat.max()) if len(heat) and heat.max() > 0 else 1.0
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return len(self.rooms)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return utilization.HOURS_PER_WEEK if self.rooms else 0
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return utilization.hour_label(section)
+        _, building, room = self.rooms[section]
+        return f"{building} · {room}"
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        value = self.heat[index.row(), index.column()]
+        if role == QtCore.Qt.DisplayRole:
+            return f"{value * 100:.0f}" if value else ""
+        if role == QtCore.Qt.BackgroundRole:
+            return self.colors[min(100, round(value / self.scale * 100))]
+        if role == QtCore.Qt.ToolTipRole:
+            _, building, room = self.rooms[index.row()]
+            return f"{building} · {room}, {utilization.hour_label(index.column())}: {value * 100:.1f}% booked"
+        return None
+
+class UtilizationDialog(QtWidgets.QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.columns = []
+        self.rows = []
+        self.initUI()
+        self.refresh()
+
+    def initUI(self):
+        self.setWindowTitle("Utilization")
+        self.resize(1000, 700)
+        layout = QtWidgets.QVBoxLayout(self)
+
+        filterLayout = QtWidgets.QHBoxLayout()
+        today = QtCore.QDate.currentDate()
+        self.fromDate = QtWidgets.QDateEdit(today.addDays(1 - utilization.DEFAULT_DAYS), self)
+        self.fromDate.setCalendarPopup(True)
+        self.toDate = QtWidgets.QDateEdit(today, self)
+        self.toDate.setCalendarPopup(True)
+        self.buildingCombo = QtWidgets.QComboBox(self)
+        self.buildingCombo.addItem("All buildings", userData=None)
+        self.parent().worker.read(service.fetch_buildings, done=self.addBuildings)
+        self.groupCombo = QtWidgets.QComboBox(self)
+        self.thenCombo = QtWidgets.QComboBox(self)
+        self.thenCombo.addItem("—", userData=None)
+        for name in utilization.GROUPS:
+            self.groupCombo.addItem(name.capitalize(), userData=name)
+            self.thenCombo.addItem(name.capitalize(), userData=name)
+        self.hoursSpin = QtWidgets.QDoubleSpinBox(self)
+        self.hoursSpin.setRange(0.5, 24)
+        self.hoursSpin.setSingleStep(0.5)
+        self.hoursSpin.setValue(utilization.HOURS_PER_DAY)
+        self.hoursSpin.setSuffix(" h/day")
+        self.hoursSpin.setToolTip("Open hours per room and day that utilization is measured against")
+        for label, widget in (("From:", self.fromDate), ("To:", self.toDate), ("Building:", self.buildingCombo),
+                              ("Group by:", self.groupCombo), ("Then by:", self.thenCombo), ("Open:", self.hoursSpin)):
+            filterLayout.addWidget(QtWidgets.QLabel(label))
+            filterLayout.addWidget(widget)
+        self.refreshButton = QtWidgets.QPushButton("Refresh", self)
+        self.refreshButton.clicked.connect(self.refresh)
+        filterLayout.addWidget(self.refreshButton)
+        layout.addLayout(filterLayout)
+
+        self.tabs = QtWidgets.QTabWidget(self)
+        self.reportTable = QtWidgets.QTableWidget(self)
+        self.reportTable.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.reportTable.setSortingEnabled(True)
+        self.tabs.addTab(self.reportTable, "Report")
+
+        heatmapPage = QtWidgets.QWidget(self)
+        heatmapLayout = QtWidgets.QVBoxLayout(heatmapPage)
+        self.peaksLabel = QtWidgets.QLabel(heatmapPage)
+        self.peaksLabel.setWordWrap(True)
+        heatmapLayout.addWidget(self.peaksLabel)
+        self.heatmapModel = HeatmapModel(self)
+        self.heatmapView = QtWidgets.QTableView(heatmapPage)
+        self.heatmapView.setModel(self.heatmapModel)
+        self.heatmapView.horizontalHeader().setDefaultSectionSize(34)
+        self.heatmapView.verticalHeader().setDefaultSectionSize(20)
+        heatmapLayout.addWidget(self.heatmapView)
+        self.tabs.addTab(heatmapPage, "Hour-of-week heatmap")
+        layout.addWidget(self.tabs)
+
+        bottomLayout = QtWidgets.QHBoxLayout()
+        self.statusLabel = QtWidgets.QLabel(self)
+        bottomLayout.addWidget(self.statusLabel, stretch=1)
+        self.exportButton = QtWidgets.QPushButton("Export CSV…", self)
+        self.exportButton.clicked.connect(self.exportReport)
+        bottomLayout.addWidget(self.exportButton)
+        layout.addLayout(bottomLayout)
+
+        self.setLayout(layout)
+
+    def addBuildings(self, rows):
+        for building_id, name in rows:
+            self.buildingCombo.addItem(name, userData=building_id)
+
+    def dayRange(self):
+        start_day = utilization.day_number(self.fromDate.date().toPyDate())
+        end_day = utilization.day_number(self.toDate.date().toPyDate()) + 1
+        return start_day, max(end_day, start_day + 1)
+
+    def refresh(self):
+        start_day, end_day = self.dayRange()
+        group_by = [self.groupCombo.currentData()]
+        if self.thenCombo.currentData() not in (None, group_by[0]):
+            group_by.append(self.thenCombo.currentData())
+        building_id = self.buildingCombo.currentData()
+        worker = self.parent().worker
+        self.statusLabel.setText("Loading…")
+        worker.read(utilization.report, start_day, end_day, group_by, building_id, self.hoursSpin.value(),
+                    channel='utilization-report', done=self.showReport)
+        worker.read(utilization.heatmap, start_day, end_day, building_id,
+                    channel='utilization-heatmap', done=self.showHeatmap)
+
+    def showReport(self, result):
+        self.columns, self.rows = result
+        self.reportTable.setSortingEnabled(False)
+        self.reportTable.clear()
+        self.reportTable.setColumnCount(len(self.columns))
+        self.reportTable.setHorizontalHeaderLabels([
+            "Utilization %" if column == 'utilization' else column.replace('_', ' ').capitalize()
+            for column in self.columns])
+        self.reportTable.setRowCount(len(self.rows))
+        for row_num, values in enumerate(self.rows):
+            for col_num, value in enumerate(values):
+                item = QtWidgets.QTableWidgetItem()
+                if self.columns[col_num] == 'utilization' and value is not None:
+                    item.setData(QtCore.Qt.DisplayRole, round(value * 100, 1))
+                    item.setToolTip(f"{value * 100:.1f}% of open hours booked")
+                else:
+                    item.setData(QtCore.Qt.DisplayRole, value if value is not None else "")
+                self.reportTable.setItem(row_num, col_num, item)
+        self.reportTable.setSortingEnabled(True)
+        self.statusLabel.setText(f"{len(self.rows)} row(s); utilization is the share of {self.hoursSpin.value():g} open hours a day")
+
+    def showHeatmap(self, result):
+        rooms, heat, (first_day, end_day) = result
+        self.heatmapModel.setHeatmap(rooms, heat)
+        peaks = ", ".join(f"{utilization.hour_label(hour)} ({share * 100:.1f}%)"
+                          for hour, share, _ in utilization.peaks(heat, 5))
+        self.peaksLabel.setText(f"{utilization.day_date(first_day)} to {utilization.day_date(end_day - 1)} "
+                                f"(whole months). Busiest hours: {peaks or 'none'}")
+
+    def exportReport(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Export Utilization", "utilization.csv", "CSV (*.csv)")
+        if not path:
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as handle:
+            writer = csv.writer(handle)
+            writer.writerow(self.columns)
+            writer.writerows(self.rows)
+
+class ProfilerDialog(QtWidgets.QDialog):
+    def __init__(self, profiler, parent=None):
+        super().__init__(parent)
+        self.profiler = profiler
+        self.initUI()
+        self.refresh()
+
+    def initUI(self):
+        self.setWindowTitle("Profiler")
+        self.resize(900, 600)
+        layout = QtWidgets.QVBoxLayout(self)
+
+        self.callsTable = QtWidgets.QTableWidget(self)
+        self.callsTable.setColumnCount(6)
+        self.callsTable.setHorizontalHeaderLabels(["Handler", "Calls", "Mean ms", "p50 ms", "p95 ms", "Max ms"])
+        self.callsTable.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        layout.addWidget(QtWidgets.QLabel("Handlers:"))
+        layout.addWidget(self.callsTable)
+
+        self.sqlTable = QtWidgets.QTableWidget(self)
+        self.sqlTable.setColumnCount(5)
+        self.sqlTable.setHorizontalHeaderLabels(["Statement", "Count", "Total ms", "Max ms", "Rows"])
+        self.sqlTable.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.sqlTable.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.Stretch)
+        layout.addWidget(QtWidgets.QLabel("SQL (by total time):"))
+        layout.addWidget(self.sqlTable)
+
+        self.stallsLabel = QtWidgets.QLabel(self)
+        self.stallsLabel.setWordWrap(True)
+        layout.addWidget(self.stallsLabel)
+
+        buttonLayout = QtWidgets.QHBoxLayout()
+        refreshButton = QtWidgets.QPushButton("Refresh", self)
+        refreshButton.clicked.connect(self.refresh)
+        saveButton = QtWidgets.QPushButton("Save Report…", self)
+        saveButton.clicked.connect(self.saveReport)
+        traceButton = QtWidgets.QPushButton("Save Chrome Trace…", self)
+        traceButton.clicked.connect(self.saveTrace)
+        buttonLayout.addWidget(refreshButton)
+        buttonLayout.addWidget(saveButton)
+        buttonLayout.addWidget(traceButton)
+        layout.addLayout(buttonLayout)
+
+        self.setLayout(layout)
+
+    def fillTable(self, table, rows):
+        table.setRowCount(len(rows))
+        for row_num, values in enumerate(rows):
+            for col_num, value in enumerate(values):
+                table.setItem(row_num, col_num, QtWidgets.QTableWidgetItem(str(value)))
+
+    def refresh(self):
+        summary = self.profiler.summary()
+        self.fillTable(self.callsTable, [
+            (name, stats['count'], stats['mean_ms'], stats['p50_ms'], stats['p95_ms'], stats['max_ms'])
+            for name, stats in summary['calls'].items()])
+        self.fillTable(self.sqlTable, [
+            (stats['sql'], stats['count'], stats['total_ms'], stats['max_ms'], stats['rows'])
+            for stats in summary['sql']['statements']])
+        stalls = summary['stalls']
+        text = f"{len(stalls)} event-loop stall(s) over {instrument.STALL_MS} ms."
+        if stalls:
+            worst = max(stalls, key=lambda stall: stall['duration_ms'])
+            text += f" Longest: {worst['duration_ms']:.0f} ms in {', '.join(worst['handlers']) or 'unprofiled code'}."
+        self.stallsLabel.setText(text)
+
+    def saveReport(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save Profile Report", "profile.json", "JSON (*.json)")
+        if path:
+            self.profiler.dump(path)
+
+    def saveTrace(self):
+        path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save Chrome Trace", "profile.trace.json",
+                                                        "Chrome trace (*.json)")
+        if path:
+            self.profiler.dump_trace(path)
+
+# Timed when profiling is on (--profile or ROOMS_PROFILE).
+PROFILED_METHODS = {
+    RoomReservationApp: ('updateClock', 'checkReservations', 'filterRooms', 'loadRooms', 'showRooms',
+                         'loadReservations', 'applyReservationChanges', 'reserveRoom', 'reservationBooked'),
+    ViewReservationsDialog: ('loadReservations',),
+    ReservationTableModel: ('addPage',),
+    FindFreeRoomDialog: ('showResults',),
+    UtilizationDialog: ('showReport', 'showHeatmap'),
+    TimelineView: ('paintEvent',),
+}
+
+def main(argv=None):
+    # Command-line subcommands never create a QApplication, so they also run
+    # on machines without a display.
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in cli.TRANSFER_COMMANDS:
+        sys.exit(transfer.main(argv))
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--serve', metavar='[HOST:]PORT',
+                        help='also serve the JSON API for kiosks from this process')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='time handlers and SQL, and write a JSON report (plus a Chrome trace) here at exit')
+    parser.add_argument('--archive-after', metavar='DAYS', type=int, default=archive.ARCHIVE_AFTER_DAYS,
+                        help='archive reservations that ended this many days ago (0 to never archive)')
+    args, qt_args = parser.parse_known_args(argv)
+    # Installed before anything opens a connection, so every statement is traced.
+    profiler = instrument.configure(args.profile)
+    if profiler is not None:
+        for cls, methods in PROFILED_METHODS.items():
+            profiler.instrument(cls, methods)
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+    server = None
+    if args.serve:
+        from server import BackgroundServer, DEFAULT_HOST
+        host, _, port = args.serve.rpartition(':')
+        server = BackgroundServer(DB_PATH, host or DEFAULT_HOST, int(port))
+        server.start()
+    ex = RoomReservationApp(profiler, args.archive_after)
+    status = app.exec_()
+    if server is not None:
+        server.stop()
+    if profiler is not None:
+        profiler.save()
+    sys.exit(status)
 
 if __name__ == '__main__':
     main()
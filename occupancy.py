@@ -0,0 +1,88 @@
+from bisect import bisect_right
+
+
+class OccupancyIndex:
+    """Per-room reservation intervals kept as sorted epoch-minute numbers.
+
+    Each room holds its intervals sorted by start together with a running
+    maximum of the end times, so "is this room occupied at T" is a single
+    binary search no matter how many bookings the room has.
+    """
+
+    def __init__(self):
+        self._intervals = {}
+        self._starts = {}
+        self._max_ends = {}
+        self._ends = {}
+        self.version = 0
+
+    def clear(self):
+        self._intervals.clear()
+        self._starts.clear()
+        self._max_ends.clear()
+        self._ends.clear()
+        self.version += 1
+
+    def rooms(self):
+        return self._intervals.keys()
+
+    def intervals(self, room):
+        return list(self._intervals.get(room, ()))
+
+    def set_room(self, room, intervals):
+        self._intervals[room] = sorted(intervals)
+        self._rebuild(room)
+
+    def update(self, room, added=(), removed=()):
+        removed = set(removed)
+        intervals = [interval for interval in self._intervals.get(room, ()) if interval[2] not in removed]
+        intervals.extend(added)
+        self.set_room(room, intervals)
+
+    def discard_room(self, room):
+        if self._intervals.pop(room, None) is not None:
+            del self._starts[room]
+            del self._max_ends[room]
+            del self._ends[room]
+            self.version += 1
+
+    def _rebuild(self, room):
+        intervals = self._intervals[room]
+        self._starts[room] = [interval[0] for interval in intervals]
+        max_ends = []
+        running = None
+        for interval in intervals:
+            end = interval[1]
+            running = end if running is None or end > running else running
+            max_ends.append(running)
+        self._max_ends[room] = max_ends
+        self._ends[room] = sorted(interval[1] for interval in intervals)
+        self.version += 1
+
+    def is_occupied(self, room, minute):
+        starts = self._starts.get(room)
+        if not starts:
+            return False
+        # Intervals starting at or before `minute` are starts[:i]; the room is
+        # occupied if any of them is still running.
+        i = bisect_right(starts, minute)
+        return i > 0 and self._max_ends[room][i - 1] > minute
+
+    def occupied_rooms(self, minute):
+        return {room for room in self._starts if self.is_occupied(room, minute)}
+
+    def next_boundary(self, room, minute):
+        # The earliest start or end strictly after `minute`, i.e. the next
+        # moment this room's status could change.
+        starts = self._starts.get(room)
+        if not starts:
+            return None
+        candidates = []
+        i = bisect_right(starts, minute)
+        if i < len(starts):
+            candidates.append(starts[i])
+        ends = self._ends[room]
+        j = bisect_right(ends, minute)
+        if j < len(ends):
+            candidates.append(ends[j])
+        return min(candidates) if candidates else None
@@ -0,0 +1,271 @@
+from datetime import datetime
+from math import gcd
+
+from timeutil import from_minutes, to_minutes
+
+DAY = 24 * 60
+FIXED_PERIODS = {'daily': DAY, 'weekly': 7 * DAY}
+FREQUENCIES = ('daily', 'weekly', 'monthly')
+
+# The Gregorian calendar repeats every 400 years (4800 months, exactly 20871
+# weeks), which bounds any search over a monthly series.
+CALENDAR_CYCLE_MONTHS = 4800
+MONTH_DAYS = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+SERIES_COLUMNS = ('id', 'room_id', 'start_minute', 'duration', 'frequency', 'interval', 'until_minute', 'count',
+                  'teacher_name', 'student_name', 'purpose', 'priority')
+
+
+def series_from_row(row, exceptions=()):
+    series = dict(zip(SERIES_COLUMNS, row))
+    series['exceptions'] = frozenset(exceptions)
+    return series
+
+
+def period(series):
+    # Fixed length of a daily/weekly step in minutes, or None for monthly.
+    step = FIXED_PERIODS.get(series['frequency'])
+    return step * series['interval'] if step is not None else None
+
+
+def _days_in_month(month):
+    # `month` counts months from January of year 0.
+    year, month = divmod(month, 12)
+    if month == 1 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+        return 29
+    return MONTH_DAYS[month]
+
+
+def _calendar_position(series):
+    # (month as counted by _days_in_month, day of month, minute of day) of the first occurrence.
+    first = from_minutes(series['start_minute'])
+    return first.year * 12 + first.month - 1, first.day, first.hour * 60 + first.minute
+
+
+def _minute_in_month(month, day, minute):
+    return to_minutes(datetime(month // 12, month % 12 + 1, day)) + minute
+
+
+def _fixed_index_range(series, window_start, window_end):
+    # Indexes k whose occurrence [start + k*p, start + k*p + duration)
+    # overlaps the window, clipped to the series' count and until.
+    step = period(series)
+    start = series['start_minute']
+    first = 0
+    # Smallest k with start + k*step + duration > window_start.
+    if window_start is not None:
+        first = max(0, (window_start - series['duration'] - start) // step + 1)
+    stop = None
+    if window_end is not None:
+        stop = max(0, (window_end - start - 1) // step + 1)
+    if series['count'] is not None:
+        stop = series['count'] if stop is None else min(stop, series['count'])
+    if series['until_minute'] is not None:
+        until_stop = max(0, (series['until_minute'] - start - 1) // step + 1)
+        stop = until_stop if stop is None else min(stop, until_stop)
+    return first, stop
+
+
+def occurrences(series, window_start=None, window_end=None):
+    """Lazily yield the start minutes of occurrences overlapping a window.
+
+    Every frequency jumps straight to the first step inside the window;
+    either bound may be None for an open-ended window.
+    """
+    duration = series['duration']
+    exceptions = series['exceptions']
+    step = period(series)
+    if step is not None:
+        k, stop = _fixed_index_range(series, window_start, window_end)
+        start = series['start_minute'] + k * step
+        while stop is None or k < stop:
+            if start not in exceptions:
+                yield start
+            k += 1
+            start += step
+        return
+
+    month, day, minute = _calendar_position(series)
+    interval = series['interval']
+    k = produced = 0
+    if window_start is not None:
+        # Jump to the last step not after the month in which an occurrence
+        # could still reach into the window; earlier ones all end before it.
+        reach = from_minutes(window_start - duration)
+        k = max(0, (reach.year * 12 + reach.month - 1 - month) // interval)
+        if series['count'] is not None:
+            # A series on the 29th-31st skips the months that lack the day (as RFC 5545 does).
+            produced = k if day <= 28 else sum(day <= _days_in_month(month + i * interval) for i in range(k))
+    while True:
+        if series['count'] is not None and produced >= series['count']:
+            return
+        step_month = month + k * interval
+        k += 1
+        if day > _days_in_month(step_month):
+            continue
+        start = _minute_in_month(step_month, day, minute)
+        produced += 1
+        if series['until_minute'] is not None and start >= series['until_minute']:
+            return
+        if window_end is not None and start >= window_end:
+            return
+        if (window_start is None or start + duration > window_start) and start not in exceptions:
+            yield start
+
+
+def last_end(series):
+    # End of the final occurrence, or None if the series never ends.
+    if series['count'] is None and series['until_minute'] is None:
+        return None
+    step = period(series)
+    if step is not None:
+        _, stop = _fixed_index_range(series, None, None)
+        return series['start_minute'] + (stop - 1) * step + series['duration'] if stop else series['start_minute']
+    last = None
+    for last in occurrences(series):
+        pass
+    return last + series['duration'] if last is not None else series['start_minute']
+
+
+def overlaps_interval(series, start_minute, end_minute):
+    return next(occurrences(series, start_minute, end_minute), None)
+
+
+def _solve(a, b, c):
+    # One integer solution (x, y) of a*x - b*y = c, given gcd(a, b) divides c.
+    def egcd(p, q):
+        if q == 0:
+            return p, 1, 0
+        g, x, y = egcd(q, p % q)
+        return g, y, x - (p // q) * y
+    g, x, y = egcd(a, b)
+    return x * (c // g), -y * (c // g)
+
+
+def first_conflict(first, second):
+    """Earliest pair of overlapping occurrence starts of two series, or None.
+
+    Two daily/weekly series are compared arithmetically: with periods p and q
+    the gap between any two occurrences is the difference of their first
+    starts plus a multiple of gcd(p, q), so only the handful of gaps that
+    make the occurrences overlap need to be solved for. Two monthly series
+    are solved per month offset in _monthly_conflict. A monthly series
+    against a daily/weekly one walks the monthly occurrences inside the
+    shared span, at most one calendar cycle of them.
+    """
+    if first['room_id'] != second['room_id']:
+        return None
+    span_start = max(first['start_minute'], second['start_minute'])
+    ends = [end for end in (last_end(first), last_end(second)) if end is not None]
+    span_end = min(ends) if ends else None
+    if span_end is not None and span_end <= span_start:
+        return None
+
+    p, q = period(first), period(second)
+    if p is None and q is None:
+        return _monthly_conflict(first, second)
+    if p is None or q is None:
+        monthly, other = (first, second) if p is None else (second, first)
+        if span_end is None:
+            # Both open-ended: one full calendar cycle covers every alignment.
+            span_end = span_start + CALENDAR_CYCLE_MONTHS * monthly['interval'] * 31 * DAY
+        for start in occurrences(monthly, span_start - monthly['duration'], span_end):
+            hit = overlaps_interval(other, start, start + monthly['duration'])
+            if hit is not None:
+                return (start, hit) if monthly is first else (hit, start)
+        return None
+
+    g = gcd(p, q)
+    offset = first['start_minute'] - second['start_minute']
+    best = None
+    # Occurrences overlap when -first duration < gap < second duration.
+    gap = offset - ((offset + first['duration'] - 1) // g) * g
+    while gap < second['duration']:
+        if gap > -first['duration']:
+            found = _first_pair(first, second, p, q, g, gap - offset)
+            if found is not None and (best is None or found < best):
+                best = found
+        gap += g
+    return best
+
+
+def _first_pair(first, second, p, q, g, c):
+    # Index pairs with i*p - j*q == c are (i0 + t*q/g, j0 + t*p/g).
+    i0, j0 = _solve(p, q, c)
+    di, dj = q // g, p // g
+    # Smallest t with both indexes non-negative.
+    t = max(-(i0 // di), -(j0 // dj))
+    _, stop_i = _fixed_index_range(first, None, None)
+    _, stop_j = _fixed_index_range(second, None, None)
+    # Each exception can hide at most one colliding pair, so this loop ends.
+    for _ in range(len(first['exceptions']) + len(second['exceptions']) + 1):
+        i, j = i0 + t * di, j0 + t * dj
+        if (stop_i is not None and i >= stop_i) or (stop_j is not None and j >= stop_j):
+            return None
+        a = first['start_minute'] + i * p
+        b = second['start_minute'] + j * q
+        if a not in first['exceptions'] and b not in second['exceptions']:
+            return a, b
+        t += 1
+    return None
+
+
+def _last_start(series):
+    end = last_end(series)
+    return end - series['duration'] if end is not None else None
+
+
+def _monthly_conflict(first, second):
+    # Pairs an occurrence of `first` in month x with one of `second` in
+    # month x + delta. The month offsets that can overlap are few, bounded
+    # by the longer duration. For each, x must solve
+    # x = month_a + i * interval_a = month_b - delta + j * interval_b, a
+    # progression with step lcm(interval_a, interval_b). The start-to-start
+    # gap only depends on the lengths of the months in between, so offsets
+    # that cannot overlap for any month lengths are skipped outright.
+    # Otherwise whether the days exist and the gap fits repeats with the
+    # calendar, so one calendar cycle of the progression without a match
+    # rules the offset out.
+    month_a, day_a, minute_a = _calendar_position(first)
+    month_b, day_b, minute_b = _calendar_position(second)
+    interval_a, interval_b = first['interval'], second['interval']
+    duration_a, duration_b = first['duration'], second['duration']
+    last_a, last_b = _last_start(first), _last_start(second)
+    g = gcd(interval_a, interval_b)
+    step = interval_a // g * interval_b
+    cycle = CALENDAR_CYCLE_MONTHS // gcd(step, CALENDAR_CYCLE_MONTHS)
+    hidden = len(first['exceptions']) + len(second['exceptions'])
+    reach = (max(duration_a, duration_b) // DAY + 31) // 28 + 1
+    best = None
+    for delta in range(-reach, reach + 1):
+        base = (day_b - day_a) * DAY + minute_b - minute_a
+        fewest, most = (28 * delta, 31 * delta) if delta >= 0 else (31 * delta, 28 * delta)
+        if base + fewest * DAY >= duration_a or base + most * DAY <= -duration_b:
+            continue
+        c = month_b - delta - month_a
+        if c % g:
+            continue
+        i, _ = _solve(interval_a, interval_b, c)
+        x = month_a + i * interval_a
+        # First x with both occurrences on or after their series' first month.
+        x += -(-(max(month_a, month_b - delta) - x) // step) * step
+        matches = 0
+        for steps in range(cycle * (hidden + 1)):
+            if steps == cycle and not matches:
+                break
+            if day_a <= _days_in_month(x) and day_b <= _days_in_month(x + delta):
+                a = _minute_in_month(x, day_a, minute_a)
+                b = _minute_in_month(x + delta, day_b, minute_b)
+                if (last_a is not None and a > last_a) or (last_b is not None and b > last_b):
+                    break
+                if -duration_b < b - a < duration_a:
+                    if a not in first['exceptions'] and b not in second['exceptions']:
+                        if best is None or (a, b) < best:
+                            best = (a, b)
+                        break
+                    matches += 1
+                    # Each exception hides at most one pair.
+                    if matches > hidden:
+                        break
+            x += step
+    return best
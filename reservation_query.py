@@ -0,0 +1,137 @@
+import re
+
+import archive
+
+# Sortable columns of the reservations view, in display order. Text columns
+# sort through COALESCE so NULLs still compare in keyset row values.
+COLUMNS = [
+    ('Room', 'rooms.name'),
+    ('Start Time', 'reservations.start_minute'),
+    ('End Time', 'reservations.end_minute'),
+    ('Teacher', "COALESCE(reservations.teacher_name, '')"),
+    ('Student', "COALESCE(reservations.student_name, '')"),
+    ('Purpose', "COALESCE(reservations.purpose, '')"),
+]
+
+PAGE_SIZE = 200
+
+# Sort column meaning "best search match first"; bm25 scores a hit on the
+# teacher highest, then the student, then the purpose.
+RELEVANCE = None
+RANK = 'bm25(reservation_search, 10.0, 5.0, 1.0)'
+# bm25 has to score every match before the best can be picked, so a broad
+# search ranks only its newest RANK_WINDOW matches; sorting by a column still
+# reaches all of them.
+RANK_WINDOW = 2000
+
+# Letters and digits, as the unicode61 tokenizer splits them.
+_WORD = re.compile(r'\w+')
+
+
+def match_expression(text):
+    """FTS5 query for free text: every word must match, each as a prefix.
+
+    Returns None when there is nothing to search for. Words are quoted, so
+    FTS5 operators typed by the user are taken as plain words.
+    """
+    words = _WORD.findall(text or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class ReservationQuery:
+    """Keyset-paginated, server-side sorted and filtered reservation listing.
+
+    Each page continues after the (sort value, id) of the previous page's
+    last row, so fetching page n costs the same as fetching page one. A
+    `search` filter goes through the reservation_search FTS5 index and can
+    be sorted by RELEVANCE as well as by any column.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.sort_column = 1
+        self.descending = False
+        self.room_id = None
+        self.start_from = None
+        self.start_to = None
+        self.teacher = None
+        self.search = None
+        self.include_archived = False
+
+    def set_sort(self, column, descending=False):
+        self.sort_column = column
+        self.descending = descending
+
+    def set_filters(self, room_id=None, start_from=None, start_to=None, teacher=None, search=None,
+                    include_archived=False):
+        self.room_id = room_id
+        self.start_from = start_from
+        self.start_to = start_to
+        self.teacher = teacher or None
+        self.search = match_expression(search)
+        self.include_archived = include_archived
+
+    def _where(self):
+        clauses = []
+        params = []
+        if self.search is not None:
+            clauses.append('reservation_search MATCH ?')
+            params.append(self.search)
+        if self.room_id is not None:
+            clauses.append('reservations.room_id = ?')
+            params.append(self.room_id)
+        if self.start_from is not None:
+            clauses.append('reservations.start_minute >= ?')
+            params.append(self.start_from)
+        if self.start_to is not None:
+            clauses.append('reservations.start_minute < ?')
+            params.append(self.start_to)
+        if self.teacher is not None:
+            escaped = self.teacher.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            clauses.append("reservations.teacher_name LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        return clauses, params
+
+    def _rank_floor(self, cursor):
+        # Lowest id among the newest RANK_WINDOW matches; the index walks ids
+        # in order without scoring, so this is cheap even for common words.
+        cursor.execute('''
+            SELECT rowid FROM reservation_search WHERE reservation_search MATCH ?
+            ORDER BY rowid DESC LIMIT 1 OFFSET ?
+        ''', (self.search, RANK_WINDOW - 1))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def page(self, after=None, limit=PAGE_SIZE):
+        # Rows are (sort key, id, room name, start, end, teacher, student, purpose);
+        # pass the last row back as `after` to continue.
+        cursor = self.conn.cursor()
+        clauses, params = self._where()
+        if self.sort_column is RELEVANCE:
+            sort_expr = RANK if self.search is not None else COLUMNS[1][1]
+        else:
+            sort_expr = COLUMNS[self.sort_column][1]
+        source = f"{archive.history_source(self.include_archived)} AS reservations"
+        if self.search is not None:
+            source = f"reservation_search JOIN {source} ON reservations.id = reservation_search.rowid"
+            floor = self._rank_floor(cursor) if sort_expr == RANK else None
+            if floor is not None:
+                clauses.append('reservation_search.rowid >= ?')
+                params.append(floor)
+        direction = 'DESC' if self.descending else 'ASC'
+        if after is not None:
+            clauses.append(f"({sort_expr}, reservations.id) {'<' if self.descending else '>'} (?, ?)")
+            params.extend(after[:2])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        cursor.execute(f'''
+            SELECT {sort_expr}, reservations.id, rooms.name, reservations.start_minute, reservations.end_minute,
+                   reservations.teacher_name, reservations.student_name, reservations.purpose
+            FROM {source}
+            JOIN rooms ON reservations.room_id = rooms.id
+            {where}
+            ORDER BY {sort_expr} {direction}, reservations.id {direction}
+            LIMIT ?
+        ''', params + [limit])
+        return cursor.fetchall()
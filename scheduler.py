@@ -0,0 +1,50 @@
+import heapq
+import itertools
+
+
+class TransitionScheduler:
+    """Min-heap of the next start/end boundary of every room in an index.
+
+    Rooms are re-queued whenever their reservations change; entries left
+    behind by an older version of a room are skipped lazily when popped.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._heap = []
+        self._generations = {}
+        self._counter = itertools.count()
+
+    def reset(self, minute):
+        self._heap = []
+        self._generations.clear()
+        for room in self.index.rooms():
+            self.update_room(room, minute)
+
+    def update_room(self, room, minute):
+        generation = self._generations.get(room, 0) + 1
+        self._generations[room] = generation
+        boundary = self.index.next_boundary(room, minute)
+        if boundary is not None:
+            heapq.heappush(self._heap, (boundary, next(self._counter), room, generation))
+
+    def discard_room(self, room):
+        self._generations[room] = self._generations.get(room, 0) + 1
+
+    def _drop_stale(self):
+        while self._heap and self._heap[0][3] != self._generations.get(self._heap[0][2]):
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, minute):
+        due = set()
+        self._drop_stale()
+        while self._heap and self._heap[0][0] <= minute:
+            due.add(heapq.heappop(self._heap)[2])
+            self._drop_stale()
+        for room in due:
+            self.update_room(room, minute)
+        return due
@@ -0,0 +1,571 @@
+import os
+import random
+import sqlite3
+import time
+
+from features import feature_key, parse_features
+from timeutil import to_minutes
+
+# Rows converted per round trip when rewriting large tables.
+MIGRATION_CHUNK_SIZE = 10000
+
+# Seconds SQLite itself waits on another connection's lock, then how often and
+# how patiently write_transaction starts over when it still gets SQLITE_BUSY.
+BUSY_TIMEOUT = 5.0
+BUSY_RETRIES = 6
+BUSY_BACKOFF = 0.05
+
+# room_monthly_hours packs the minutes booked in four consecutive hours of a
+# weekday into each column, HOUR_BITS bits per hour: w0_00 holds Monday
+# 00:00-04:00 and w6_20 Sunday 20:00-24:00. A month has at most five of a
+# weekday, so each booking covering an hour adds at most 300 minutes to its
+# field; a field overflows into the next hour only once more than 109
+# overlapping bookings cover the same hour every week of a month.
+HOUR_BITS = 15
+HOURS_PER_COLUMN = 4
+HOUR_COLUMNS = tuple(f'w{weekday}_{hour:02d}' for weekday in range(7) for hour in range(0, 24, HOURS_PER_COLUMN))
+# A reservation longer than this many days only counts towards its first ones.
+USAGE_MAX_DAYS = 400
+
+# Class of every connection connect() opens; instrument.install swaps in a
+# tracing subclass when profiling is switched on.
+CONNECTION_FACTORY = sqlite3.Connection
+
+
+def _create_legacy_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS buildings (
+            id INTEGER PRIMARY KEY,
+            name TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rooms (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            building_id INTEGER,
+            floor INTEGER,
+            capacity INTEGER,
+            features TEXT,
+            FOREIGN KEY(building_id) REFERENCES buildings(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reservations (
+            id INTEGER PRIMARY KEY,
+            room_id INTEGER,
+            start_time TEXT,
+            end_time TEXT,
+            teacher_name TEXT,
+            student_name TEXT,
+            purpose TEXT,
+            FOREIGN KEY(room_id) REFERENCES rooms(id)
+        )
+    ''')
+
+
+def _epoch_minute_reservations(cursor):
+    cursor.execute('''
+        CREATE TABLE reservations_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id INTEGER NOT NULL REFERENCES rooms(id) ON DELETE CASCADE,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            teacher_name TEXT,
+            student_name TEXT,
+            purpose TEXT,
+            priority INTEGER
+        )
+    ''')
+
+    cursor.execute('PRAGMA table_info(reservations)')
+    priority = 'priority' if 'priority' in [row[1] for row in cursor.fetchall()] else 'NULL'
+    # Keyset pagination over the rowid keeps memory flat however big the table is.
+    last_id = -1
+    reader = cursor.connection.cursor()
+    while True:
+        reader.execute(f'''
+            SELECT id, room_id, start_time, end_time, teacher_name, student_name, purpose, {priority}
+            FROM reservations WHERE id > ? ORDER BY id LIMIT ?
+        ''', (last_id, MIGRATION_CHUNK_SIZE))
+        rows = reader.fetchall()
+        if not rows:
+            break
+        cursor.executemany('INSERT INTO reservations_v2 VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+            (res_id, room_id, to_minutes(start_time), to_minutes(end_time), teacher_name, student_name, purpose, level)
+            for res_id, room_id, start_time, end_time, teacher_name, student_name, purpose, level in rows
+        ])
+        last_id = rows[-1][0]
+
+    cursor.execute('DROP TABLE reservations')
+    cursor.execute('ALTER TABLE reservations_v2 RENAME TO reservations')
+    cursor.execute('CREATE INDEX idx_reservations_room_start ON reservations (room_id, start_minute, end_minute)')
+    cursor.execute('CREATE INDEX idx_reservations_start ON reservations (start_minute)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rooms_building ON rooms (building_id)')
+
+    # The change log read by sync.ReservationSync; its triggers went with the old table.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reservation_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            reservation_id INTEGER,
+            room_id INTEGER,
+            op TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER reservations_log_insert AFTER INSERT ON reservations
+        BEGIN
+            INSERT INTO reservation_changes (reservation_id, room_id, op) VALUES (NEW.id, NEW.room_id, 'insert');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER reservations_log_delete AFTER DELETE ON reservations
+        BEGIN
+            INSERT INTO reservation_changes (reservation_id, room_id, op) VALUES (OLD.id, OLD.room_id, 'delete');
+        END
+    ''')
+
+
+def _recurring_series(cursor):
+    # One row per series plus its cancelled occurrences; occurrences are
+    # expanded on demand by recurrence.occurrences.
+    cursor.execute('''
+        CREATE TABLE reservation_series (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id INTEGER NOT NULL REFERENCES rooms(id) ON DELETE CASCADE,
+            start_minute INTEGER NOT NULL,
+            duration INTEGER NOT NULL CHECK (duration > 0),
+            frequency TEXT NOT NULL CHECK (frequency IN ('daily', 'weekly', 'monthly')),
+            interval INTEGER NOT NULL DEFAULT 1 CHECK (interval > 0),
+            until_minute INTEGER,
+            count INTEGER,
+            teacher_name TEXT,
+            student_name TEXT,
+            purpose TEXT,
+            priority INTEGER
+        )
+    ''')
+    cursor.execute('CREATE INDEX idx_series_room_start ON reservation_series (room_id, start_minute)')
+    cursor.execute('''
+        CREATE TABLE series_exceptions (
+            series_id INTEGER NOT NULL REFERENCES reservation_series(id) ON DELETE CASCADE,
+            occurrence_start INTEGER NOT NULL,
+            PRIMARY KEY (series_id, occurrence_start)
+        ) WITHOUT ROWID
+    ''')
+    # Series edits go through the same change log as single reservations.
+    for row, event in (('NEW', 'INSERT'), ('OLD', 'DELETE')):
+        cursor.execute(f'''
+            CREATE TRIGGER series_log_{event.lower()} AFTER {event} ON reservation_series
+            BEGIN
+                INSERT INTO reservation_changes (reservation_id, room_id, op) VALUES ({row}.id, {row}.room_id, 'series');
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER series_exceptions_log_{event.lower()} AFTER {event} ON series_exceptions
+            BEGIN
+                INSERT INTO reservation_changes (reservation_id, room_id, op)
+                SELECT {row}.series_id, room_id, 'series' FROM reservation_series WHERE id = {row}.series_id;
+            END
+        ''')
+
+
+def _feature_catalogue(cursor):
+    cursor.execute('''
+        CREATE TABLE features (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            key TEXT NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE room_features (
+            room_id INTEGER NOT NULL REFERENCES rooms(id) ON DELETE CASCADE,
+            feature_id INTEGER NOT NULL REFERENCES features(id) ON DELETE CASCADE,
+            PRIMARY KEY (room_id, feature_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX idx_room_features_feature ON room_features (feature_id)')
+
+    # rooms.features stays as it was; the join table is the source of truth.
+    feature_ids = {}
+    last_id = -1
+    reader = cursor.connection.cursor()
+    while True:
+        reader.execute('SELECT id, features FROM rooms WHERE id > ? ORDER BY id LIMIT ?',
+                       (last_id, MIGRATION_CHUNK_SIZE))
+        rows = reader.fetchall()
+        if not rows:
+            break
+        links = []
+        for room_id, text in rows:
+            for name in parse_features(text):
+                key = feature_key(name)
+                if key not in feature_ids:
+                    cursor.execute('INSERT INTO features (name, key) VALUES (?, ?)', (name, key))
+                    feature_ids[key] = cursor.lastrowid
+                links.append((room_id, feature_ids[key]))
+        cursor.executemany('INSERT OR IGNORE INTO room_features (room_id, feature_id) VALUES (?, ?)', links)
+        last_id = rows[-1][0]
+
+
+def _reservation_archive(cursor):
+    # Reservations moved out of the hot table by archive.py keep their ids.
+    # Nothing watches this table, so it has no change-log triggers.
+    cursor.execute('''
+        CREATE TABLE reservations_archive (
+            id INTEGER PRIMARY KEY,
+            room_id INTEGER NOT NULL REFERENCES rooms(id) ON DELETE CASCADE,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            teacher_name TEXT,
+            student_name TEXT,
+            purpose TEXT,
+            priority INTEGER
+        )
+    ''')
+    cursor.execute('CREATE INDEX idx_archive_room_start ON reservations_archive (room_id, start_minute)')
+    cursor.execute('CREATE INDEX idx_archive_start ON reservations_archive (start_minute)')
+    cursor.execute('''
+        CREATE VIEW reservation_history AS
+        SELECT id, room_id, start_minute, end_minute, teacher_name, student_name, purpose, priority, 0 AS archived
+        FROM reservations
+        UNION ALL
+        SELECT id, room_id, start_minute, end_minute, teacher_name, student_name, purpose, priority, 1 AS archived
+        FROM reservations_archive
+    ''')
+
+
+def _reservation_search(cursor):
+    # Full-text index over both tables, keyed by reservation id. Its content
+    # lives in the tables themselves; the index only holds tokens.
+    cursor.execute('''
+        CREATE VIRTUAL TABLE reservation_search USING fts5(
+            teacher_name, student_name, purpose,
+            content='reservation_history', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+    # Archiving inserts the archive row before deleting the hot one, so a
+    # row moving between the tables keeps its index entry.
+    for table, other in (('reservations', 'reservations_archive'), ('reservations_archive', 'reservations')):
+        cursor.execute(f'''
+            CREATE TRIGGER {table}_search_insert AFTER INSERT ON {table}
+            WHEN NOT EXISTS (SELECT 1 FROM {other} WHERE id = NEW.id)
+            BEGIN
+                INSERT INTO reservation_search (rowid, teacher_name, student_name, purpose)
+                VALUES (NEW.id, NEW.teacher_name, NEW.student_name, NEW.purpose);
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER {table}_search_delete AFTER DELETE ON {table}
+            WHEN NOT EXISTS (SELECT 1 FROM {other} WHERE id = OLD.id)
+            BEGIN
+                INSERT INTO reservation_search (reservation_search, rowid, teacher_name, student_name, purpose)
+                VALUES ('delete', OLD.id, OLD.teacher_name, OLD.student_name, OLD.purpose);
+            END
+        ''')
+    rebuild_search(cursor)
+
+
+def rebuild_search(cursor):
+    # Re-reads every reservation; also for bulk loads that bypass the triggers.
+    cursor.execute("INSERT INTO reservation_search (reservation_search) VALUES ('rebuild')")
+
+
+def _usage_split(row):
+    # Columns and condition splitting reservation `row` into the days it
+    # touches (offset n from its start day): the day, whether it is the start
+    # day, and the minutes it takes of that day and of each of its hours.
+    start, end = f'{row}.start_minute', f'{row}.end_minute'
+    day = f'({start} / 1440 + n)'
+    columns = [f'{day} AS day', 'n = 0 AS first',
+               f'MAX(0, MIN({end}, {day} * 1440 + 1440) - MAX({start}, {day} * 1440)) AS minutes']
+    columns += [f'MAX(0, MIN({end}, {day} * 1440 + {(hour + 1) * 60}) - MAX({start}, {day} * 1440 + {hour * 60}))'
+                f' AS h{hour:02d}' for hour in range(24)]
+    return ', '.join(columns), f'n <= MAX(0, ({end} - 1) / 1440 - {start} / 1440)'
+
+
+# Month number (year * 12 + month - 1) of a split row's day.
+_MONTH = ("CAST(strftime('%Y', day * 86400, 'unixepoch') AS INTEGER) * 12"
+          " + CAST(strftime('%m', day * 86400, 'unixepoch') AS INTEGER) - 1")
+
+
+def _packed_hours():
+    # One expression per HOUR_COLUMNS entry over a split row.
+    expressions = []
+    for column in HOUR_COLUMNS:
+        weekday, first_hour = int(column[1]), int(column[3:])
+        fields = ' + '.join(f'(h{first_hour + i:02d} << {i * HOUR_BITS})' for i in range(HOURS_PER_COLUMN))
+        # Epoch day 0 was a Thursday.
+        expressions.append(f'CASE WHEN (day + 3) % 7 = {weekday} THEN {fields} ELSE 0 END')
+    return expressions
+
+
+def _utilization_summary(cursor):
+    # Two summaries of both reservation tables, kept up to date by triggers:
+    # booked minutes and booking counts per day, priority and room for
+    # reports, and booked minutes per hour of the week, room and month for
+    # heatmaps. Days are epoch day numbers and priority 0 stands for none.
+    # Recurring series are not stored; utilization.py expands them for the
+    # range it reports.
+    cursor.execute('''
+        CREATE TABLE room_daily_usage (
+            day INTEGER NOT NULL,
+            priority INTEGER NOT NULL,
+            room_id INTEGER NOT NULL REFERENCES rooms(id) ON DELETE CASCADE,
+            bookings INTEGER NOT NULL,
+            booked_minutes INTEGER NOT NULL,
+            PRIMARY KEY (day, priority, room_id)
+        ) WITHOUT ROWID
+    ''')
+    # Reports aggregate along one of these two orders so SQLite never sorts
+    # the whole range; the room index also serves deletes cascading from rooms.
+    cursor.execute('''
+        CREATE INDEX idx_usage_room ON room_daily_usage (room_id, day, priority, bookings, booked_minutes)
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE room_monthly_hours (
+            room_id INTEGER NOT NULL REFERENCES rooms(id) ON DELETE CASCADE,
+            month INTEGER NOT NULL,
+            booked_minutes INTEGER NOT NULL,
+            {', '.join(f'{column} INTEGER NOT NULL' for column in HOUR_COLUMNS)},
+            PRIMARY KEY (room_id, month)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE TABLE usage_day_offsets (n INTEGER PRIMARY KEY)')
+    cursor.executemany('INSERT INTO usage_day_offsets (n) VALUES (?)', [(n,) for n in range(USAGE_MAX_DAYS)])
+
+    daily_updates = 'bookings = bookings + excluded.bookings, booked_minutes = booked_minutes + excluded.booked_minutes'
+    monthly_updates = ', '.join(f'{column} = {column} + excluded.{column}'
+                                for column in ('booked_minutes',) + HOUR_COLUMNS)
+    # Like the search index, the summaries ignore rows moving to the archive.
+    # Deletes cascading from a deleted room find the room gone and skip too.
+    for table, other in (('reservations', 'reservations_archive'), ('reservations_archive', 'reservations')):
+        for row, event, sign in (('NEW', 'INSERT', ''), ('OLD', 'DELETE', '-')):
+            columns, condition = _usage_split(row)
+            split = f'(SELECT {columns} FROM usage_day_offsets WHERE {condition})'
+            cleanup = ''
+            if event == 'DELETE':
+                cleanup = f'''
+                    DELETE FROM room_daily_usage
+                    WHERE day IN (SELECT day FROM {split}) AND priority = COALESCE(OLD.priority, 0)
+                      AND room_id = OLD.room_id AND bookings = 0 AND booked_minutes = 0;
+                    DELETE FROM room_monthly_hours
+                    WHERE room_id = OLD.room_id AND month IN (SELECT {_MONTH} FROM {split}) AND booked_minutes = 0;'''
+            cursor.execute(f'''
+                CREATE TRIGGER {table}_usage_{event.lower()} AFTER {event} ON {table}
+                WHEN NOT EXISTS (SELECT 1 FROM {other} WHERE id = {row}.id)
+                 AND EXISTS (SELECT 1 FROM rooms WHERE id = {row}.room_id)
+                BEGIN
+                    INSERT INTO room_daily_usage (day, priority, room_id, bookings, booked_minutes)
+                    SELECT day, COALESCE({row}.priority, 0), {row}.room_id, {sign}first, {sign}minutes
+                    FROM {split} WHERE true
+                    ON CONFLICT (day, priority, room_id) DO UPDATE SET {daily_updates};
+                    INSERT INTO room_monthly_hours (room_id, month, booked_minutes, {', '.join(HOUR_COLUMNS)})
+                    SELECT {row}.room_id, {_MONTH}, {sign}minutes,
+                           {', '.join(f'{sign}({expression})' for expression in _packed_hours())}
+                    FROM {split} WHERE true
+                    ON CONFLICT (room_id, month) DO UPDATE SET {monthly_updates};{cleanup}
+                END
+            ''')
+    _rebuild_day_summaries(cursor)
+
+
+def rebuild_usage(cursor):
+    # Recomputes every summary; also for bulk loads that bypass the triggers.
+    _rebuild_day_summaries(cursor)
+    _rebuild_weekly_usage(cursor)
+
+
+def _rebuild_day_summaries(cursor):
+    columns, condition = _usage_split('r')
+    split = f'''(SELECT r.room_id, COALESCE(r.priority, 0) AS priority, {columns}
+               FROM reservation_history AS r JOIN usage_day_offsets ON {condition})'''
+    cursor.execute('DELETE FROM room_daily_usage')
+    cursor.execute('DELETE FROM room_monthly_hours')
+    cursor.execute(f'''
+        INSERT INTO room_daily_usage (day, priority, room_id, bookings, booked_minutes)
+        SELECT day, priority, room_id, SUM(first), SUM(minutes) FROM {split}
+        GROUP BY day, priority, room_id
+    ''')
+    cursor.execute(f'''
+        INSERT INTO room_monthly_hours (room_id, month, booked_minutes, {', '.join(HOUR_COLUMNS)})
+        SELECT room_id, {_MONTH}, SUM(minutes), {', '.join(f'SUM({expression})' for expression in _packed_hours())}
+        FROM {split}
+        GROUP BY 1, 2
+    ''')
+
+
+# Monday of a split row's week; epoch day 0 was a Thursday.
+_WEEK = 'day - (day + 3) % 7'
+
+
+def _weekly_usage(cursor):
+    # Booking counts and booked minutes per week and room, summed the same way
+    # as room_daily_usage but without priorities: about a seventh of its rows
+    # for reports grouped by nothing finer than a week.
+    cursor.execute('''
+        CREATE TABLE room_weekly_usage (
+            week INTEGER NOT NULL,
+            room_id INTEGER NOT NULL REFERENCES rooms(id) ON DELETE CASCADE,
+            bookings INTEGER NOT NULL,
+            booked_minutes INTEGER NOT NULL,
+            PRIMARY KEY (week, room_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX idx_weekly_usage_room ON room_weekly_usage (room_id)')
+    updates = 'bookings = bookings + excluded.bookings, booked_minutes = booked_minutes + excluded.booked_minutes'
+    for table, other in (('reservations', 'reservations_archive'), ('reservations_archive', 'reservations')):
+        for row, event, sign in (('NEW', 'INSERT', ''), ('OLD', 'DELETE', '-')):
+            columns, condition = _usage_split(row)
+            split = f'(SELECT {columns} FROM usage_day_offsets WHERE {condition})'
+            cleanup = ''
+            if event == 'DELETE':
+                cleanup = f'''
+                    DELETE FROM room_weekly_usage
+                    WHERE week IN (SELECT {_WEEK} FROM {split}) AND room_id = OLD.room_id
+                      AND bookings = 0 AND booked_minutes = 0;'''
+            cursor.execute(f'''
+                CREATE TRIGGER {table}_weekly_usage_{event.lower()} AFTER {event} ON {table}
+                WHEN NOT EXISTS (SELECT 1 FROM {other} WHERE id = {row}.id)
+                 AND EXISTS (SELECT 1 FROM rooms WHERE id = {row}.room_id)
+                BEGIN
+                    INSERT INTO room_weekly_usage (week, room_id, bookings, booked_minutes)
+                    SELECT {_WEEK}, {row}.room_id, {sign}first, {sign}minutes
+                    FROM {split} WHERE true
+                    ON CONFLICT (week, room_id) DO UPDATE SET {updates};{cleanup}
+                END
+            ''')
+    _rebuild_weekly_usage(cursor)
+
+
+def _rebuild_weekly_usage(cursor):
+    cursor.execute('DELETE FROM room_weekly_usage')
+    cursor.execute(f'''
+        INSERT INTO room_weekly_usage (week, room_id, bookings, booked_minutes)
+        SELECT {_WEEK}, room_id, SUM(bookings), SUM(booked_minutes) FROM room_daily_usage
+        GROUP BY 1, 2
+    ''')
+
+
+def _duration_index(cursor):
+    # MAX(end_minute - start_minute) of one room in a single seek: the
+    # longest booking bounds how far back an overlapping one can start.
+    cursor.execute('CREATE INDEX idx_reservations_room_duration ON reservations (room_id, end_minute - start_minute)')
+
+
+# MIGRATIONS[n - 1] upgrades a database from user_version n - 1 to n.
+MIGRATIONS = [
+    _create_legacy_tables,
+    _epoch_minute_reservations,
+    _recurring_series,
+    _feature_catalogue,
+    _reservation_archive,
+    _reservation_search,
+    _utilization_summary,
+    _duration_index,
+    _weekly_usage,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _user_version(cursor):
+    cursor.execute('PRAGMA user_version')
+    version = cursor.fetchone()[0]
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"rooms database is at schema version {version}, newer than this app ({SCHEMA_VERSION})")
+    return version
+
+
+def migrate(conn):
+    cursor = conn.cursor()
+    version = _user_version(cursor)
+    if version == SCHEMA_VERSION:
+        return version
+
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        while True:
+            # Each step commits together with its version bump, so an
+            # interrupted upgrade resumes from the last completed step. The
+            # version is read again under the write lock because another
+            # connection may have run the step in the meantime.
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                target = _user_version(cursor) + 1
+                if target > SCHEMA_VERSION:
+                    cursor.execute('COMMIT')
+                    break
+                MIGRATIONS[target - 1](cursor)
+                cursor.execute(f'PRAGMA user_version = {target}')
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+            cursor.execute('COMMIT')
+    finally:
+        conn.isolation_level = isolation_level
+    return version
+
+
+def is_busy(error):
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in str(error) or 'busy' in str(error))
+
+
+def write_transaction(conn, fn, *args, retries=BUSY_RETRIES, backoff=BUSY_BACKOFF):
+    """Run fn(cursor, *args) in a BEGIN IMMEDIATE transaction and commit it.
+
+    Taking the write lock up front means everything fn reads stays true
+    until its writes commit, so check-then-insert is safe across processes.
+    On SQLITE_BUSY the whole call is retried after a jittered exponential
+    backoff; any other exception rolls back and propagates.
+    """
+    for attempt in range(retries + 1):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn(conn.cursor(), *args)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            return result
+        except sqlite3.OperationalError as error:
+            if not is_busy(error) or attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, factory=CONNECTION_FACTORY)
+    # Before migrating, so other connections can keep reading during the upgrade.
+    conn.execute('PRAGMA journal_mode = WAL')
+    migrate(conn)
+    conn.execute('PRAGMA foreign_keys = ON')
+    return conn
+
+
+def connect_readonly(path):
+    """Open the database for reading only, without taking any write lock.
+
+    Falls back to `connect` when the file does not exist yet or still needs
+    migrating, which only a writer can do.
+    """
+    # A URI path is absolute, uses '/' (SQLite drops the slash before a Windows
+    # drive letter) and escapes the characters that would end it.
+    location = os.path.abspath(path).replace(os.sep, '/')
+    location = location.replace('%', '%25').replace('?', '%3f').replace('#', '%23')
+    try:
+        conn = sqlite3.connect(f"file:{'' if location.startswith('/') else '/'}{location}?mode=ro", uri=True,
+                               timeout=BUSY_TIMEOUT, factory=CONNECTION_FACTORY)
+    except sqlite3.OperationalError:
+        return connect(path)
+    try:
+        if _user_version(conn.cursor()) == SCHEMA_VERSION:
+            return conn
+    except sqlite3.DatabaseError:
+        pass
+    conn.close()
+    return connect(path)
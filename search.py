@@ -0,0 +1,34 @@
+import sys
+
+from reservation_query import RELEVANCE, ReservationQuery, match_expression
+from timeutil import format_minutes
+
+DEFAULT_LIMIT = 20
+
+
+def search_reservations(conn, text, limit=DEFAULT_LIMIT, include_archived=False):
+    """Best matches first, as (id, room, start, end, teacher, student, purpose) rows."""
+    query = ReservationQuery(conn)
+    query.set_filters(search=text, include_archived=include_archived)
+    query.set_sort(RELEVANCE)
+    return [row[1:] for row in query.page(limit=limit)]
+
+
+def build_parser(subparsers, common):
+    search_parser = subparsers.add_parser('search', parents=[common],
+                                          help='full-text search over teacher, student and purpose')
+    search_parser.add_argument('text', help='words to look for; each matches as a prefix')
+    search_parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+    search_parser.add_argument('--include-archived', action='store_true')
+    search_parser.set_defaults(handler=run_search)
+
+
+def run_search(conn, args):
+    if match_expression(args.text) is None:
+        print("Nothing to search for.", file=sys.stderr)
+        return 2
+    rows = search_reservations(conn, args.text, args.limit, args.include_archived)
+    for res_id, room, start, end, teacher, student, purpose in rows:
+        print(f"{res_id}\t{room}\t{format_minutes(start)}\t{format_minutes(end)}\t"
+              f"{teacher or ''}\t{student or ''}\t{purpose or ''}")
+    return 0 if rows else 1
@@ -0,0 +1,360 @@
+import argparse
+import asyncio
+import json
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+from conflicts import BookingConflict
+from service import ReservationService
+from timeutil import format_minutes, from_minutes, to_minutes
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Seconds between checks for commits by other processes.
+POLL_INTERVAL = 1.0
+LONG_POLL_LIMIT = 60.0
+SSE_KEEPALIVE = 15.0
+MAX_BODY = 64 * 1024
+
+REASONS = {
+    200: 'OK',
+    201: 'Created',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    409: 'Conflict',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _query_int(query, name, default=None):
+    values = query.get(name)
+    if not values or values[0] == '':
+        return default
+    try:
+        return int(values[0])
+    except ValueError:
+        raise HttpError(400, f"{name} must be an integer")
+
+
+def _query_minutes(query, name):
+    values = query.get(name)
+    if not values:
+        raise HttpError(400, f"{name} is required")
+    try:
+        return to_minutes(values[0])
+    except (ValueError, IndexError):
+        raise HttpError(400, f"{name} must look like YYYY-MM-DD HH:MM")
+
+
+def _conflict_json(conflict):
+    return {
+        'reservation_id': conflict.get('id'),
+        'series_id': conflict.get('series_id'),
+        'start_time': format_minutes(conflict['start_minute']),
+        'end_time': format_minutes(conflict['end_minute']),
+        'priority': conflict['priority'],
+    }
+
+
+class ReservationServer:
+    """HTTP/1.1 JSON API over a ReservationService, on one asyncio loop.
+
+    GET  /buildings
+    GET  /rooms?building_id=
+    GET  /status?building_id=&since=&timeout=    (long-polls while version == since)
+    GET  /events?building_id=                    (server-sent events, one per status change)
+    GET  /availability?start=&end=&duration=&capacity=&features=&building_id=
+    POST /reservations                           (JSON body, see service.parse_booking)
+    DELETE /reservations/<id>
+
+    Requests are parsed on the loop thread; every service call, and so all
+    SQLite work, runs on `executor`, which must have a single thread (the
+    one that created the service). Status bodies are encoded once per
+    status version, so repeated status reads cost little more than the
+    socket write.
+    """
+
+    def __init__(self, service, executor, poll_interval=POLL_INTERVAL):
+        self.service = service
+        self.executor = executor
+        self.poll_interval = poll_interval
+        self.encoded = {}
+        self.changed = None
+        self.server = None
+        self.watcher = None
+        self.connections = set()
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.changed = asyncio.Condition()
+        self.server = await asyncio.start_server(self._handle, host, port)
+        self.watcher = asyncio.create_task(self._watch())
+        return self.server
+
+    async def close(self):
+        # Long-poll and event-stream clients would otherwise hold the loop open.
+        self.server.close()
+        tasks = [self.watcher, *self.connections]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def _db(self, fn, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args, **kwargs))
+
+    def _sleep_time(self, due):
+        # Wake for the next room transition, or for the next external poll.
+        if due is None:
+            return self.poll_interval
+        until_due = (from_minutes(due) - datetime.now()).total_seconds() + 0.05
+        return max(0.0, min(self.poll_interval, until_due))
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self._sleep_time(await self._db(self.service.next_due)))
+            if await self._db(self.service.refresh):
+                await self._notify()
+
+    async def _notify(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+    async def _wait_for_change(self, version, timeout):
+        async with self.changed:
+            try:
+                await asyncio.wait_for(self.changed.wait_for(lambda: self.service.version != version), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY:
+                    writer.write(self._response(413, {'error': "Request body too large"}, False))
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                url = urlsplit(target)
+                query = parse_qs(url.query)
+                if method == 'GET' and url.path == '/events':
+                    await self._events(writer, query)
+                    break
+                status, payload = await self._dispatch(method, url.path, query, body)
+                writer.write(self._response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        except asyncio.CancelledError:
+            # Shutting down; asyncio's stream callback would report a
+            # cancelled handler as an error, so end normally.
+            pass
+        finally:
+            self.connections.discard(task)
+            writer.close()
+
+    def _response(self, status, payload, keep_alive):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        return (f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n").encode() + body
+
+    async def _dispatch(self, method, path, query, body):
+        parts = [part for part in path.split('/') if part]
+        try:
+            if parts == ['buildings']:
+                self._allow(method, 'GET')
+                return 200, await self._db(self.service.buildings)
+            if parts == ['rooms']:
+                self._allow(method, 'GET')
+                return 200, await self._db(self.service.rooms, _query_int(query, 'building_id'))
+            if parts == ['status']:
+                self._allow(method, 'GET')
+                return 200, await self._status(query)
+            if parts == ['availability']:
+                self._allow(method, 'GET')
+                return 200, await self._availability(query)
+            if parts == ['reservations']:
+                self._allow(method, 'POST')
+                return 201, await self._book(body)
+            if len(parts) == 2 and parts[0] == 'reservations':
+                self._allow(method, 'DELETE')
+                if not parts[1].isdigit() or not await self._db(self.service.cancel, int(parts[1])):
+                    raise HttpError(404, "No such reservation")
+                await self._notify()
+                return 200, {'deleted': int(parts[1])}
+            raise HttpError(404, "Not found")
+        except HttpError as error:
+            return error.status, {'error': str(error)}
+        except BookingConflict as conflict:
+            return 409, {'error': str(conflict), 'conflicts': [_conflict_json(c) for c in conflict.conflicts]}
+        except (ValueError, sqlite3.IntegrityError) as error:
+            return 400, {'error': str(error)}
+        except Exception as error:
+            return 500, {'error': str(error)}
+
+    def _allow(self, method, allowed):
+        if method != allowed:
+            raise HttpError(405, f"Use {allowed}")
+
+    async def _status(self, query):
+        building_id = _query_int(query, 'building_id')
+        since = _query_int(query, 'since')
+        if since is not None and since == self.service.version:
+            timeout = min(float(query.get('timeout', [LONG_POLL_LIMIT])[0]), LONG_POLL_LIMIT)
+            await self._wait_for_change(since, timeout)
+        return await self._status_body(building_id)
+
+    async def _status_body(self, building_id):
+        cached = self.encoded.get(building_id)
+        if cached is None or cached[0] != self.service.version:
+            cached = await self._db(self._encode_status, building_id)
+            # One version's bodies at a time.
+            self.encoded = {key: body for key, body in self.encoded.items() if body[0] == cached[0]}
+            self.encoded[building_id] = cached
+        return cached[1]
+
+    def _encode_status(self, building_id):
+        # On the database thread, so the version matches the snapshot.
+        return self.service.version, json.dumps(self.service.status(building_id)).encode()
+
+    async def _availability(self, query):
+        features = [name for value in query.get('features', []) for name in value.split(',')]
+        results = await self._db(
+            self.service.availability, _query_minutes(query, 'start'), _query_minutes(query, 'end'),
+            _query_int(query, 'duration', 60), capacity=_query_int(query, 'capacity', 0),
+            features=tuple(features), building_id=_query_int(query, 'building_id'), limit=_query_int(query, 'limit', 20))
+        return [dict(result, start_time=format_minutes(result['start_minute']),
+                     end_time=format_minutes(result['end_minute'])) for result in results]
+
+    async def _book(self, body):
+        try:
+            data = json.loads(body or b'{}')
+        except json.JSONDecodeError:
+            raise HttpError(400, "Body must be JSON")
+        if not isinstance(data, dict):
+            raise HttpError(400, "Body must be a JSON object")
+        result = await self._db(self.service.book, data)
+        await self._notify()
+        return {'id': result['id'], 'displaced': [_conflict_json(c) for c in result['displaced']]}
+
+    async def _events(self, writer, query):
+        building_id = _query_int(query, 'building_id')
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        version = None
+        while True:
+            if version != self.service.version:
+                version = self.service.version
+                writer.write(b"event: status\nid: %d\ndata: %s\n\n" % (version, await self._status_body(building_id)))
+            else:
+                writer.write(b": keep-alive\n\n")
+            await writer.drain()
+            await self._wait_for_change(version, SSE_KEEPALIVE)
+
+
+async def serve(path, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+    # The service's connection belongs to the executor's one thread.
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reservation-db')
+    loop = asyncio.get_running_loop()
+    service = server = None
+    try:
+        service = await loop.run_in_executor(executor, ReservationService, path)
+        server = ReservationServer(service, executor)
+        await server.start(host, port)
+        print(f"Serving {path} on http://{host}:{port}")
+        if ready is not None:
+            ready()
+        await server.server.serve_forever()
+    finally:
+        if server is not None and server.server is not None:
+            await server.close()
+        if service is not None:
+            await loop.run_in_executor(executor, service.close)
+        executor.shutdown()
+
+
+class BackgroundServer:
+    """Runs the API on its own thread and event loop, e.g. inside the desktop app."""
+
+    def __init__(self, path, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.loop = None
+        self.task = None
+        self.error = None
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='reservation-server', daemon=True)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(serve(self.path, self.host, self.port, self.started.set))
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        except Exception as error:
+            self.error = error
+        finally:
+            self.started.set()
+            self.loop.close()
+
+    def start(self):
+        self.thread.start()
+        self.started.wait()
+        if self.error is not None:
+            raise self.error
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.task.cancel)
+            self.thread.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve room status, availability and bookings as JSON over HTTP.')
+    parser.add_argument('--db', default='rooms.db', help='path to the rooms database')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.db, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,350 @@
+import schema
+from conflicts import ConflictEngine, check_priority
+from features import parse_features, room_masks, set_room_features
+from occupancy import OccupancyIndex
+from recurrence import DAY, occurrences
+from scheduler import TransitionScheduler
+from sync import ExternalChanges, ReservationSync
+from timeutil import format_minutes, now_minutes, to_minutes
+
+ROOM_COLUMNS = ('id', 'name', 'building_id', 'floor', 'capacity')
+
+
+# Building blocks shared by the desktop window's worker jobs and the service.
+# Each takes a connection from the calling thread and knows nothing about Qt.
+
+def fetch_buildings(conn):
+    return conn.execute('SELECT id, name FROM buildings').fetchall()
+
+
+def fetch_rooms(conn, building_id=None):
+    if building_id is None:
+        return conn.execute(f'SELECT {", ".join(ROOM_COLUMNS)} FROM rooms ORDER BY id').fetchall()
+    return conn.execute(f'SELECT {", ".join(ROOM_COLUMNS)} FROM rooms WHERE building_id=? ORDER BY id',
+                        (building_id,)).fetchall()
+
+
+def fetch_room_names(conn):
+    return conn.execute('SELECT id, name FROM rooms ORDER BY name').fetchall()
+
+
+def rooms_signature(conn):
+    # Changes whenever buildings, rooms or room features are added or removed.
+    return conn.execute('''
+        SELECT (SELECT COUNT(*) FROM buildings), (SELECT COALESCE(MAX(id), 0) FROM buildings),
+               (SELECT COUNT(*) FROM rooms), (SELECT COALESCE(MAX(id), 0) FROM rooms),
+               (SELECT COUNT(*) FROM room_features)
+    ''').fetchone()
+
+
+def insert_building(conn, name):
+    cursor = conn.execute('INSERT INTO buildings (name) VALUES (?)', (name,))
+    conn.commit()
+    return cursor.lastrowid
+
+
+def insert_room(conn, name, building_id, floor, capacity, features):
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO rooms (name, building_id, floor, capacity)
+        VALUES (?, ?, ?, ?)
+    ''', (name, building_id, floor, capacity))
+    room_id = cursor.lastrowid
+    set_room_features(cursor, room_id, parse_features(features))
+    conn.commit()
+    return room_id
+
+
+def delete_rooms(conn, room_ids):
+    cursor = conn.cursor()
+    for room_id in room_ids:
+        cursor.execute('DELETE FROM reservations WHERE room_id=?', (room_id,))
+        cursor.execute('DELETE FROM rooms WHERE id=?', (room_id,))
+    conn.commit()
+
+
+def delete_reservations(conn, reservation_ids):
+    # Ids are kept when archived, so a history listing's ids delete either way.
+    params = [(res_id,) for res_id in reservation_ids]
+    deleted = conn.executemany('DELETE FROM reservations WHERE id = ?', params).rowcount
+    deleted += conn.executemany('DELETE FROM reservations_archive WHERE id = ?', params).rowcount
+    conn.commit()
+    return deleted
+
+
+def book(conn, booking):
+    # A booking with a 'frequency' is a recurring series.
+    if booking.get('frequency'):
+        return ConflictEngine(conn).book_series(booking)
+    return ConflictEngine(conn).book(booking)
+
+
+def series_window(minute):
+    # Recurring series are only expanded around today.
+    today = minute // DAY * DAY
+    return (today - DAY, today + 2 * DAY)
+
+
+class RoomStatus:
+    """Vacant/occupied state of a set of rooms, kept current incrementally.
+
+    ReservationSync changes feed an OccupancyIndex keyed by room id,
+    recurring series are expanded around today, and a TransitionScheduler
+    knows when the next room changes state. Given a connection it tracks
+    every room and `refresh` costs only what changed; the desktop window
+    instead runs its syncs as worker jobs and passes the results to
+    `reset` and `apply`.
+    """
+
+    def __init__(self, conn=None):
+        self.conn = conn
+        self.occupancy = OccupancyIndex()
+        self.scheduler = TransitionScheduler(self.occupancy)
+        self.sync = None
+        self.reset((), now_minutes())
+        if conn is not None:
+            self.load()
+
+    def reset(self, rows, minute):
+        # Starts over with `rows` of ROOM_COLUMNS, all vacant and without bookings.
+        self.rooms = {row[0]: dict(zip(ROOM_COLUMNS, row), status='vacant') for row in rows}
+        self.slots = {room_id: {} for room_id in self.rooms}
+        self.series = {room_id: {} for room_id in self.rooms}
+        self.occupancy.clear()
+        self.scheduler.reset(minute)
+        self.window = series_window(minute)
+
+    def load(self):
+        minute = now_minutes()
+        self.reset(fetch_rooms(self.conn), minute)
+        self.sync = ReservationSync(self.conn)
+        self.sync.track(self.rooms)
+        self.apply(self.sync.sync(), minute)
+        self.update_statuses(self.rooms, minute)
+
+    def _expand(self, room_id, added, removed):
+        window_start, window_end = self.window
+        removed.setdefault(room_id, []).extend(
+            key for _, _, key in self.occupancy.intervals(room_id) if isinstance(key, tuple))
+        added.setdefault(room_id, []).extend(
+            (start, start + series['duration'], ('series', series['id'], start))
+            for series in self.series[room_id].values()
+            for start in occurrences(series, window_start, window_end))
+
+    def apply(self, changes, minute):
+        """Apply (room_id, key, slot) changes from a ReservationSync.
+
+        Returns the ids of rooms whose bookings changed; their statuses are
+        left to update_statuses.
+        """
+        added = {}
+        removed = {}
+        series_changed = set()
+        for room_id, key, slot in changes:
+            if room_id not in self.rooms:
+                continue
+            if isinstance(key, tuple):
+                if slot is None:
+                    self.series[room_id].pop(key[1], None)
+                else:
+                    self.series[room_id][key[1]] = slot
+                series_changed.add(room_id)
+                continue
+            slots = self.slots[room_id]
+            # Resyncs repeat unchanged bookings; a reused rowid shows up as a
+            # plain insert and replaces the old slot.
+            if slots.get(key) == slot:
+                continue
+            if slots.pop(key, None) is not None:
+                removed.setdefault(room_id, []).append(key)
+            if slot is not None:
+                slots[key] = slot
+                added.setdefault(room_id, []).append((slot['start_minute'], slot['end_minute'], key))
+        for room_id in series_changed:
+            self._expand(room_id, added, removed)
+        changed = set(added) | set(removed)
+        for room_id in changed:
+            self.occupancy.update(room_id, added.get(room_id, ()), removed.get(room_id, ()))
+            self.scheduler.update_room(room_id, minute)
+        return changed
+
+    def slide_window(self, minute):
+        # Re-expands recurring series once `minute` nears the end of the
+        # window; returns the ids of rooms that have any.
+        if minute < self.window[1] - DAY:
+            return set()
+        self.window = series_window(minute)
+        added = {}
+        removed = {}
+        for room_id, series in self.series.items():
+            if series:
+                self._expand(room_id, added, removed)
+        for room_id in added:
+            self.occupancy.update(room_id, added[room_id], removed[room_id])
+            self.scheduler.update_room(room_id, minute)
+        return set(added)
+
+    def update_statuses(self, room_ids, minute):
+        # Returns the ids whose status flipped.
+        flipped = []
+        for room_id in room_ids:
+            room = self.rooms[room_id]
+            status = 'occupied' if self.occupancy.is_occupied(room_id, minute) else 'vacant'
+            if room['status'] != status:
+                room['status'] = status
+                flipped.append(room_id)
+        return flipped
+
+    def pop_due(self, minute):
+        return self.scheduler.pop_due(minute) & self.rooms.keys()
+
+    def refresh(self, minute=None):
+        # Returns the ids of rooms whose status or next change moved.
+        minute = now_minutes() if minute is None else minute
+        touched = self.apply(self.sync.sync(), minute)
+        touched |= self.slide_window(minute)
+        touched |= self.pop_due(minute)
+        self.update_statuses(touched, minute)
+        return touched
+
+    def next_due(self):
+        return self.scheduler.next_due()
+
+    def snapshot(self, building_id=None, minute=None):
+        minute = now_minutes() if minute is None else minute
+        rooms = []
+        for room_id, room in self.rooms.items():
+            if building_id is not None and room['building_id'] != building_id:
+                continue
+            boundary = self.occupancy.next_boundary(room_id, minute)
+            rooms.append(dict(room, next_change=format_minutes(boundary) if boundary is not None else None))
+        return rooms
+
+
+class ReservationService:
+    """Qt-free front end to one rooms database for kiosks and the HTTP API.
+
+    Reads are cached until the next write, either through this service or
+    by another process (noticed by `refresh`, which the caller runs
+    periodically). Room status is kept in a RoomStatus; `version` goes up
+    every time any room's status or next change moves, which is what
+    long-poll and server-sent event clients wait on. Not thread-safe: use from one thread.
+    """
+
+    def __init__(self, path):
+        self.conn = schema.connect(path)
+        self.external = ExternalChanges(self.conn)
+        self.signature = rooms_signature(self.conn)
+        self.status_index = RoomStatus(self.conn)
+        self.availability_index = None
+        self.cache = {}
+        self.version = 1
+
+    def close(self):
+        self.conn.close()
+
+    def _cached(self, key, fn, *args):
+        try:
+            return self.cache[key]
+        except KeyError:
+            value = self.cache[key] = fn(*args)
+            return value
+
+    def invalidate(self):
+        self.cache.clear()
+
+    def refresh(self, minute=None):
+        """Pick up other writers' commits and clock transitions; True if the status moved."""
+        if self.external.poll():
+            self.invalidate()
+            signature = rooms_signature(self.conn)
+            if signature != self.signature:
+                self.signature = signature
+                self.status_index.load()
+                self.version += 1
+                return True
+        if self.status_index.refresh(minute):
+            self.cache.pop('status', None)
+            self.version += 1
+            return True
+        return False
+
+    def next_due(self):
+        return self.status_index.next_due()
+
+    def buildings(self):
+        return self._cached('buildings', lambda: [
+            {'id': building_id, 'name': name} for building_id, name in fetch_buildings(self.conn)])
+
+    def rooms(self, building_id=None):
+        return self._cached(('rooms', building_id), lambda: [
+            dict(zip(ROOM_COLUMNS, row), feature_mask=masks.get(row[0], 0))
+            for masks in [room_masks(self.conn.cursor(), building_id)]
+            for row in fetch_rooms(self.conn, building_id)])
+
+    def status(self, building_id=None):
+        # Only the last version's snapshots are kept, one per building filter.
+        snapshots = self.cache.setdefault('status', {})
+        if building_id not in snapshots:
+            snapshots[building_id] = {'version': self.version, 'rooms': self.status_index.snapshot(building_id)}
+        return snapshots[building_id]
+
+    def availability(self, start_minute, end_minute, duration, capacity=0, features=(), building_id=None, limit=20):
+        # numpy is only needed once someone searches.
+        from availability import AvailabilityIndex
+        if self.availability_index is None:
+            self.availability_index = AvailabilityIndex(self.conn)
+        key = ('availability', start_minute, end_minute, duration, capacity, tuple(features), building_id, limit)
+        return self._cached(key, self.availability_index.search, start_minute, end_minute, duration, capacity,
+                            features, building_id, limit)
+
+    def _written(self):
+        # Our own commits do not move data_version, so catch up explicitly.
+        self.invalidate()
+        if self.status_index.refresh():
+            self.version += 1
+
+    def book(self, booking):
+        """Book a reservation, or a series when it has a 'frequency'.
+
+        Times may be given as epoch minutes or as 'YYYY-MM-DD HH:MM' strings
+        under start_time/end_time/until_time. Raises ValueError for bad
+        input and conflicts.BookingConflict when the slot is taken.
+        """
+        result = book(self.conn, parse_booking(booking))
+        self._written()
+        return result
+
+    def cancel(self, reservation_id):
+        deleted = delete_reservations(self.conn, [reservation_id])
+        self._written()
+        return deleted > 0
+
+
+def parse_booking(data):
+    booking = {}
+    for field in ('room_id', 'priority', 'interval', 'count'):
+        if data.get(field) is not None:
+            booking[field] = int(data[field])
+    if 'room_id' not in booking:
+        raise ValueError("room_id is required")
+    check_priority(booking.get('priority'))
+    for field in ('teacher_name', 'student_name', 'purpose', 'frequency'):
+        if data.get(field) is not None:
+            booking[field] = str(data[field])
+    for field in ('start', 'end', 'until'):
+        if data.get(f'{field}_minute') is not None:
+            booking[f'{field}_minute'] = int(data[f'{field}_minute'])
+        elif data.get(f'{field}_time'):
+            try:
+                booking[f'{field}_minute'] = to_minutes(str(data[f'{field}_time']))
+            except (ValueError, IndexError):
+                raise ValueError(f"{field}_time must look like YYYY-MM-DD HH:MM")
+    if 'start_minute' not in booking or 'end_minute' not in booking:
+        raise ValueError("start and end times are required")
+    if booking.get('frequency'):
+        booking['duration'] = booking.pop('end_minute') - booking['start_minute']
+    else:
+        for field in ('until_minute', 'interval', 'count'):
+            booking.pop(field, None)
+    return booking
@@ -0,0 +1,102 @@
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+import schema
+from conflicts import BookingConflict, ConflictEngine
+
+# Few rooms and a few days, so attempts keep colliding with each other
+# well before the rooms fill up.
+ROOMS = 3
+SPAN_MINUTES = 3 * 24 * 60
+DURATIONS = (15, 30, 45, 60, 90)
+
+
+def _book_many(path, seed, attempts, priorities, results):
+    conn = schema.connect(path)
+    engine = ConflictEngine(conn)
+    room_ids = [row[0] for row in conn.execute('SELECT id FROM rooms')]
+    rng = random.Random(seed)
+    counts = {'booked': 0, 'conflicts': 0, 'errors': 0}
+    for _ in range(attempts):
+        start = rng.randrange(0, SPAN_MINUTES, 15)
+        booking = {
+            'room_id': rng.choice(room_ids),
+            'start_minute': start,
+            'end_minute': start + rng.choice(DURATIONS),
+            'teacher_name': f"desk {seed}",
+            'priority': rng.choice(priorities),
+        }
+        try:
+            engine.book(booking)
+            counts['booked'] += 1
+        except BookingConflict:
+            counts['conflicts'] += 1
+        except Exception as error:
+            counts['errors'] += 1
+            print(f"desk {seed}: {error}", file=sys.stderr)
+    conn.close()
+    results.put(counts)
+
+
+def double_bookings(conn):
+    return conn.execute('''
+        SELECT COUNT(*) FROM reservations AS a JOIN reservations AS b
+        ON a.room_id = b.room_id AND a.id < b.id
+           AND a.start_minute < b.end_minute AND b.start_minute < a.end_minute
+    ''').fetchone()[0]
+
+
+def run(path, processes, attempts, priorities):
+    conn = schema.connect(path)
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO buildings (name) VALUES ('Stress')")
+    building_id = cursor.lastrowid
+    cursor.executemany('INSERT INTO rooms (name, building_id, floor, capacity) VALUES (?, ?, 1, 10)',
+                       [(f"Room {i}", building_id) for i in range(ROOMS)])
+    conn.commit()
+
+    results = multiprocessing.Queue()
+    desks = [multiprocessing.Process(target=_book_many, args=(path, seed, attempts, priorities, results))
+             for seed in range(processes)]
+    started = time.perf_counter()
+    for desk in desks:
+        desk.start()
+    totals = {'booked': 0, 'conflicts': 0, 'errors': 0}
+    for _ in desks:
+        for key, value in results.get().items():
+            totals[key] += value
+    for desk in desks:
+        desk.join()
+    elapsed = time.perf_counter() - started
+
+    overlaps = double_bookings(conn)
+    remaining = conn.execute('SELECT COUNT(*) FROM reservations').fetchone()[0]
+    conn.close()
+    print(f"{processes} processes x {attempts} attempts in {elapsed:.2f}s: {totals['booked']} booked "
+          f"({remaining} kept), {totals['conflicts']} conflicts, {totals['errors']} errors, "
+          f"{overlaps} double bookings")
+    return 1 if overlaps or totals['errors'] else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Book overlapping slots from several processes at once and check none were double-booked.')
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--attempts', type=int, default=200, help='bookings tried by each process')
+    parser.add_argument('--db', help='database to create (default: a temporary file)')
+    parser.add_argument('--no-bump', action='store_true', help='give every booking the same priority')
+    args = parser.parse_args(argv)
+    priorities = (3,) if args.no_bump else (1, 3, 5, 7)
+    if args.db:
+        return run(args.db, args.processes, args.attempts, priorities)
+    with tempfile.TemporaryDirectory() as directory:
+        return run(os.path.join(directory, 'stress.db'), args.processes, args.attempts, priorities)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,149 @@
+from recurrence import SERIES_COLUMNS, series_from_row
+
+RESERVATION_COLUMNS = 'id, room_id, start_minute, end_minute, teacher_name, student_name, purpose, priority'
+
+# Keeps IN (...) lists well below SQLite's bound-parameter limit.
+CHUNK_SIZE = 500
+
+
+def reservation_slot(row):
+    res_id, room_id, start_minute, end_minute, teacher_name, student_name, purpose, priority = row
+    return {
+        'id': res_id,
+        'start_minute': start_minute,
+        'end_minute': end_minute,
+        'teacher_name': teacher_name,
+        'student_name': student_name,
+        'purpose': purpose,
+        'priority': priority
+    }
+
+
+def series_key(series_id):
+    return ('series', series_id)
+
+
+class ReservationSync:
+    """Keeps an in-memory copy of a set of rooms' reservations up to date.
+
+    Change log entries come from the triggers installed by schema.py.
+    The first sync after `track` loads the tracked rooms' rows; later syncs
+    only read the change log past the last seen sequence number, so their
+    cost is proportional to what changed. A reader that fell behind a
+    trimmed change log loads again, reporting rows it no longer finds as
+    gone. Each sync returns
+    (room_id, key, slot) tuples where key is a reservation id, or
+    series_key(id) for a recurring series whose slot is the series itself,
+    and a slot of None means the row is gone; applying the same tuple twice
+    is harmless.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.room_ids = frozenset()
+        self.watermark = None
+        # key -> room id of every row the last syncs reported as present.
+        self.known = {}
+
+    def track(self, room_ids):
+        self.room_ids = frozenset(room_ids)
+        self.watermark = None
+        self.known = {}
+
+    def _current_seq(self, cursor):
+        cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM reservation_changes')
+        return cursor.fetchone()[0]
+
+    def _pruned_past(self, cursor, watermark):
+        # True when change log entries after `watermark` have been trimmed
+        # (see archive.prune_batch). Sequence numbers have no other gaps.
+        cursor.execute('SELECT MIN(seq) FROM reservation_changes')
+        oldest = cursor.fetchone()[0]
+        return oldest is not None and oldest > watermark + 1
+
+    def _fetch(self, cursor, sql, values):
+        values = list(values)
+        for i in range(0, len(values), CHUNK_SIZE):
+            chunk = values[i:i + CHUNK_SIZE]
+            cursor.execute(sql.format(params=",".join("?" * len(chunk))), chunk)
+            yield from cursor.fetchall()
+
+    def _reservations(self, cursor, column, values):
+        return self._fetch(cursor, f'SELECT {RESERVATION_COLUMNS} FROM reservations WHERE {column} IN ({{params}})',
+                           values)
+
+    def _series(self, cursor, column, values):
+        rows = list(self._fetch(
+            cursor, f'SELECT {", ".join(SERIES_COLUMNS)} FROM reservation_series WHERE {column} IN ({{params}})',
+            values))
+        exceptions = {}
+        for series_id, occurrence_start in self._fetch(
+                cursor, 'SELECT series_id, occurrence_start FROM series_exceptions WHERE series_id IN ({params})',
+                [row[0] for row in rows]):
+            exceptions.setdefault(series_id, []).append(occurrence_start)
+        return [series_from_row(row, exceptions.get(row[0], ())) for row in rows]
+
+    def _load(self, cursor):
+        # Read the watermark first: rows committed while loading are then
+        # seen again by the next delta, which is idempotent.
+        self.watermark = self._current_seq(cursor)
+        changes = [(row[1], row[0], reservation_slot(row))
+                   for row in self._reservations(cursor, 'room_id', self.room_ids)]
+        changes.extend((series['room_id'], series_key(series['id']), series)
+                       for series in self._series(cursor, 'room_id', self.room_ids))
+        loaded = {key: room_id for room_id, key, slot in changes}
+        # After a resync, rows deleted while this reader was behind.
+        changes.extend((room_id, key, None) for key, room_id in self.known.items() if key not in loaded)
+        self.known = loaded
+        return changes
+
+    def sync(self):
+        cursor = self.conn.cursor()
+        if self.watermark is None:
+            return self._load(cursor)
+
+        cursor.execute('SELECT seq, reservation_id, room_id, op FROM reservation_changes WHERE seq > ? ORDER BY seq',
+                       (self.watermark,))
+        entries = cursor.fetchall()
+        if self._pruned_past(cursor, self.watermark):
+            return self._load(cursor)
+        latest = {}
+        for seq, row_id, room_id, op in entries:
+            self.watermark = seq
+            if room_id in self.room_ids:
+                key = series_key(row_id) if op == 'series' else row_id
+                latest[key] = (room_id, op)
+
+        inserted = [key for key, (room_id, op) in latest.items() if op == 'insert']
+        rows = {row[0]: reservation_slot(row) for row in self._reservations(cursor, 'id', inserted)}
+        series_ids = [key[1] for key, (room_id, op) in latest.items() if op == 'series']
+        rows.update((series_key(series['id']), series) for series in self._series(cursor, 'id', series_ids))
+        changes = [(room_id, key, rows.get(key)) for key, (room_id, op) in latest.items()]
+        for room_id, key, slot in changes:
+            if slot is None:
+                self.known.pop(key, None)
+            else:
+                self.known[key] = room_id
+        return changes
+
+
+class ExternalChanges:
+    """Cheap test for commits made by other connections, e.g. other app instances.
+
+    PRAGMA data_version changes whenever another connection commits to the
+    database file and never for this connection's own commits, so polling
+    it costs no table reads.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.version = self._data_version()
+
+    def _data_version(self):
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def poll(self):
+        version = self._data_version()
+        changed = version != self.version
+        self.version = version
+        return changed
@@ -0,0 +1,159 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import schema
+
+# The tables as the first release created them, times as 'YYYY-MM-DD HH:MM' text.
+LEGACY_TABLES = '''
+    CREATE TABLE buildings (
+        id INTEGER PRIMARY KEY,
+        name TEXT
+    );
+    CREATE TABLE rooms (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        building_id INTEGER,
+        floor INTEGER,
+        capacity INTEGER,
+        features TEXT,
+        FOREIGN KEY(building_id) REFERENCES buildings(id)
+    );
+    CREATE TABLE reservations (
+        id INTEGER PRIMARY KEY,
+        room_id INTEGER,
+        start_time TEXT,
+        end_time TEXT,
+        teacher_name TEXT,
+        student_name TEXT,
+        purpose TEXT,
+        FOREIGN KEY(room_id) REFERENCES rooms(id)
+    );
+'''
+
+# (id, room_id, start_time, end_time) and the epoch minutes each should become.
+LEGACY_RESERVATIONS = [
+    (1, 1, '1970-01-01 00:00', '1970-01-01 00:30', 0, 30),
+    (2, 1, '1970-01-02 09:15', '1970-01-02 10:00', 1440 + 555, 1440 + 600),
+    (3, 2, '2024-02-29 23:30', '2024-03-01 01:00', 19782 * 1440 + 1410, 19783 * 1440 + 60),
+    (7, 2, '2025-12-31 08:00', '2025-12-31 09:45', 20453 * 1440 + 480, 20453 * 1440 + 585),
+    (9, 3, '1999-07-04 12:00', '1999-07-04 13:00', 10776 * 1440 + 720, 10776 * 1440 + 780),
+]
+
+
+class LegacyMigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'rooms.db')
+        legacy = sqlite3.connect(self.path)
+        legacy.executescript(LEGACY_TABLES)
+        legacy.execute("INSERT INTO buildings VALUES (1, 'Main')")
+        legacy.executemany('INSERT INTO rooms VALUES (?, ?, 1, ?, ?, ?)', [
+            (1, 'Room 101', 1, 10, 'Projector, Whiteboard'),
+            (2, 'Room 102', 1, 4, ''),
+            (3, 'Room 201', 2, 30, 'projector'),
+        ])
+        legacy.executemany('INSERT INTO reservations VALUES (?, ?, ?, ?, ?, ?, ?)', [
+            (res_id, room_id, start, end, f'Teacher {res_id}', f'Student {res_id}', f'Purpose {res_id}')
+            for res_id, room_id, start, end, _, _ in LEGACY_RESERVATIONS
+        ])
+        legacy.commit()
+        legacy.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def connect(self):
+        # A tiny chunk size makes the reservation rewrite take several rounds.
+        with mock.patch.object(schema, 'MIGRATION_CHUNK_SIZE', 2):
+            conn = schema.connect(self.path)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_upgrades_to_current_version(self):
+        conn = self.connect()
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], schema.SCHEMA_VERSION)
+
+    def test_converts_text_times_to_epoch_minutes(self):
+        conn = self.connect()
+        rows = conn.execute('''
+            SELECT id, room_id, start_minute, end_minute, teacher_name, student_name, purpose, priority
+            FROM reservations ORDER BY id
+        ''').fetchall()
+        self.assertEqual(rows, [
+            (res_id, room_id, start, end, f'Teacher {res_id}', f'Student {res_id}', f'Purpose {res_id}', None)
+            for res_id, room_id, _, _, start, end in LEGACY_RESERVATIONS
+        ])
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(reservations)')]
+        self.assertNotIn('start_time', columns)
+        self.assertNotIn('end_time', columns)
+
+    def test_creates_indexes(self):
+        conn = self.connect()
+        indexes = {row[0]: (row[1], row[2]) for row in conn.execute(
+            "SELECT name, tbl_name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")}
+        self.assertEqual(indexes['idx_reservations_room_start'][0], 'reservations')
+        self.assertIn('(room_id, start_minute, end_minute)', indexes['idx_reservations_room_start'][1])
+        self.assertIn('(start_minute)', indexes['idx_reservations_start'][1])
+        self.assertIn('(building_id)', indexes['idx_rooms_building'][1])
+        plan = conn.execute('EXPLAIN QUERY PLAN SELECT id FROM reservations WHERE room_id = 1 AND start_minute < 60')
+        self.assertIn('idx_reservations_room_start', ' '.join(row[3] for row in plan))
+
+    def test_sets_connection_pragmas(self):
+        conn = self.connect()
+        self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        self.assertEqual(conn.execute('PRAGMA foreign_keys').fetchone()[0], 1)
+
+    def test_migrates_in_wal_mode(self):
+        modes = []
+
+        def recording(step):
+            def run(cursor):
+                modes.append(cursor.execute('PRAGMA journal_mode').fetchone()[0])
+                step(cursor)
+            return run
+
+        with mock.patch.object(schema, 'MIGRATIONS', [recording(step) for step in schema.MIGRATIONS]):
+            self.connect()
+        self.assertEqual(modes, ['wal'] * schema.SCHEMA_VERSION)
+
+    def test_keeps_rooms_and_links_features(self):
+        conn = self.connect()
+        self.assertEqual(conn.execute('SELECT id, name, floor, capacity FROM rooms ORDER BY id').fetchall(),
+                         [(1, 'Room 101', 1, 10), (2, 'Room 102', 1, 4), (3, 'Room 201', 2, 30)])
+        links = conn.execute('''
+            SELECT room_id, features.name FROM room_features JOIN features ON features.id = feature_id
+            ORDER BY room_id, features.name
+        ''').fetchall()
+        self.assertEqual([(room_id, name.lower()) for room_id, name in links],
+                         [(1, 'projector'), (1, 'whiteboard'), (3, 'projector')])
+
+    def test_new_ids_follow_legacy_ones(self):
+        conn = self.connect()
+        cursor = conn.execute('INSERT INTO reservations (room_id, start_minute, end_minute) VALUES (1, 100, 160)')
+        self.assertGreater(cursor.lastrowid, max(row[0] for row in LEGACY_RESERVATIONS))
+        self.assertEqual(conn.execute('SELECT op FROM reservation_changes WHERE reservation_id = ?',
+                                      (cursor.lastrowid,)).fetchall(), [('insert',)])
+
+    def test_reconnecting_is_a_no_op(self):
+        self.connect().close()
+        conn = self.connect()
+        self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], schema.SCHEMA_VERSION)
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM reservations').fetchone()[0], len(LEGACY_RESERVATIONS))
+
+    def test_keeps_legacy_priority_column(self):
+        legacy = sqlite3.connect(self.path)
+        legacy.execute('ALTER TABLE reservations ADD COLUMN priority INTEGER')
+        legacy.execute('UPDATE reservations SET priority = id % 7 + 1')
+        legacy.commit()
+        legacy.close()
+        conn = self.connect()
+        self.assertEqual(conn.execute('SELECT id, priority FROM reservations ORDER BY id').fetchall(),
+                         [(row[0], row[0] % 7 + 1) for row in LEGACY_RESERVATIONS])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,18 @@
+import pytest
+
+import schema
+import stress
+
+
+# Enough contention that checking and inserting outside one write transaction
+# double-books, while the whole run still takes about a second.
+@pytest.mark.parametrize('priorities', [(1, 3, 5, 7), (3,)], ids=['bump', 'no-bump'])
+def test_concurrent_desks_never_double_book(tmp_path, priorities):
+    path = str(tmp_path / 'stress.db')
+    assert stress.run(path, processes=6, attempts=150, priorities=priorities) == 0
+    conn = schema.connect(path)
+    try:
+        assert stress.double_bookings(conn) == 0
+        assert conn.execute('SELECT COUNT(*) FROM reservations').fetchone()[0] > 0
+    finally:
+        conn.close()
@@ -0,0 +1,53 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import schema
+import utilization
+from timeutil import to_minutes
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = schema.connect(str(tmp_path / 'rooms.db'))
+    conn.execute("INSERT INTO buildings (id, name) VALUES (1, 'Main')")
+    conn.execute("INSERT INTO rooms (id, name, building_id, floor, capacity) VALUES (1, 'Room 101', 1, 1, 10)")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def book_mondays(conn, first, last, layers):
+    # `layers` overlapping 09:00-10:00 bookings every Monday from first to last.
+    rows = []
+    monday = first
+    while monday <= last:
+        start = to_minutes(datetime.combine(monday, datetime.min.time())) + 9 * 60
+        rows.extend([(start, start + 60)] * layers)
+        monday += timedelta(days=7)
+    conn.executemany('INSERT INTO reservations (room_id, start_minute, end_minute) VALUES (1, ?, ?)', rows)
+    conn.commit()
+
+
+def monday_hours(conn, first, last):
+    _, heat, _ = utilization.heatmap(conn, utilization.day_number(first), utilization.day_number(last) + 1)
+    return heat[0, :24]
+
+
+def test_heatmap_sums_many_months_of_overlapping_bookings(conn):
+    # Six years of three stacked bookings is far more than one packed field holds.
+    first, last = date(2020, 1, 6), date(2025, 12, 29)
+    book_mondays(conn, first, last, 3)
+    hours = monday_hours(conn, first, last)
+    assert hours[9] == pytest.approx(3.0)
+    assert not hours[:9].any() and not hours[10:].any()
+
+
+def test_monthly_field_holds_the_documented_overlap(conn):
+    # March 2021 has five Mondays; 109 layers is the most a month's field holds.
+    first, last = date(2021, 3, 1), date(2021, 3, 29)
+    book_mondays(conn, first, last, 109)
+    assert 109 * 5 * 60 < 1 << schema.HOUR_BITS
+    hours = monday_hours(conn, first, last)
+    assert hours[9] == pytest.approx(109.0)
+    assert not hours[10:].any()
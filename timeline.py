@@ -0,0 +1,445 @@
+from bisect import bisect_left
+from collections import OrderedDict
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+
+from conflicts import MEETING_TYPES
+from recurrence import DAY, occurrences
+from timeutil import format_minutes, from_minutes, now_minutes
+
+ROW_HEIGHT = 26
+LABEL_WIDTH = 160
+HEADER_HEIGHT = 40
+# Rows are drawn in tiles this many pixels wide. A tile is only rendered
+# again when its room's bookings, the zoom or the shown days change.
+TILE_WIDTH = 512
+# Least recently drawn tiles are dropped past this many, about 50 MB.
+MAX_TILES = 1000
+MAX_PIXELS_PER_MINUTE = 4.0
+ZOOM_STEP = 1.25
+# While the wheel keeps zooming, the tiles from before are drawn stretched;
+# rows are rendered sharp again once it has rested this long.
+ZOOM_SETTLE_MS = 150
+SNAP_MINUTES = 15
+CLICK_BOOKING_MINUTES = 60
+# Minutes between grid lines and between hour labels, the first that leaves
+# enough room at the current zoom.
+GRID_STEPS = (15, 30, 60, 180, 360, 720, DAY)
+MIN_GRID_PIXELS = 12
+
+# One colour per meeting type, strongest for the most important ones.
+PRIORITY_COLORS = {
+    1: QtGui.QColor('#c62828'),
+    2: QtGui.QColor('#ef6c00'),
+    3: QtGui.QColor('#f9a825'),
+    4: QtGui.QColor('#2e7d32'),
+    5: QtGui.QColor('#00838f'),
+    6: QtGui.QColor('#1565c0'),
+    7: QtGui.QColor('#6a1b9a'),
+}
+UNKNOWN_PRIORITY_COLOR = QtGui.QColor('#757575')
+EDGE_COLORS = {priority: color.darker(150) for priority, color in PRIORITY_COLORS.items()}
+TEXT_COLORS = {priority: QtGui.QColor('#212121' if color.lightness() > 140 else '#ffffff')
+               for priority, color in PRIORITY_COLORS.items()}
+
+
+def _grid_step(pixels_per_minute, min_pixels):
+    return next((step for step in GRID_STEPS if step * pixels_per_minute >= min_pixels), GRID_STEPS[-1])
+
+
+def _booking_text(booking):
+    return " · ".join(filter(None, (booking.get('teacher_name'), booking.get('purpose'))))
+
+
+class TimelineView(QtWidgets.QAbstractScrollArea):
+    """Rooms as rows and time as columns, with bookings as bars coloured by priority.
+
+    Reads the main window's room dictionaries (reserved slots and series)
+    directly; call `invalidate` with the rooms whose bookings changed.
+    Only visible rows and tiles are painted, and rendered tiles are cached
+    per room, so scrolling mostly copies pixmaps. Ctrl+wheel zooms around
+    the pointer. Clicking or dragging across free time emits
+    `bookingRequested(room, start minute, end minute)`.
+    """
+
+    bookingRequested = QtCore.pyqtSignal(str, int, int)
+
+    def __init__(self, rooms, parent=None):
+        super().__init__(parent)
+        self.rooms = rooms
+        self.names = []
+        self.firstDay = now_minutes() // DAY
+        self.days = 1
+        self.pixelsPerMinute = 1.0
+        self.fitted = True
+        self.bookings = {}
+        self.tiles = OrderedDict()
+        self.roomTiles = {}
+        # The grid behind the bars is the same in every row.
+        self.gridTiles = {}
+        self.staleTiles = None
+        self.settleTimer = QtCore.QTimer(self)
+        self.settleTimer.setSingleShot(True)
+        self.settleTimer.setInterval(ZOOM_SETTLE_MS)
+        self.settleTimer.timeout.connect(self.settleZoom)
+        self.selection = None
+        self.viewport().setAttribute(QtCore.Qt.WA_OpaquePaintEvent)
+        self.verticalScrollBar().setSingleStep(ROW_HEIGHT)
+        self.horizontalScrollBar().setSingleStep(TILE_WIDTH // 8)
+        self.gridPen = QtGui.QPen(QtGui.QColor('#e4e4e4'))
+        self.dayPen = QtGui.QPen(QtGui.QColor('#9e9e9e'))
+        self.textPen = QtGui.QPen(QtGui.QColor('#333333'))
+        self.nowPen = QtGui.QPen(QtGui.QColor('#d50000'), 2)
+
+    def setRooms(self, names):
+        names = list(names)
+        if names == self.names:
+            return
+        self.names = names
+        self.updateScrollBars()
+        self.viewport().update()
+
+    def setRange(self, first_day, days):
+        if (first_day, days) == (self.firstDay, self.days):
+            return
+        self.firstDay = first_day
+        self.days = days
+        self.bookings.clear()
+        if self.fitted or self.pixelsPerMinute < self.fitZoom():
+            self.setZoom(self.fitZoom())
+        else:
+            self.clearTiles()
+            self.updateScrollBars()
+        self.viewport().update()
+
+    def invalidate(self, rooms=None):
+        # Drops the cached bookings and tiles of `rooms`, or of every room.
+        self.staleTiles = None
+        if rooms is None:
+            self.bookings.clear()
+            self.clearTiles()
+        else:
+            for room in rooms:
+                self.bookings.pop(room, None)
+                for index in self.roomTiles.pop(room, ()):
+                    del self.tiles[(room, index)]
+        self.viewport().update()
+
+    def clearTiles(self):
+        self.tiles.clear()
+        self.roomTiles.clear()
+        self.gridTiles.clear()
+
+    def rangeStart(self):
+        return self.firstDay * DAY
+
+    def rangeEnd(self):
+        return (self.firstDay + self.days) * DAY
+
+    def fitZoom(self):
+        return min(max(self.viewport().width() - LABEL_WIDTH, 1) / (self.days * DAY), MAX_PIXELS_PER_MINUTE)
+
+    def contentWidth(self):
+        return int(self.days * DAY * self.pixelsPerMinute)
+
+    def setZoom(self, pixels_per_minute, anchor_x=None, interactive=False):
+        # Keeps the time under anchor_x (viewport x) in place.
+        if interactive:
+            if self.staleTiles is None:
+                self.staleTiles = (self.pixelsPerMinute, self.tiles)
+                self.tiles = OrderedDict()
+            self.settleTimer.start()
+        else:
+            self.staleTiles = None
+        fit = self.fitZoom()
+        anchor_x = LABEL_WIDTH if anchor_x is None else max(anchor_x, LABEL_WIDTH)
+        minute = (anchor_x - LABEL_WIDTH + self.horizontalScrollBar().value()) / self.pixelsPerMinute
+        self.pixelsPerMinute = min(max(pixels_per_minute, fit), MAX_PIXELS_PER_MINUTE)
+        self.fitted = self.pixelsPerMinute <= fit
+        self.clearTiles()
+        self.updateScrollBars()
+        self.horizontalScrollBar().setValue(round(minute * self.pixelsPerMinute - (anchor_x - LABEL_WIDTH)))
+        self.viewport().update()
+
+    def updateScrollBars(self):
+        width = self.viewport().width() - LABEL_WIDTH
+        height = self.viewport().height() - HEADER_HEIGHT
+        self.horizontalScrollBar().setPageStep(max(width, 1))
+        self.horizontalScrollBar().setRange(0, max(0, self.contentWidth() - width))
+        self.verticalScrollBar().setPageStep(max(height, 1))
+        self.verticalScrollBar().setRange(0, max(0, len(self.names) * ROW_HEIGHT - height))
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        if self.fitted or self.pixelsPerMinute < self.fitZoom():
+            self.setZoom(self.fitZoom())
+        else:
+            self.updateScrollBars()
+
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+
+    def wheelEvent(self, event):
+        if event.modifiers() & QtCore.Qt.ControlModifier:
+            factor = ZOOM_STEP if event.angleDelta().y() > 0 else 1 / ZOOM_STEP
+            self.setZoom(self.pixelsPerMinute * factor, event.pos().x(), interactive=True)
+            event.accept()
+        else:
+            super().wheelEvent(event)
+
+    def settleZoom(self):
+        self.staleTiles = None
+        self.viewport().update()
+
+    def drawStaleRow(self, painter, room, y, dx, width):
+        # Stretches the row's tiles from before the zoom over the visible
+        # part; False if one of them is missing.
+        scale, tiles = self.staleTiles
+        ratio = self.pixelsPerMinute / scale
+        first, last = int(dx / ratio) // TILE_WIDTH, int((dx + width - 1) / ratio) // TILE_WIDTH
+        pixmaps = [tiles.get((room, index)) for index in range(first, last + 1)]
+        if None in pixmaps:
+            return False
+        for index, pixmap in enumerate(pixmaps, first):
+            painter.drawPixmap(QtCore.QRectF(LABEL_WIDTH + index * TILE_WIDTH * ratio - dx, y,
+                                             TILE_WIDTH * ratio, ROW_HEIGHT),
+                               pixmap, QtCore.QRectF(0, 0, pixmap.width(), pixmap.height()))
+        return True
+
+    def roomBookings(self, room):
+        # (start, end, priority, booking) overlapping the shown days, by start,
+        # with their starts and the longest duration for bisecting.
+        cached = self.bookings.get(room)
+        if cached is None:
+            info = self.rooms.get(room)
+            start, end = self.rangeStart(), self.rangeEnd()
+            bookings = []
+            if info is not None:
+                bookings.extend((slot['start_minute'], slot['end_minute'], slot['priority'], slot)
+                                for slot in info['reserved_slots'].values()
+                                if slot['start_minute'] < end and slot['end_minute'] > start)
+                bookings.extend((occurrence, occurrence + series['duration'], series['priority'], series)
+                                for series in info['series'].values()
+                                for occurrence in occurrences(series, start, end))
+            bookings.sort(key=lambda booking: booking[:2])
+            cached = self.bookings[room] = (bookings, [booking[0] for booking in bookings],
+                                            max((end - start for start, end, _, _ in bookings), default=0))
+        return cached
+
+    def bookingsBetween(self, room, first, last):
+        bookings, starts, longest = self.roomBookings(room)
+        return [booking for booking in bookings[bisect_left(starts, first - longest):bisect_left(starts, last)]
+                if booking[1] > first]
+
+    def tile(self, room, index):
+        key = (room, index)
+        pixmap = self.tiles.get(key)
+        if pixmap is not None:
+            self.tiles.move_to_end(key)
+            return pixmap
+        pixmap = self.tiles[key] = self.renderTile(room, index)
+        self.roomTiles.setdefault(room, set()).add(index)
+        while len(self.tiles) > MAX_TILES:
+            (old_room, old_index), _ = self.tiles.popitem(last=False)
+            self.roomTiles[old_room].discard(old_index)
+        return pixmap
+
+    def gridTile(self, index):
+        pixmap = self.gridTiles.get(index)
+        if pixmap is None:
+            ratio = self.devicePixelRatioF()
+            pixmap = self.gridTiles[index] = QtGui.QPixmap(int(TILE_WIDTH * ratio), int(ROW_HEIGHT * ratio))
+            pixmap.setDevicePixelRatio(ratio)
+            pixmap.fill(QtCore.Qt.white)
+            painter = QtGui.QPainter(pixmap)
+            scale = self.pixelsPerMinute
+            offset = self.rangeStart() + index * TILE_WIDTH / scale
+            step = _grid_step(scale, MIN_GRID_PIXELS)
+            minute = -(-int(offset) // step) * step
+            while minute < offset + TILE_WIDTH / scale:
+                x = round((minute - offset) * scale)
+                painter.setPen(self.dayPen if minute % DAY == 0 else self.gridPen)
+                painter.drawLine(x, 0, x, ROW_HEIGHT)
+                minute += step
+            painter.setPen(self.gridPen)
+            painter.drawLine(0, ROW_HEIGHT - 1, TILE_WIDTH, ROW_HEIGHT - 1)
+            painter.end()
+        return pixmap
+
+    def renderTile(self, room, index):
+        pixmap = QtGui.QPixmap(self.gridTile(index))
+        painter = QtGui.QPainter(pixmap)
+        scale = self.pixelsPerMinute
+        offset = self.rangeStart() + index * TILE_WIDTH / scale
+        first, last = offset, offset + TILE_WIDTH / scale
+
+        for start, end, priority, booking in self.bookingsBetween(room, first, last):
+            # Positions are relative to the whole row, so bars and their
+            # text line up across tile edges.
+            bar = QtCore.QRectF((start - offset) * scale, 3, max((end - start) * scale, 2), ROW_HEIGHT - 7)
+            painter.fillRect(bar, PRIORITY_COLORS.get(priority, UNKNOWN_PRIORITY_COLOR))
+            # A darker left edge separates back-to-back bookings.
+            painter.fillRect(QtCore.QRectF(bar.left(), bar.top(), 1, bar.height()),
+                             EDGE_COLORS.get(priority, QtCore.Qt.black))
+            if bar.width() > 24:
+                painter.setPen(TEXT_COLORS.get(priority, QtCore.Qt.white))
+                painter.drawText(bar.adjusted(4, 0, -2, 0), QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter,
+                                 _booking_text(booking))
+        painter.end()
+        return pixmap
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self.viewport())
+        width, height = self.viewport().width(), self.viewport().height()
+        dx, dy = self.horizontalScrollBar().value(), self.verticalScrollBar().value()
+        painter.fillRect(0, 0, width, height, QtGui.QColor('#fafafa'))
+
+        first_row = dy // ROW_HEIGHT
+        last_row = min(len(self.names), (dy + height - HEADER_HEIGHT) // ROW_HEIGHT + 1)
+        first_tile = dx // TILE_WIDTH
+        last_tile = min(dx + width - LABEL_WIDTH, self.contentWidth() - 1) // TILE_WIDTH
+        painter.setClipRect(LABEL_WIDTH, HEADER_HEIGHT, width - LABEL_WIDTH, height - HEADER_HEIGHT)
+        for row in range(first_row, last_row):
+            y = HEADER_HEIGHT + row * ROW_HEIGHT - dy
+            if self.staleTiles is not None and self.drawStaleRow(painter, self.names[row], y, dx, width - LABEL_WIDTH):
+                continue
+            for index in range(first_tile, last_tile + 1):
+                painter.drawPixmap(LABEL_WIDTH + index * TILE_WIDTH - dx, y, self.tile(self.names[row], index))
+
+        def x_of(minute):
+            return LABEL_WIDTH + round((minute - self.rangeStart()) * self.pixelsPerMinute) - dx
+
+        if self.selection is not None:
+            room, _, start, end, _, _ = self.selection
+            if room in self.names:
+                y = HEADER_HEIGHT + self.names.index(room) * ROW_HEIGHT - dy
+                highlight = QtGui.QColor(self.palette().highlight().color())
+                highlight.setAlpha(110)
+                painter.fillRect(QtCore.QRect(x_of(start), y + 1, x_of(end) - x_of(start), ROW_HEIGHT - 2),
+                                 highlight)
+        now = now_minutes()
+        if self.rangeStart() <= now < self.rangeEnd():
+            painter.setPen(self.nowPen)
+            painter.drawLine(x_of(now), HEADER_HEIGHT, x_of(now), height)
+
+        painter.setClipRect(0, HEADER_HEIGHT, LABEL_WIDTH, height - HEADER_HEIGHT)
+        painter.setPen(self.textPen)
+        metrics = painter.fontMetrics()
+        for row in range(first_row, last_row):
+            y = HEADER_HEIGHT + row * ROW_HEIGHT - dy
+            painter.drawText(QtCore.QRect(6, y, LABEL_WIDTH - 12, ROW_HEIGHT),
+                             QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter,
+                             metrics.elidedText(self.names[row], QtCore.Qt.ElideRight, LABEL_WIDTH - 12))
+        painter.setClipping(False)
+        painter.setPen(self.dayPen)
+        painter.drawLine(LABEL_WIDTH - 1, HEADER_HEIGHT, LABEL_WIDTH - 1, height)
+        self.paintHeader(painter, width, dx, x_of)
+
+    def paintHeader(self, painter, width, dx, x_of):
+        painter.fillRect(0, 0, width, HEADER_HEIGHT, QtGui.QColor('#eeeeee'))
+        painter.setClipRect(LABEL_WIDTH, 0, width - LABEL_WIDTH, HEADER_HEIGHT)
+        half = HEADER_HEIGHT // 2
+        first_minute = self.rangeStart() + dx / self.pixelsPerMinute
+        last_minute = first_minute + (width - LABEL_WIDTH) / self.pixelsPerMinute
+        for day in range(self.firstDay, self.firstDay + self.days):
+            left, right = x_of(day * DAY), x_of((day + 1) * DAY)
+            if right < LABEL_WIDTH or left > width:
+                continue
+            painter.setPen(self.dayPen)
+            painter.drawLine(left, 0, left, HEADER_HEIGHT)
+            # Day names stay in view while their day is scrolled partly out.
+            painter.setPen(self.textPen)
+            painter.drawText(QtCore.QRect(max(left, LABEL_WIDTH) + 4, 0, right - max(left, LABEL_WIDTH) - 4, half),
+                             QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter,
+                             from_minutes(day * DAY).strftime('%a %d %b %Y'))
+        label_width = painter.fontMetrics().horizontalAdvance('00:00') + 8
+        step = _grid_step(self.pixelsPerMinute, label_width)
+        minute = -(-int(first_minute) // step) * step
+        while minute < last_minute and step < DAY:
+            painter.drawText(x_of(minute) + 3, half, label_width, half,
+                             QtCore.Qt.AlignLeft | QtCore.Qt.AlignVCenter, format_minutes(minute)[11:])
+            minute += step
+        painter.setClipping(False)
+        painter.setPen(self.dayPen)
+        painter.drawLine(0, HEADER_HEIGHT - 1, width, HEADER_HEIGHT - 1)
+
+    def hitTest(self, pos):
+        # (room, minute) under a viewport position, or None outside the grid.
+        if pos.x() < LABEL_WIDTH or pos.y() < HEADER_HEIGHT:
+            return None
+        row = (pos.y() - HEADER_HEIGHT + self.verticalScrollBar().value()) // ROW_HEIGHT
+        minute = self.minuteAt(pos.x())
+        if row >= len(self.names) or minute >= self.rangeEnd():
+            return None
+        return self.names[row], minute
+
+    def minuteAt(self, x):
+        return int(self.rangeStart() + (x - LABEL_WIDTH + self.horizontalScrollBar().value()) / self.pixelsPerMinute)
+
+    def bookingAt(self, room, minute):
+        return next(iter(self.bookingsBetween(room, minute, minute + 1)), None)
+
+    def freeGap(self, room, minute):
+        # The free stretch around `minute`, within its day; the booking
+        # dialog takes one date, so the end stays before midnight.
+        day_start = minute // DAY * DAY
+        bookings = self.roomBookings(room)[0]
+        low = max([end for start, end, _, _ in bookings if end <= minute] + [day_start])
+        high = min([start for start, end, _, _ in bookings if start > minute] + [day_start + DAY - 1])
+        return low, high
+
+    def mousePressEvent(self, event):
+        hit = self.hitTest(event.pos()) if event.button() == QtCore.Qt.LeftButton else None
+        if hit is None or self.bookingAt(*hit) is not None:
+            super().mousePressEvent(event)
+            return
+        room, minute = hit
+        low, high = self.freeGap(room, minute)
+        anchor = max(minute // SNAP_MINUTES * SNAP_MINUTES, low)
+        # (room, anchor, start, end, low, high); a plain click books an hour.
+        self.selection = (room, anchor, anchor, min(anchor + CLICK_BOOKING_MINUTES, high), low, high)
+        self.viewport().update()
+
+    def mouseMoveEvent(self, event):
+        if self.selection is None:
+            super().mouseMoveEvent(event)
+            return
+        room, anchor, _, _, low, high = self.selection
+        minute = self.minuteAt(event.pos().x())
+        if minute < anchor:
+            start, end = max(minute // SNAP_MINUTES * SNAP_MINUTES, low), min(anchor + SNAP_MINUTES, high)
+        else:
+            start, end = anchor, min(-(-(minute + 1) // SNAP_MINUTES) * SNAP_MINUTES, high)
+        self.selection = (room, anchor, start, end, low, high)
+        self.viewport().update()
+
+    def mouseReleaseEvent(self, event):
+        if self.selection is None:
+            super().mouseReleaseEvent(event)
+            return
+        room, _, start, end, _, _ = self.selection
+        self.selection = None
+        self.viewport().update()
+        if end > start:
+            self.bookingRequested.emit(room, start, end)
+
+    def viewportEvent(self, event):
+        if event.type() == QtCore.QEvent.ToolTip:
+            hit = self.hitTest(event.pos())
+            booking = self.bookingAt(*hit) if hit is not None else None
+            if booking is None:
+                text = f"{hit[0]}: click or drag to book" if hit is not None else ""
+            else:
+                start, end, priority, details = booking
+                lines = [f"{hit[0]}: {format_minutes(start)} - {format_minutes(end)[11:]}"]
+                lines.extend(f"{label}: {details[field]}" for label, field in
+                             (("Teacher", 'teacher_name'), ("Student", 'student_name'), ("Purpose", 'purpose'))
+                             if details.get(field))
+                lines.append(f"{priority} - {MEETING_TYPES[priority]}" if priority in MEETING_TYPES
+                             else "Priority unknown")
+                if 'frequency' in details:
+                    lines.append(f"Repeats {details['frequency']}")
+                text = "\n".join(lines)
+            QtWidgets.QToolTip.showText(event.globalPos(), text, self.viewport())
+            return True
+        return super().viewportEvent(event)
@@ -0,0 +1,28 @@
+from datetime import date, datetime, timedelta
+
+TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = _EPOCH.toordinal()
+
+
+def to_minutes(value):
+    # Reservation times are naive local times, so "epoch minutes" here are
+    # minutes since 1970-01-01 00:00 on the wall clock, not UTC.
+    if isinstance(value, datetime):
+        return (value.toordinal() - _EPOCH_ORDINAL) * 1440 + value.hour * 60 + value.minute
+    # Slicing the fixed 'YYYY-MM-DD HH:MM' layout is far cheaper than strptime.
+    days = date(int(value[0:4]), int(value[5:7]), int(value[8:10])).toordinal() - _EPOCH_ORDINAL
+    return days * 1440 + int(value[11:13]) * 60 + int(value[14:16])
+
+
+def from_minutes(minutes):
+    return _EPOCH + timedelta(minutes=minutes)
+
+
+def format_minutes(minutes):
+    return from_minutes(minutes).strftime(TIME_FORMAT)
+
+
+def now_minutes():
+    return to_minutes(datetime.now())
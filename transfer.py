@@ -0,0 +1,360 @@
+import argparse
+import csv
+import re
+import sys
+import time
+from datetime import datetime, timezone
+
+import archive
+import schema
+import search
+import utilization
+from conflicts import BOOKING_FIELDS, ConflictEngine, check_priority
+from timeutil import TIME_FORMAT, format_minutes, from_minutes, to_minutes
+
+CSV_FIELDS = ['building', 'room', 'start_time', 'end_time', 'teacher_name', 'student_name', 'purpose', 'priority']
+ICS_TIME_FORMAT = '%Y%m%dT%H%M%S'
+
+BATCH_SIZE = 1000
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as handle:
+        reader = csv.DictReader(handle)
+        for record in reader:
+            yield reader.line_num, record
+
+
+def _unfolded_lines(handle):
+    # RFC 5545 folds long lines by starting continuations with a space or tab.
+    line_no = 0
+    pending = None
+    for line_no, line in enumerate(handle, 1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and pending is not None:
+            pending = (pending[0], pending[1] + line[1:])
+            continue
+        if pending is not None:
+            yield pending
+        pending = (line_no, line)
+    if pending is not None:
+        yield pending
+
+
+def _ics_unescape(value):
+    return re.sub(r'\\(.)', lambda match: '\n' if match.group(1) in 'nN' else match.group(1), value)
+
+
+def _ics_escape(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ics_time(value):
+    moment = datetime.strptime(value[:15], ICS_TIME_FORMAT)
+    if value.endswith('Z'):
+        # Reservations are stored in local wall-clock time.
+        moment = moment.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    return moment.strftime(TIME_FORMAT)
+
+
+def read_ics(path):
+    with open(path, encoding='utf-8') as handle:
+        event = None
+        for line_no, line in _unfolded_lines(handle):
+            name, _, value = line.partition(':')
+            name = name.split(';', 1)[0].upper()
+            if name == 'BEGIN' and value.upper() == 'VEVENT':
+                event = {'line': line_no}
+            elif event is None:
+                continue
+            elif name == 'END' and value.upper() == 'VEVENT':
+                record = {
+                    'building': event.get('X-BUILDING', ''),
+                    'room': event.get('X-ROOM') or event.get('LOCATION', ''),
+                    'start_time': event.get('DTSTART', ''),
+                    'end_time': event.get('DTEND', ''),
+                    'teacher_name': event.get('X-TEACHER', ''),
+                    'student_name': event.get('X-STUDENT', ''),
+                    'purpose': event.get('SUMMARY', ''),
+                    'priority': event.get('PRIORITY', ''),
+                }
+                try:
+                    record['start_time'] = _ics_time(record['start_time'])
+                    record['end_time'] = _ics_time(record['end_time'])
+                except ValueError:
+                    pass
+                yield event['line'], record
+                event = None
+            else:
+                event[name] = _ics_unescape(value)
+
+
+class RoomLookup:
+    """Resolves (building, room) names to room ids, caching every answer."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cache = {}
+
+    def __call__(self, building, room):
+        key = (building, room)
+        if key not in self.cache:
+            cursor = self.conn.cursor()
+            if building:
+                cursor.execute('''
+                    SELECT rooms.id FROM rooms JOIN buildings ON rooms.building_id = buildings.id
+                    WHERE buildings.name = ? AND rooms.name = ?
+                ''', (building, room))
+            else:
+                cursor.execute('SELECT id FROM rooms WHERE name = ?', (room,))
+            ids = [row[0] for row in cursor.fetchall()]
+            # A room name shared by several buildings needs the building column.
+            self.cache[key] = ids[0] if len(ids) == 1 else None
+        return self.cache[key]
+
+
+def _booking(record, lookup):
+    room_id = lookup(record.get('building', '').strip(), record.get('room', '').strip())
+    if room_id is None:
+        raise ValueError(f"Unknown or ambiguous room {record.get('room')!r}")
+    priority = (record.get('priority') or '').strip()
+    priority = int(priority) if priority else None
+    check_priority(priority)
+    return {
+        'room_id': room_id,
+        'start_minute': to_minutes(datetime.strptime(record['start_time'].strip(), TIME_FORMAT)),
+        'end_minute': to_minutes(datetime.strptime(record['end_time'].strip(), TIME_FORMAT)),
+        'teacher_name': record.get('teacher_name'),
+        'student_name': record.get('student_name'),
+        'purpose': record.get('purpose'),
+        'priority': priority,
+    }
+
+
+def import_reservations(conn, records, reject, batch_size=BATCH_SIZE, bump=True):
+    """Insert (line number, record) pairs in batches inside one transaction.
+
+    Each batch is validated with ConflictEngine.validate_batch before its
+    accepted rows go in with a single executemany; `reject(line, reason)` is
+    called for every row that was not imported. Returns (imported, rejected).
+    """
+    engine = ConflictEngine(conn, bump=bump)
+    lookup = RoomLookup(conn)
+    cursor = conn.cursor()
+    imported = rejected = 0
+
+    def flush(batch):
+        nonlocal imported, rejected
+        results = engine.validate_batch([booking for _, booking in batch])
+        displaced = []
+        rows = []
+        for (line_no, booking), result in zip(batch, results):
+            if result['status'] != 'rejected':
+                displaced.extend(other for other in result['displaced'] if 'index' not in other)
+            if result['status'] in ('accepted', 'bumped'):
+                rows.append([booking.get(field) for field in BOOKING_FIELDS])
+            elif result['status'] == 'displaced':
+                rejected += 1
+                reject(line_no, "Displaced by a higher priority row in the same import")
+            else:
+                rejected += 1
+                reject(line_no, result.get('error') or "Conflicts with " + ", ".join(
+                    f"{format_minutes(other['start_minute'])}-{format_minutes(other['end_minute'])[11:]}"
+                    for other in result['conflicts']))
+        engine.displace(cursor, displaced)
+        cursor.executemany(f'''
+            INSERT INTO reservations ({", ".join(BOOKING_FIELDS)})
+            VALUES ({", ".join("?" * len(BOOKING_FIELDS))})
+        ''', rows)
+        imported += len(rows)
+
+    try:
+        # Hold the write lock from the first validation to the commit so no
+        # other writer can book a slot this import has already checked.
+        conn.execute('BEGIN IMMEDIATE')
+        batch = []
+        for line_no, record in records:
+            try:
+                batch.append((line_no, _booking(record, lookup)))
+            except (KeyError, ValueError, AttributeError) as error:
+                rejected += 1
+                reject(line_no, str(error))
+                continue
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return imported, rejected
+
+
+def iter_reservations(conn, building=None, start_from=None, start_to=None, include_archived=False):
+    clauses = []
+    params = []
+    if building is not None:
+        clauses.append('buildings.name = ?')
+        params.append(building)
+    if start_from is not None:
+        clauses.append('reservations.start_minute >= ?')
+        params.append(start_from)
+    if start_to is not None:
+        clauses.append('reservations.start_minute < ?')
+        params.append(start_to)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT reservations.id, buildings.name, rooms.name, reservations.start_minute, reservations.end_minute,
+               reservations.teacher_name, reservations.student_name, reservations.purpose, reservations.priority
+        FROM {archive.history_source(include_archived)} AS reservations
+        JOIN rooms ON reservations.room_id = rooms.id
+        LEFT JOIN buildings ON rooms.building_id = buildings.id
+        {where}
+        ORDER BY reservations.start_minute, reservations.id
+    ''', params)
+    # Iterating the cursor streams rows instead of materialising the result.
+    yield from cursor
+
+
+def write_csv(handle, rows):
+    writer = csv.writer(handle)
+    writer.writerow(CSV_FIELDS)
+    count = 0
+    for res_id, building, room, start, end, teacher, student, purpose, priority in rows:
+        writer.writerow([building, room, format_minutes(start), format_minutes(end), teacher, student, purpose,
+                         '' if priority is None else priority])
+        count += 1
+    return count
+
+
+def _fold(line):
+    # Lines are limited to 75 octets; continuation lines start with a space.
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    while len(encoded) > 75:
+        cut = 75 if not parts else 74
+        while cut and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    parts.append(encoded.decode('utf-8'))
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def write_ics(handle, rows):
+    handle.write('BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Room Reservation App//EN\r\n')
+    stamp = datetime.now(timezone.utc).strftime(ICS_TIME_FORMAT) + 'Z'
+    count = 0
+    for res_id, building, room, start, end, teacher, student, purpose, priority in rows:
+        lines = [
+            'BEGIN:VEVENT',
+            f'UID:reservation-{res_id}@room-reservation-app',
+            f'DTSTAMP:{stamp}',
+            f'DTSTART:{from_minutes(start).strftime(ICS_TIME_FORMAT)}',
+            f'DTEND:{from_minutes(end).strftime(ICS_TIME_FORMAT)}',
+            f'SUMMARY:{_ics_escape(purpose)}',
+            f'LOCATION:{_ics_escape(room)}',
+            f'X-BUILDING:{_ics_escape(building)}',
+            f'X-ROOM:{_ics_escape(room)}',
+            f'X-TEACHER:{_ics_escape(teacher)}',
+            f'X-STUDENT:{_ics_escape(student)}',
+        ]
+        if priority is not None:
+            lines.append(f'PRIORITY:{priority}')
+        lines.append('END:VEVENT')
+        handle.write(''.join(_fold(line) for line in lines))
+        count += 1
+    handle.write('END:VCALENDAR\r\n')
+    return count
+
+
+def _format_of(path, explicit):
+    if explicit:
+        return explicit
+    return 'ics' if path.lower().endswith('.ics') else 'csv'
+
+
+def _date_minutes(value):
+    return to_minutes(datetime.strptime(value, '%Y-%m-%d'))
+
+
+def build_parser(subparsers, common):
+    import_parser = subparsers.add_parser('import', parents=[common],
+                                          help='bulk import reservations from CSV or iCalendar')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=['csv', 'ics'])
+    import_parser.add_argument('--report', help='write rejected rows (line, reason) to this CSV file')
+    import_parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    import_parser.add_argument('--no-bump', action='store_true',
+                               help='reject rows that overlap lower priority reservations instead of replacing them')
+    import_parser.set_defaults(handler=run_import)
+
+    export_parser = subparsers.add_parser('export', parents=[common], help='export reservations to CSV or iCalendar')
+    export_parser.add_argument('path', help="output file, or '-' for stdout")
+    export_parser.add_argument('--format', choices=['csv', 'ics'])
+    export_parser.add_argument('--building')
+    export_parser.add_argument('--from', dest='start_from', type=_date_minutes, metavar='YYYY-MM-DD')
+    export_parser.add_argument('--to', dest='start_to', type=_date_minutes, metavar='YYYY-MM-DD',
+                               help='exclusive end date')
+    export_parser.add_argument('--include-archived', action='store_true',
+                               help='also export reservations moved to the archive')
+    export_parser.set_defaults(handler=run_export)
+
+
+def run_import(conn, args):
+    records = read_ics(args.path) if _format_of(args.path, args.format) == 'ics' else read_csv(args.path)
+    report = open(args.report, 'w', newline='', encoding='utf-8') if args.report else None
+    try:
+        if report is not None:
+            writer = csv.writer(report)
+            writer.writerow(['line', 'reason'])
+            reject = lambda line_no, reason: writer.writerow([line_no, reason])
+        else:
+            reject = lambda line_no, reason: print(f"{args.path}:{line_no}: {reason}", file=sys.stderr)
+        started = time.perf_counter()
+        imported, rejected = import_reservations(conn, records, reject, args.batch_size, bump=not args.no_bump)
+        elapsed = time.perf_counter() - started
+    finally:
+        if report is not None:
+            report.close()
+    total = imported + rejected
+    print(f"Imported {imported} of {total} rows ({rejected} rejected) in {elapsed:.2f}s, "
+          f"{total / elapsed if elapsed else 0:.0f} rows/sec.")
+    return 0 if rejected == 0 else 1
+
+
+def run_export(conn, args):
+    rows = iter_reservations(conn, args.building, args.start_from, args.start_to, args.include_archived)
+    write = write_ics if _format_of(args.path, args.format) == 'ics' else write_csv
+    started = time.perf_counter()
+    if args.path == '-':
+        count = write(sys.stdout, rows)
+    else:
+        with open(args.path, 'w', newline='', encoding='utf-8') as handle:
+            count = write(handle, rows)
+    elapsed = time.perf_counter() - started
+    print(f"Exported {count} rows in {elapsed:.2f}s, {count / elapsed if elapsed else 0:.0f} rows/sec.",
+          file=sys.stderr)
+    return 0
+
+
+def main(argv, prog='main.py'):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--db', default='rooms.db', help='path to the rooms database')
+    parser = argparse.ArgumentParser(prog=prog)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser(subparsers, common)
+    archive.build_parser(subparsers, common)
+    search.build_parser(subparsers, common)
+    utilization.build_parser(subparsers, common)
+    args = parser.parse_args(argv)
+    conn = schema.connect(args.db)
+    try:
+        return args.handler(conn, args)
+    finally:
+        conn.close()
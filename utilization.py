@@ -0,0 +1,520 @@
+import argparse
+import csv
+import json
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from recurrence import DAY, SERIES_COLUMNS, occurrences, series_from_row
+from schema import HOUR_BITS, HOUR_COLUMNS, HOURS_PER_COLUMN
+
+# Utilization is booked time over this many open hours per room and day.
+HOURS_PER_DAY = 10
+# The default report covers this many days up to today.
+DEFAULT_DAYS = 365
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+HOURS_PER_WEEK = 7 * 24
+PEAK_COUNT = 10
+
+_EPOCH = date(1970, 1, 1)
+
+# Each grouping: its output columns, and whether it describes rooms (True)
+# or days and priorities.
+GROUPS = {
+    'building': (('building',), True),
+    'floor': (('floor',), True),
+    'room': (('building', 'room'), True),
+    'day': (('day',), False),
+    'week': (('week',), False),
+    'month': (('month',), False),
+    'priority': (('priority',), False),
+}
+MEASURES = ('bookings', 'booked_hours', 'utilization')
+
+
+# Reservations are summarised by triggers (see schema._utilization_summary
+# and schema._weekly_usage) into room_daily_usage and room_weekly_usage for
+# reports and room_monthly_hours for heatmaps. Reports that group by nothing
+# finer than a week read whole weeks from the weekly table and only the days
+# of partial weeks at either end from the daily one. SQLite sums along an
+# index when a report groups only by rooms or only by time, and NumPy groups
+# the rows it returns, so reports of hundreds of thousands of rows never go
+# through Python row by row. Recurring series are expanded for the
+# requested range at query time.
+
+def day_number(value):
+    return (value - _EPOCH).days
+
+
+def day_date(day):
+    return _EPOCH + timedelta(days=day)
+
+
+def default_range(days=DEFAULT_DAYS, today=None):
+    # The last `days` days, today included, as [start_day, end_day).
+    end_day = day_number(today or date.today()) + 1
+    return end_day - days, end_day
+
+
+def week_of(day):
+    # Monday of the day's week; epoch day 0 was a Thursday.
+    return day - (day + 3) % 7
+
+
+def month_of(day):
+    value = day_date(day)
+    return value.year * 12 + value.month - 1
+
+
+def month_start(month):
+    return day_number(date(month // 12, month % 12 + 1, 1))
+
+
+def hour_label(hour_of_week):
+    weekday, hour = divmod(int(hour_of_week), 24)
+    return f"{WEEKDAYS[weekday]} {hour:02d}:00"
+
+
+def _series_intervals(conn, span_start, span_end, building_id=None):
+    # (room, start, end, priority) of series occurrences overlapping the span.
+    building_filter = 'AND room_id IN (SELECT id FROM rooms WHERE building_id = ?)' if building_id is not None else ''
+    params = [span_end] + ([building_id] if building_id is not None else [])
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT {", ".join(SERIES_COLUMNS)} FROM reservation_series WHERE start_minute < ? {building_filter}
+    ''', params)
+    series_rows = cursor.fetchall()
+    intervals = []
+    if series_rows:
+        exceptions = {}
+        cursor.execute(f'''
+            SELECT series_id, occurrence_start FROM series_exceptions
+            WHERE series_id IN ({','.join('?' * len(series_rows))})
+        ''', [row[0] for row in series_rows])
+        for series_id, start in cursor.fetchall():
+            exceptions.setdefault(series_id, []).append(start)
+        for row in series_rows:
+            series = series_from_row(row, exceptions.get(row[0], ()))
+            intervals.extend((series['room_id'], start, start + series['duration'], series['priority'] or 0)
+                             for start in occurrences(series, span_start, span_end))
+    return intervals
+
+
+def _split_days(intervals):
+    # The same split as the summary triggers: one row per interval and day it
+    # touches, as arrays of room, priority, day, start-day flag and the
+    # minutes taken of each hour (days x 24).
+    data = np.array(intervals, dtype=np.int64).reshape(-1, 4)
+    starts, ends = data[:, 1], data[:, 2]
+    spans = np.maximum(0, (ends - 1) // DAY - starts // DAY) + 1
+    index = np.repeat(np.arange(len(data)), spans)
+    offsets = np.arange(len(index)) - np.repeat(np.cumsum(spans) - spans, spans)
+    days = starts[index] // DAY + offsets
+    edges = days[:, None] * DAY + np.arange(25) * 60
+    hours = np.clip(np.minimum(ends[index, None], edges[:, 1:]) - np.maximum(starts[index, None], edges[:, :-1]),
+                    0, None)
+    return data[index, 0], data[index, 3], days, offsets == 0, hours
+
+
+def _series_usage(conn, start_day, end_day, building_id=None):
+    # Fill temp.series_usage, shaped like room_daily_usage, with the series
+    # occurrences in the range; returns False when there are none.
+    intervals = _series_intervals(conn, start_day * DAY, end_day * DAY, building_id)
+    if not intervals:
+        return False
+    rooms, priorities, days, first, hours = _split_days(intervals)
+    keep = (days >= start_day) & (days < end_day)
+    rows = np.column_stack([days, priorities, rooms, first, hours.sum(axis=1)])[keep]
+    cursor = conn.cursor()
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS series_usage AS SELECT * FROM room_daily_usage WHERE 0')
+    cursor.execute('DELETE FROM temp.series_usage')
+    cursor.executemany('INSERT INTO temp.series_usage (day, priority, room_id, bookings, booked_minutes) '
+                       'VALUES (?, ?, ?, ?, ?)', rows.tolist())
+    # Only the temp table was written; end the implicit transaction so this
+    # connection does not keep reading an old snapshot.
+    conn.commit()
+    return True
+
+
+def _period_days(name, key, start_day, end_day):
+    # Days of the range a day-describing group value covers.
+    if name == 'day':
+        first, last = key, key + 1
+    elif name == 'week':
+        first, last = key, key + 7
+    elif name == 'month':
+        first, last = month_start(key), month_start(key + 1)
+    else:
+        return end_day - start_day
+    return max(0, min(last, end_day) - max(first, start_day))
+
+
+def _format_label(name, value):
+    if name in ('day', 'week'):
+        return day_date(value).isoformat()
+    if name == 'month':
+        return f"{value // 12:04d}-{value % 12 + 1:02d}"
+    if name == 'priority':
+        return value or None
+    return value
+
+
+def _time_keys(name, days, priorities):
+    # Per-row values of a day-describing grouping, as _period_days takes them.
+    if name == 'day':
+        return days
+    if name == 'week':
+        return days - (days + 3) % 7
+    if name == 'month':
+        return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) + 1970 * 12
+    return priorities
+
+
+def _sort_key(values):
+    # SQL order: NULLs first.
+    return tuple((value is not None, value) for value in values)
+
+
+def _ranks(items):
+    # Rank of each item in sorted order, equal items sharing one.
+    order = sorted(range(len(items)), key=items.__getitem__)
+    ranks = np.zeros(len(items), dtype=np.int64)
+    for position in range(1, len(order)):
+        same = items[order[position]] == items[order[position - 1]]
+        ranks[order[position]] = ranks[order[position - 1]] + (not same)
+    return ranks
+
+
+def _round(values, digits):
+    # Python's round over an array. NumPy's scale-and-rint gives the same
+    # except near halves, where scaling can land on the wrong side (0.01875
+    # is just below one), so those few go through round itself.
+    scaled = values * 10.0 ** digits
+    rounded = np.rint(scaled) / 10.0 ** digits
+    near = np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)
+    rounded[near] = [round(value, digits) for value in values[near].tolist()]
+    return rounded.tolist()
+
+
+def _fetch_usage(conn, start_day, end_day, building_id, room_groups, other_groups):
+    # Summary rows of the range as an (n, 5) array of day, priority, room,
+    # bookings and booked minutes, summed by SQLite as far as the groupings
+    # allow; day, priority or room is 0 where they do not matter.
+    building_filter = 'AND room_id IN (SELECT id FROM rooms WHERE building_id = ?)' if building_id is not None else ''
+    building_params = [building_id] if building_id is not None else []
+    # (table, its day and priority columns, room index, first day, end day) to read.
+    sources = [('room_daily_usage', 'day', 'priority', 'idx_usage_room', start_day, end_day)]
+    first_week, end_week = week_of(start_day + 6), week_of(end_day)
+    if set(other_groups) <= {'week'} and first_week < end_week:
+        sources = [('room_daily_usage', 'day', 'priority', 'idx_usage_room', start_day, first_week),
+                   ('room_weekly_usage', 'week', '0', 'idx_weekly_usage_room', first_week, end_week),
+                   ('room_daily_usage', 'day', 'priority', 'idx_usage_room', end_week, end_day)]
+    if _series_usage(conn, start_day, end_day, building_id):
+        sources.append(('temp.series_usage', 'day', 'priority', None, start_day, end_day))
+    passes = []
+    params = []
+    for table, day, priority, index, first, last in sources:
+        if first >= last:
+            continue
+        # Summing in index order keeps SQLite from sorting the whole range;
+        # mixing room and time groupings gains nothing from it, as there is
+        # about one summary row per room and day to begin with.
+        if not room_groups:
+            columns, tail = f'{day}, {priority}, 0, SUM(bookings), SUM(booked_minutes)', 'GROUP BY 1, 2'
+        elif not other_groups:
+            columns, tail = '0, 0, room_id, SUM(bookings), SUM(booked_minutes)', 'GROUP BY room_id'
+            table += f' INDEXED BY {index}' if index else ''
+        else:
+            columns, tail = f'{day}, {priority}, room_id, bookings, booked_minutes', ''
+        passes.append(f'SELECT {columns} FROM {table} WHERE {day} >= ? AND {day} < ? {building_filter} {tail}')
+        params += [first, last] + building_params
+    if not passes:
+        return np.zeros((0, 5), dtype=np.int64)
+    return np.array(conn.execute(' UNION ALL '.join(passes), params).fetchall(), dtype=np.int64).reshape(-1, 5)
+
+
+def report(conn, start_day, end_day, group_by=('building',), building_id=None, hours_per_day=HOURS_PER_DAY):
+    """Bookings, booked hours and utilization over [start_day, end_day), grouped.
+
+    Returns (columns, rows). Days are epoch day numbers; `group_by` names
+    entries of GROUPS, outermost first. Rows are ordered by their labels.
+    """
+    for name in group_by:
+        if name not in GROUPS:
+            raise ValueError(f"unknown grouping {name!r}; choose from {', '.join(GROUPS)}")
+    room_groups = [name for name in group_by if GROUPS[name][1]]
+    other_groups = [name for name in group_by if not GROUPS[name][1]]
+    usage = _fetch_usage(conn, start_day, end_day, building_id, room_groups, other_groups)
+    days, priorities, room_ids, bookings, minutes = usage.T
+
+    building_filter = 'WHERE rooms.building_id = ?' if building_id is not None else ''
+    rooms = conn.execute(f'''
+        SELECT rooms.id, rooms.building_id, rooms.floor, buildings.name, rooms.name
+        FROM rooms LEFT JOIN buildings ON buildings.id = rooms.building_id
+        {building_filter}
+        ORDER BY rooms.id
+    ''', [building_id] if building_id is not None else []).fetchall()
+    columns = [column for name in group_by for column in GROUPS[name][0]] + list(MEASURES)
+    if room_groups:
+        # Like a join with rooms: summaries of rooms not in the list drop out.
+        known = np.array([room[0] for room in rooms], dtype=np.int64)
+        positions = np.minimum(np.searchsorted(known, room_ids), max(0, len(known) - 1))
+        found = known[positions] == room_ids if len(known) else np.zeros(len(room_ids), dtype=bool)
+        positions = positions[found]
+        days, priorities, bookings, minutes = days[found], priorities[found], bookings[found], minutes[found]
+    if group_by and not len(bookings):
+        return columns, []
+
+    # Each grouping numbers its values 0..n-1, and keeps the values, their
+    # labels, and the ranks the labels and the values sort in.
+    codes, values, labels, label_ranks, value_ranks, room_codes = [], [], [], [], [], []
+    for name in group_by:
+        if GROUPS[name][1]:
+            if name == 'building':
+                per_room = [(room[1], (room[3],)) for room in rooms]
+            elif name == 'floor':
+                per_room = [(room[2], (room[2],)) for room in rooms]
+            else:
+                per_room = [(room[0], (room[3], room[4])) for room in rooms]
+            numbering = {}
+            room_code = np.array([numbering.setdefault(value, len(numbering)) for value, _ in per_room],
+                                 dtype=np.int64)
+            group_values = list(numbering)
+            group_labels = [None] * len(group_values)
+            for value, label in per_room:
+                group_labels[numbering[value]] = label
+            room_codes.append(room_code)
+            codes.append(room_code[positions])
+        else:
+            unique, code = np.unique(_time_keys(name, days, priorities), return_inverse=True)
+            group_values = unique.tolist()
+            group_labels = [(_format_label(name, value),) for value in group_values]
+            codes.append(code.reshape(-1))
+        values.append(group_values)
+        labels.append(group_labels)
+        label_ranks.append(_ranks([_sort_key(label) for label in group_labels]))
+        value_ranks.append(_ranks([_sort_key((value,)) for value in group_values]))
+
+    if group_by:
+        sizes = [len(group_values) for group_values in values]
+        unique, inverse = np.unique(np.ravel_multi_index(codes, sizes), return_inverse=True)
+        inverse = inverse.reshape(-1)
+        group_bookings, group_minutes = [np.bincount(inverse, weights=column, minlength=len(unique)).astype(np.int64)
+                                         for column in (bookings, minutes)]
+        group_codes = np.unravel_index(unique, sizes)
+        # Labels first, then values, as an SQL ORDER BY over both would.
+        order = np.lexsort([ranks[group] for ranks, group in zip(value_ranks[::-1], group_codes[::-1])]
+                           + [ranks[group] for ranks, group in zip(label_ranks[::-1], group_codes[::-1])])
+        group_codes = [group[order] for group in group_codes]
+        group_bookings, group_minutes = group_bookings[order], group_minutes[order]
+    else:
+        group_codes = []
+        group_bookings, group_minutes = np.array([bookings.sum()]), np.array([minutes.sum()])
+
+    open_rooms = np.full(len(group_bookings), len(rooms), dtype=np.int64)
+    room_positions = [i for i, name in enumerate(group_by) if GROUPS[name][1]]
+    if room_positions:
+        room_sizes = [sizes[i] for i in room_positions]
+        counts = np.bincount(np.ravel_multi_index(room_codes, room_sizes), minlength=int(np.prod(room_sizes)))
+        open_rooms = counts[np.ravel_multi_index([group_codes[i] for i in room_positions], room_sizes)]
+    period_days = np.full(len(group_bookings), end_day - start_day, dtype=np.int64)
+    time_positions = [i for i, name in enumerate(group_by) if not GROUPS[name][1]]
+    if time_positions:
+        # Few distinct periods: work out the days of each once.
+        time_sizes = [sizes[i] for i in time_positions]
+        periods, period_index = np.unique(
+            np.ravel_multi_index([group_codes[i] for i in time_positions], time_sizes), return_inverse=True)
+        lengths = [min(_period_days(group_by[i], values[i][code], start_day, end_day)
+                       for i, code in zip(time_positions, period))
+                   for period in zip(*(part.tolist() for part in np.unravel_index(periods, time_sizes)))]
+        period_days = np.array(lengths, dtype=np.int64)[period_index.reshape(-1)]
+    available = open_rooms * period_days * hours_per_day * 60
+    with np.errstate(divide='ignore', invalid='ignore'):
+        utilization = _round(group_minutes / available, 4)
+    for i in np.flatnonzero(available == 0).tolist():
+        utilization[i] = None
+
+    results = []
+    for group_labels, group in zip(labels, group_codes):
+        for position in range(len(group_labels[0])):
+            column = np.empty(len(group_labels), dtype=object)
+            column[:] = [label[position] for label in group_labels]
+            results.append(column[group].tolist())
+    results += [group_bookings.tolist(), _round(group_minutes / 60, 2), utilization]
+    return columns, list(zip(*results))
+
+
+def heatmap(conn, start_day, end_day, building_id=None):
+    """Share of each hour of the week that every room was booked.
+
+    The heatmap covers the whole months the range touches. Returns
+    (rooms, heat, (first_day, end_day)): rooms as (room id, building, room)
+    rows sorted by building and name, heat as a rooms x 168 float array,
+    Monday 00:00 first, where 1.0 means booked for that whole hour every
+    week, and the days actually covered.
+    """
+    first_month, end_month = month_of(start_day), month_of(end_day - 1) + 1
+    first_day, last_day = month_start(first_month), month_start(end_month)
+    building_filter = 'WHERE rooms.building_id = ?' if building_id is not None else ''
+    params = [building_id] if building_id is not None else []
+    rooms = conn.execute(f'''
+        SELECT rooms.id, buildings.name, rooms.name
+        FROM rooms LEFT JOIN buildings ON buildings.id = rooms.building_id
+        {building_filter}
+        ORDER BY buildings.name, rooms.name, rooms.id
+    ''', params).fetchall()
+    row_of = {room[0]: i for i, room in enumerate(rooms)}
+    minutes = np.zeros((len(rooms), HOURS_PER_WEEK))
+
+    building_filter = 'AND room_id IN (SELECT id FROM rooms WHERE building_id = ?)' if building_id is not None else ''
+    # Summing packed columns as they are would let one hour's total carry
+    # into the next over enough months. Each column is summed twice instead,
+    # once with only its even hours and once with only its odd ones, so every
+    # hour has an empty field above it and may reach 2**(2 * HOUR_BITS) - 1
+    # minutes. HOUR_COLUMNS run weekday by weekday.
+    field_mask = (1 << HOUR_BITS) - 1
+    alternate = sum(field_mask << i * HOUR_BITS for i in range(0, HOURS_PER_COLUMN, 2))
+    sums = [f'SUM(({column} >> {parity * HOUR_BITS}) & {alternate})' for column in HOUR_COLUMNS for parity in (0, 1)]
+    rows = conn.execute(f'''
+        SELECT room_id, {", ".join(sums)}
+        FROM room_monthly_hours
+        WHERE month >= ? AND month < ? {building_filter}
+        GROUP BY room_id
+    ''', [first_month, end_month] + params).fetchall()
+    if rows:
+        data = np.array(rows, dtype=np.int64)
+        positions = np.array([row_of[room_id] for room_id in data[:, 0].tolist()], dtype=np.int64)
+        # (room, column, parity, pair) -> (room, column, pair, parity) puts hour 2 * pair + parity in order.
+        shifts = np.arange(HOURS_PER_COLUMN // 2) * 2 * HOUR_BITS
+        fields = (data[:, 1:, None] >> shifts) & ((1 << 2 * HOUR_BITS) - 1)
+        fields = fields.reshape(len(data), len(HOUR_COLUMNS), 2, -1).transpose(0, 1, 3, 2)
+        minutes[positions] += fields.reshape(len(data), HOURS_PER_WEEK)
+
+    intervals = _series_intervals(conn, first_day * DAY, last_day * DAY, building_id)
+    if intervals:
+        series_rooms, _, days, _, hours = _split_days(intervals)
+        keep = (days >= first_day) & (days < last_day)
+        positions = np.array([row_of.get(room_id, -1) for room_id in series_rooms[keep].tolist()], dtype=np.int64)
+        hour_of_week = ((days[keep] + 3) % 7 * 24)[:, None] + np.arange(24)
+        known = positions >= 0
+        np.add.at(minutes, (positions[known, None], hour_of_week[known]), hours[keep][known])
+
+    # Epoch day 0 was a Thursday.
+    weekdays = np.bincount((np.arange(first_day, last_day) + 3) % 7, minlength=7)
+    heat = minutes / (np.repeat(weekdays, 24) * 60)
+    return rooms, heat, (first_day, last_day)
+
+
+def peaks(heat, count=PEAK_COUNT):
+    """The busiest hours of the week across all rooms: (hour of week, mean share, rooms in use) rows."""
+    if not len(heat):
+        return []
+    mean = heat.mean(axis=0)
+    in_use = np.count_nonzero(heat, axis=0)
+    order = np.argsort(-mean, kind='stable')[:count]
+    return [(int(hour), float(mean[hour]), int(in_use[hour])) for hour in order if mean[hour] > 0]
+
+
+def room_peaks(heat):
+    """Each room's busiest hour of the week and its share."""
+    busiest = heat.argmax(axis=1) if len(heat) else np.zeros(0, dtype=np.int64)
+    return busiest, heat[np.arange(len(heat)), busiest]
+
+
+def _date_day(value):
+    return day_number(datetime.strptime(value, '%Y-%m-%d').date())
+
+
+def _groupings(value):
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in GROUPS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown grouping {unknown[0]!r}; choose from {', '.join(GROUPS)}")
+    return names
+
+
+def build_parser(subparsers, common):
+    usage_parser = subparsers.add_parser('utilization', parents=[common],
+                                         help='export room utilization by room, building, floor, week or priority')
+    usage_parser.add_argument('path', nargs='?', default='-', help="output file, or '-' (default) for stdout")
+    usage_parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+    usage_parser.add_argument('--from', dest='start_day', type=_date_day, metavar='YYYY-MM-DD',
+                              help=f"first day (default {DEFAULT_DAYS} days before --to)")
+    usage_parser.add_argument('--to', dest='end_day', type=_date_day, metavar='YYYY-MM-DD',
+                              help='exclusive end date (default tomorrow)')
+    usage_parser.add_argument('--building', help='only rooms of this building')
+    usage_parser.add_argument('--group-by', type=_groupings, default=['building'],
+                              help=f"comma-separated groupings from {', '.join(GROUPS)} (default building)")
+    usage_parser.add_argument('--hours-per-day', type=float, default=HOURS_PER_DAY,
+                              help=f"open hours per room and day that utilization is measured against "
+                                   f"(default {HOURS_PER_DAY})")
+    usage_parser.add_argument('--heatmap', action='store_true',
+                              help='export the percentage of each hour of the week booked, per room, '
+                                   'over the whole months the range touches')
+    usage_parser.set_defaults(handler=run_utilization)
+
+
+def _write(path, write):
+    if path == '-':
+        write(sys.stdout)
+    else:
+        with open(path, 'w', newline='', encoding='utf-8') as handle:
+            write(handle)
+
+
+def run_utilization(conn, args):
+    end_day = args.end_day if args.end_day is not None else default_range()[1]
+    start_day = args.start_day if args.start_day is not None else end_day - DEFAULT_DAYS
+    building_id = None
+    if args.building is not None:
+        row = conn.execute('SELECT id FROM buildings WHERE name = ?', (args.building,)).fetchone()
+        if row is None:
+            print(f"No building named {args.building!r}.", file=sys.stderr)
+            return 2
+        building_id = row[0]
+
+    started = time.perf_counter()
+    if args.heatmap:
+        rooms, heat, (start_day, end_day) = heatmap(conn, start_day, end_day, building_id)
+        busiest, share = room_peaks(heat)
+        # Whole percentages: plenty for a heatmap, and integers write far
+        # faster than formatted floats.
+        percent = np.rint(heat * 100).astype(np.int64).tolist()
+        if args.format == 'json':
+            document = {
+                'from': day_date(start_day).isoformat(), 'to': day_date(end_day).isoformat(),
+                'hours': [hour_label(hour) for hour in range(HOURS_PER_WEEK)],
+                'peaks': [{'hour': hour_label(hour), 'percent': round(mean * 100, 1), 'rooms': count}
+                          for hour, mean, count in peaks(heat)],
+                'rooms': [{'id': room_id, 'building': building, 'room': name, 'peak': hour_label(busiest[i]),
+                           'percent': percent[i]}
+                          for i, (room_id, building, name) in enumerate(rooms)],
+            }
+            _write(args.path, lambda handle: handle.write(json.dumps(document)))
+        else:
+            def write(handle):
+                writer = csv.writer(handle)
+                writer.writerow(['building', 'room', 'peak', 'peak_percent']
+                                + [hour_label(hour) for hour in range(HOURS_PER_WEEK)])
+                writer.writerows([building, name, hour_label(busiest[i]), round(share[i] * 100)] + percent[i]
+                                 for i, (_, building, name) in enumerate(rooms))
+            _write(args.path, write)
+        count = len(rooms)
+    else:
+        columns, rows = report(conn, start_day, end_day, args.group_by, building_id, args.hours_per_day)
+        if args.format == 'json':
+            document = [dict(zip(columns, row)) for row in rows]
+            _write(args.path, lambda handle: handle.write(json.dumps(document)))
+        else:
+            def write(handle):
+                writer = csv.writer(handle)
+                writer.writerow(columns)
+                writer.writerows(rows)
+            _write(args.path, write)
+        count = len(rows)
+    elapsed = time.perf_counter() - started
+    print(f"Exported {count} rows for {day_date(start_day)} to {day_date(end_day)} in {elapsed:.2f}s.",
+          file=sys.stderr)
+    return 0